@@ -4,14 +4,23 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-import requests
+import math
 import os
 import secrets
+import time
 import pythonextensions.send_email as SMTP
 import pythonextensions.blackjack as bj
 import pythonextensions.pathfinder as pf
+import pythonextensions.mapfetch as mapfetch
+import pythonextensions.jobs as jobs
+import pythonextensions.routeformat as routeformat
+import pythonextensions.memreport as memreport
+import pythonextensions.routestats as routestats
+import pythonextensions.routecache as routecache
+import pythonextensions.gridcache as gridcache
+import pythonextensions.migrations as migrations
 from pythonextensions.models import db, ClubLoginToken, Club, Race, Carpool, Reservation, Comment
-from PIL import Image
+from sqlalchemy.orm import joinedload, load_only, selectinload
 from io import BytesIO
 
 # import send_email_2 as SMTP2
@@ -19,7 +28,10 @@ from io import BytesIO
 load_dotenv('environ.env')
 app = Flask(__name__)
 CORS(app, resources={r"/beregn_ruter/*": {"origins": "https://steinthal.dk"}})
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///carpool.db'
+# DATABASE_URL (e.g. from environ.env) overrides the default instance/carpool.db
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///carpool.db')
+# Server-Timing and X-Route-Stats headers on route responses (stage durations, search counters, cache outcome)
+app.config['ROUTE_SERVER_TIMING'] = True
 # app.run(host="0.0.0.0", port=5000, debug=True)
 token_cleanup_counter = 0
 PASSWORD_ADMIN = os.getenv("PASSWORD_ADMIN")
@@ -32,10 +44,21 @@ app.secret_key = "your_secret_key_here123"  # Needed for flash messages and sess
 with app.app_context():
    
     db.create_all()
+    # indexes added to the models after the tables were created
+    migrations.upgrade(db.engine)
     
     
 
 
+# Loader options per page; relationships are lazy by default (see models.py).
+def _club_choices():
+    """Clubs for the dropdowns: id and name only."""
+    return Club.query.options(load_only(Club.id, Club.name)).all()
+
+# home.html lists every carpool with its reservations and comments
+CARPOOL_LIST_OPTIONS = (selectinload(Carpool.reservations), selectinload(Carpool.comments))
+
+
 def generate_token(club_id, hours_valid=24):
     token = secrets.token_urlsafe(32)  # cryptographically secure random token
     expires_at = datetime.utcnow() + timedelta(hours=hours_valid)
@@ -60,12 +83,12 @@ def home():
     
 
     if club_name:
-        active_carpools = Carpool.query.join(Club).filter(Club.name == club_name, Carpool.departure_time >= datetime.utcnow()).all()
+        active_carpools = Carpool.query.join(Club).options(*CARPOOL_LIST_OPTIONS).filter(Club.name == club_name, Carpool.departure_time >= datetime.utcnow()).all()
     else:
-        active_carpools = Carpool.query.filter(Carpool.departure_time >= datetime.utcnow(), Carpool.club_level==0).all()
+        active_carpools = Carpool.query.options(*CARPOOL_LIST_OPTIONS).filter(Carpool.departure_time >= datetime.utcnow(), Carpool.club_level==0).all()
 
     # Get all clubs for the dropdown
-    clubs = Club.query.all()
+    clubs = _club_choices()
 
     return render_template('home.html', carpools=active_carpools, clubs=clubs, latitude=latitude, longitude=longitude, selected_club=club_name, is_club_page=is_club_page)
 
@@ -73,7 +96,7 @@ def home():
 # Route to show login page
 @app.route("/club-login", methods=["GET", "POST"])
 def club_login():
-    clubs = Club.query.all()  # Get all clubs for the dropdown
+    clubs = _club_choices()  # Get all clubs for the dropdown
 
     if request.method == "POST":
         club_id = request.form.get("club_id")
@@ -141,7 +164,7 @@ def club_login_token(token):
     race_id = request.args.get("race_id")  # e.g. /?race_id=14 or any path you want
     extra_param = request.args.get("extra")  # optional, just an example
 
-    login_token = ClubLoginToken.query.filter_by(token=token, used=False).first()
+    login_token = ClubLoginToken.query.options(joinedload(ClubLoginToken.club)).filter_by(token=token, used=False).first()
 
     if not login_token:
         flash("Invalid or already used token.", "danger")
@@ -187,7 +210,7 @@ def club_dashboard():
     print ("klubbens id er", session["club_name"])
     
     # Filter carpools for this club only
-    active_carpools = Carpool.query.filter(
+    active_carpools = Carpool.query.options(*CARPOOL_LIST_OPTIONS).filter(
         Carpool.club_id == club.id,
         Carpool.departure_time >= datetime.utcnow()
     ).all()
@@ -201,7 +224,7 @@ def club_dashboard():
         longitude = 12.5683
 
     # Get all clubs for dropdown (optional, could hide in dashboard)
-    clubs = Club.query.all()
+    clubs = _club_choices()
 
 
   
@@ -279,10 +302,10 @@ def admin():
             db.session.add(new_club)
             db.session.commit()
     
-    # Finally, render the admin page
-    Clubs = Club.query.all()
-    Races = Race.query.all()
-    Carpools = Carpool.query.all()
+    # Finally, render the admin page (the tables only need a few columns; carpools are just counted per race)
+    Clubs = Club.query.options(load_only(Club.id, Club.name, Club.description, Club.password)).all()
+    Races = Race.query.options(load_only(Race.id, Race.name, Race.description, Race.date, Race.club_id)).all()
+    Carpools = Carpool.query.options(load_only(Carpool.id, Carpool.race_id)).all()
     races_by_club = {}
     carpools_by_races = {}
     for race in Races:
@@ -292,7 +315,6 @@ def admin():
         carpools_by_races.setdefault(carpool.race_id, []).append(carpool)
 
     clubs_dict = {club.id: club for club in Clubs}
-    Carpools = Carpool.query.all()
     return render_template("admin.html", clubs=Clubs, races=Races, carpool=Carpools, clubs_dict = clubs_dict, races_by_club=races_by_club, carpools_by_races=carpools_by_races )
 
     
@@ -327,12 +349,12 @@ def home_klubber():
     club_name = request.args.get('club', None)
 
     if club_name:
-        active_carpools = Carpool.query.join(Club).filter(Club.name == club_name, Carpool.departure_time >= datetime.utcnow()).all(),Carpool.club_level == 1
+        active_carpools = Carpool.query.join(Club).options(*CARPOOL_LIST_OPTIONS).filter(Club.name == club_name, Carpool.departure_time >= datetime.utcnow()).all(),Carpool.club_level == 1
     else:
-        active_carpools = Carpool.query.filter(Carpool.departure_time >= datetime.utcnow(),Carpool.club_level==1).all()
+        active_carpools = Carpool.query.options(*CARPOOL_LIST_OPTIONS).filter(Carpool.departure_time >= datetime.utcnow(),Carpool.club_level==1).all()
 
     # Get all clubs for the dropdown
-    clubs = Club.query.all()
+    clubs = _club_choices()
 
     return render_template('home.html', carpools=active_carpools, clubs=clubs, latitude=latitude, longitude=longitude, selected_club=club_name, is_club_page=True)
 
@@ -343,7 +365,10 @@ def carpool_locations():
     club_name = request.args.get('club', None)
     race_id = request.args.get('race_id', type=int)  # optional race filter
 
-    query = Carpool.query.filter(Carpool.departure_time >= datetime.utcnow())
+    query = Carpool.query.options(load_only(
+        Carpool.id, Carpool.club_level, Carpool.event, Carpool.owner, Carpool.departure_place,
+        Carpool.departure_time, Carpool.vacant_seats, Carpool.latitude, Carpool.longitude, Carpool.race_id,
+    )).filter(Carpool.departure_time >= datetime.utcnow())
 
     if club_name:
         query = query.filter(Club.name == club_name)
@@ -374,7 +399,10 @@ def carpool_locations():
 @app.route('/api/race-details')
 def race_details():
 
-    query = Race.query.filter(Race.date >= datetime.utcnow())
+    # each race lists a few fields of its carpools; one extra IN query loads them for all races
+    query = Race.query.options(selectinload(Race.carpools).load_only(
+        Carpool.id, Carpool.race_id, Carpool.owner, Carpool.vacant_seats, Carpool.departure_place,
+    )).filter(Race.date >= datetime.utcnow())
 
     races = query.all()
     race_list = []
@@ -600,30 +628,327 @@ def play_blackjack():
         return redirect("./static/plot.png")
         
 
+class RouteRequestError(Exception):
+    """Bad route request or failed computation; carries the HTTP status to answer with."""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+MAX_ROUTES = 5
+
+def _parse_xy(text, name):
+    """"x,y" -> (x, y) ints, or RouteRequestError."""
+    try:
+        point = tuple(map(int, text.split(",")))
+    except ValueError:
+        point = ()
+    if len(point) != 2:
+        raise RouteRequestError(f"{name} must be x,y")
+    return point
+
+def _route_args(args):
+    """Parse /beregn_ruter query parameters into (img_url, keyword arguments for pf.main)."""
+    img_url = args.get("url")
+    start = args.get("start")
+    goal = args.get("goal")
+
+    if not img_url or not start or not goal:
+        raise RouteRequestError("Missing parameters")
+
+    # parsed here; whether they lie on the map is checked by pf.main once the map is loaded
+    start = _parse_xy(start, "start")
+    goal = _parse_xy(goal, "goal")
+    # field=1: answer from a cached distance field rooted at goal (cheap for repeat goals)
+    use_field = args.get("field", "0").lower() in ("1", "true", "yes")
+    # incremental=1: first route from a planner kept per (map, goal), cheap when only the start moved
+    use_incremental = args.get("incremental", "0").lower() in ("1", "true", "yes")
+    # k=<1..5>: number of diverse routes. Only route 1 comes from the field or the incremental
+    # planner; every alternative is another full search, so these modes answer one route unless k is given
+    k = args.get("k", default=1 if use_field or use_incremental else 3, type=int)
+    if not 1 <= k <= MAX_ROUTES:
+        raise RouteRequestError(f"k must be between 1 and {MAX_ROUTES}")
+    # pyramid=1: coarse-to-fine search for large maps
+    use_pyramid = args.get("pyramid", "0").lower() in ("1", "true", "yes")
+    # landmarks=<n>: A* with n cached landmark distance fields as heuristic (0 = off)
+    landmarks = args.get("landmarks", default=0, type=int)
+    if not 0 <= landmarks <= 16:
+        raise RouteRequestError("landmarks must be between 0 and 16")
+    # parallel=1: search alternative routes on a process pool; budget=<seconds> caps the search
+    use_parallel = args.get("parallel", "0").lower() in ("1", "true", "yes")
+    budget = args.get("budget", type=float)
+    return img_url, dict(start=start, goal=goal, k=k, field=use_field, pyramid=use_pyramid, landmarks=landmarks,
+                         incremental=use_incremental,
+                         parallel=use_parallel, time_budget=budget, **_output_args(args))
+
+
+def _output_args(args):
+    """Simplification and rendering options shared by the route endpoints."""
+    # simplify=los|rdp|none, epsilon=<pixels> for rdp
+    simplify = args.get("simplify")
+    if simplify not in (None, "los", "rdp", "none"):
+        raise RouteRequestError("simplify must be one of los, rdp, none")
+    epsilon = args.get("epsilon", default=pf.SIMPLIFY_EPSILON, type=float)
+    # format=png|webp|jpeg, quality=1..100, scale=<0..1] for a preview, viewport=x0,y0,x1,y1
+    # format=json|geojson|polyline returns the routes as data; bounds=north,west,south,east for lat/lng
+    image_format = args.get("format", "png").lower()
+    if image_format not in pf.IMAGE_FORMATS and image_format not in routeformat.VECTOR_FORMATS:
+        raise RouteRequestError("format must be one of " + ", ".join([*pf.IMAGE_FORMATS, *routeformat.VECTOR_FORMATS]))
+    bounds = args.get("bounds")
+    if bounds:
+        try:
+            bounds = tuple(map(float, bounds.split(",")))
+        except ValueError:
+            bounds = ()
+        if len(bounds) != 4 or not all(map(math.isfinite, bounds)):
+            raise RouteRequestError("bounds must be north,west,south,east")
+        north, west, south, east = bounds
+        if north <= south or east <= west:
+            raise RouteRequestError("bounds must have north > south and east > west")
+    quality = args.get("quality", default=85, type=int)
+    if not 1 <= quality <= 100:
+        raise RouteRequestError("quality must be between 1 and 100")
+    scale = args.get("scale", default=1.0, type=float)
+    if not 0 < scale <= 1:
+        raise RouteRequestError("scale must be in (0, 1]")
+    viewport = args.get("viewport")
+    if viewport:
+        # fits-the-map is checked by pf.check_viewport once the map is loaded
+        try:
+            viewport = tuple(map(int, viewport.split(",")))
+        except ValueError:
+            viewport = ()
+        if len(viewport) != 4 or min(viewport[:2]) < 0 or viewport[2] <= viewport[0] or viewport[3] <= viewport[1]:
+            raise RouteRequestError("viewport must be x0,y0,x1,y1 with x1 > x0 >= 0 and y1 > y0 >= 0")
+    # memreport=1: X-Route-Memory header with the request's array sizes; memreport=trace adds a tracemalloc peak
+    report = args.get("memreport")
+    if report not in (None, "0", "1", "trace"):
+        raise RouteRequestError("memreport must be 1 or trace")
+
+    return dict(simplify=simplify, simplify_epsilon=epsilon,
+                viewport=viewport, scale=scale, image_format=image_format, quality=quality,
+                bounds=bounds or None, memreport=None if report == "0" else report)
+
+
+def _start_memory_report(options):
+    """Pop the memreport option; returns a started MemoryReport or None."""
+    mode = options.pop("memreport", None)
+    if not mode:
+        return None
+    return memreport.MemoryReport(trace=mode == "trace").start()
+
+
+def _report_headers(report):
+    return {"X-Route-Memory": report.header()} if report is not None else {}
+
+
+def _stats_headers(stats):
+    if not app.config.get("ROUTE_SERVER_TIMING"):
+        return {}
+    return {"Server-Timing": stats.server_timing(), "X-Route-Stats": stats.header()}
+
+
+def _parse_points(text):
+    """"x1,y1;x2,y2;..." -> [(x1, y1), (x2, y2), ...]"""
+    return [tuple(map(int, p.split(","))) for p in text.split(";") if p]
+
+
+def _batch_args(args, body):
+    """
+    Parse a /beregn_ruter/batch request into (img_url, keyword arguments for pf.route_legs).
+    url, points or legs come from the JSON body or the query string:
+      points=x,y;x,y;...          ordered controls, one leg between each consecutive pair
+      legs=x,y,x,y;x,y,x,y;...    independent (start, goal) legs
+    """
+    if not isinstance(body, dict):
+        raise RouteRequestError("body must be a JSON object")
+    img_url = body.get("url") or args.get("url")
+    points = body.get("points")
+    legs = body.get("legs")
+    try:
+        if points is None and args.get("points"):
+            points = _parse_points(args["points"])
+        if legs is None and args.get("legs"):
+            legs = [(q[:2], q[2:]) for q in (tuple(map(int, l.split(","))) for l in args["legs"].split(";") if l)]
+        if legs is not None:
+            legs = [(tuple(map(int, a)), tuple(map(int, b))) for a, b in legs]
+        if points is not None:
+            points = [tuple(map(int, p)) for p in points]
+        if any(len(p) != 2 for p in (points or []) + [q for leg in legs or [] for q in leg]):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise RouteRequestError("points must be [x, y] pairs, legs [[x, y], [x, y]] pairs")
+    if not img_url or (points is None and legs is None):
+        raise RouteRequestError("Missing parameters")
+    if legs is None and len(points) < 2:
+        raise RouteRequestError("Need at least two points")
+    if len(legs if legs is not None else points[1:]) > pf.MAX_LEGS:
+        raise RouteRequestError(f"At most {pf.MAX_LEGS} legs per batch")
+    use_field = args.get("field", "0").lower() in ("1", "true", "yes")
+    return img_url, dict(points=points, legs=legs, field=use_field, **_output_args(args))
+
+
+def _fetch_map(img_url):
+    # Fetch external image (pooled, size-limited, revalidated against the local map cache);
+    # everything below stays in memory so concurrent requests can't clash
+    try:
+        return mapfetch.default_fetcher.fetch(img_url)
+    except mapfetch.MapTooLarge as e:
+        raise RouteRequestError(str(e), 413)
+    except mapfetch.MapFetchError as e:
+        raise RouteRequestError(f"Could not fetch map: {e}", 502)
+
+
+def _output_mimetype(fmt):
+    if fmt in routeformat.VECTOR_FORMATS:
+        return routeformat.VECTOR_FORMATS[fmt]
+    return pf.IMAGE_FORMATS[fmt][1]
+
+
+def _compute_routes(img_url, options, should_stop=None):
+    """
+    Fetch the map and run pf.main in memory, or answer from routecache.default_cache
+    when the same map content was already routed with the same options.
+    Returns (image or route data bytes, mimetype, extra response headers).
+    """
+    options = dict(options)
+    report = _start_memory_report(options)
+    stats = routestats.RouteStats()
+    t0 = time.perf_counter()
+
+    def compute():
+        try:
+            results, body = pf.main(fetched, return_image=True, should_stop=should_stop,
+                                    memory_report=report, route_stats=stats, **options)
+        except ValueError as e:
+            raise RouteRequestError(str(e))
+        except mapfetch.MapFetchError as e:
+            # the cached map body was pruned before it was read and could not be refetched
+            raise RouteRequestError(f"Could not fetch map: {e}", 502)
+        if results is None:
+            raise RouteRequestError("No route found", 422)
+        # fewer than k routes within a time budget: another request may have time for more
+        partial = options["time_budget"] is not None and len(results) < options["k"]
+        return routecache.CachedRoute(results, body, _output_mimetype(options["image_format"]),
+                                      counters=dict(stats.counters),
+                                      ttl=routecache.PARTIAL_TTL if partial else None)
+
+    try:
+        with stats.stage("fetch"):
+            fetched = _fetch_map(img_url)
+        stats.cache["map"] = "hit" if fetched.from_cache else "miss"
+        if report is not None:
+            # a memory report describes a computation, so never answer it from the cache
+            entry = compute()
+        else:
+            key = routecache.route_key(
+                gridcache.grid_key(fetched.content_hash, pf.COLOR_COST_MAP, pf.COLOR_MATCH_THRESHOLD), options)
+            entry, stats.cache["route"] = routecache.default_cache.get_or_compute(
+                key, compute, retry=(pf.RouteCancelled,))
+            if stats.cache["route"] != "miss":
+                # nothing was searched here; report the counters of the computation that produced the entry
+                stats.counters = dict(entry.counters)
+    finally:
+        if report is not None:
+            report.stop()
+    stats.total = time.perf_counter() - t0
+    headers = _report_headers(report)
+    if stats.counters.get("expanded") and stats.cache.get("route", "miss") == "miss":
+        headers["X-Route-Expanded"] = str(stats.counters["expanded"])
+    headers.update(_stats_headers(stats))
+    return entry.body, entry.mimetype, headers
+
+
 @app.route("/beregn_ruter", methods = ["GET"])
 def get_routes():
-    
-    img_url = request.args.get("url")
-    start = request.args.get("start")
-    goal = request.args.get("goal")
+    try:
+        img_url, options = _route_args(request.args)
+        body, mimetype, headers = _compute_routes(img_url, options)
+    except RouteRequestError as e:
+        return str(e), e.status
 
-    if not img_url or not start or not goal:
-        return "Missing parameters", 400
-
-    start = tuple(map(int, start.split(",")))
-    goal = tuple(map(int, goal.split(",")))
-
-    # Fetch external image
-    response = requests.get(img_url)
-    im = Image.open(BytesIO(response.content))
-    im.save("./pythonextensions/static/map.png")
-    # Process the image (your function)
-    pf.main("./pythonextensions/static/map.png", start=start, goal=goal)  # modify pf.main to accept PIL image
-    # or save to BytesIO if pf.main returns nothing
-    processed_im = "./static/path_result.png"
-    
     # Return image directly
-    return send_file(processed_im, mimetype="image/png")
-        
+    response = send_file(BytesIO(body), mimetype=mimetype)
+    response.headers.update(headers)
+    return response
+
+
+@app.route("/beregn_ruter/batch", methods = ["GET", "POST"])
+def get_route_batch():
+    """All legs of a course on one map: one fetch, one cost grid, one image (or vector document)."""
+    try:
+        img_url, options = _batch_args(request.args, request.get_json(silent=True) or {})
+        report = _start_memory_report(options)
+        try:
+            fetched = _fetch_map(img_url)
+            results, body = pf.route_legs(fetched, return_image=True, memory_report=report, **options)
+        except ValueError as e:
+            raise RouteRequestError(str(e))
+        except mapfetch.MapFetchError as e:
+            raise RouteRequestError(f"Could not fetch map: {e}", 502)
+        finally:
+            if report is not None:
+                report.stop()
+        if results is None:
+            raise RouteRequestError("No route found for at least one leg", 422)
+    except RouteRequestError as e:
+        return str(e), e.status
+
+    response = send_file(BytesIO(body), mimetype=_output_mimetype(options["image_format"]))
+    # leg costs for image responses; vector formats carry them in the body
+    response.headers["X-Route-Costs"] = ",".join(f"{r['cost']:.2f}" for r in results)
+    response.headers["X-Route-Total-Cost"] = f"{sum(r['cost'] for r in results):.2f}"
+    response.headers.update(_report_headers(report))
+    return response
+
+
+# Background variant: submit returns a job id at once, clients poll for the result.
+route_jobs = jobs.JobQueue(workers=2, max_pending=16, timeout=120)
+
+@app.route("/beregn_ruter/jobs", methods = ["GET", "POST"])
+def submit_route_job():
+    params = request.values
+    try:
+        img_url, options = _route_args(params)
+    except RouteRequestError as e:
+        return jsonify({"error": str(e)}), e.status
+    key = (img_url, tuple(sorted(options.items())))
+    try:
+        job = route_jobs.submit(key, _compute_routes, img_url, options)
+    except jobs.QueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    body = job.to_dict()
+    body["status_url"] = url_for("route_job_status", job_id=job.id)
+    return jsonify(body), 202
+
+@app.route("/beregn_ruter/jobs/<job_id>", methods = ["GET", "DELETE"])
+def route_job_status(job_id):
+    if request.method == "DELETE":
+        job = route_jobs.cancel(job_id)
+    else:
+        job = route_jobs.get(job_id)
+        # wait=<seconds>: long-poll until the job finishes (capped at 30s)
+        wait = min(request.args.get("wait", default=0, type=float), 30)
+        if job is not None and wait > 0:
+            job.wait(wait)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    body = job.to_dict()
+    if job.status == jobs.DONE:
+        body["result_url"] = url_for("route_job_result", job_id=job.id)
+    return jsonify(body)
+
+@app.route("/beregn_ruter/jobs/<job_id>/result")
+def route_job_result(job_id):
+    job = route_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    if job.status != jobs.DONE:
+        return jsonify(job.to_dict()), 409
+    body, mimetype, headers = job.result
+    response = send_file(BytesIO(body), mimetype=mimetype)
+    response.headers.update(headers)
+    return response
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
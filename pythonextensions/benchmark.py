@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+benchmark.py
+Stage-by-stage timings of the route pipeline, for comparing changes to pathfinder/overlap.
+Usage:
+  python -m pythonextensions.benchmark [--sizes 256,512,1024] [--densities 0.1,0.25]
+         [--backends python,vectorized,cpp] [--maps map.png ...] [--repeat 3]
+         [--format json|csv] [--out results.json]
+
+Each fixture (a synthetic palette map, or a real map) is run through the same
+steps as main(): decode, cost grid, k routes with penalties in between, a
+disjoint-mode mask, simplification and drawing. Every step is timed on its own
+(best and median of --repeat runs) and written as one row per stage.
+"""
+import argparse
+import contextlib
+import csv
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+from io import BytesIO, StringIO
+
+import numpy as np
+from PIL import Image
+
+import pythonextensions.overlap as ov
+import pythonextensions.pathfinder as pf
+
+DEFAULT_SIZES = (256, 512, 1024)
+DEFAULT_DENSITIES = (0.1, 0.25)
+DEFAULT_REPEAT = 3
+DEFAULT_ROUTES = 3
+BACKENDS = ("python", "vectorized", "cpp")
+# the reference build_cost_grid/a_star loop over every pixel in Python; larger maps are skipped for them
+PYTHON_MAX_PIXELS = 512 * 512
+# share of pixels whose color is jittered off the palette, like the anti-aliasing of a scan
+NOISE = 0.01
+# penalty and mask settings main() uses for the k-routes loop
+PENALTY = pf.RouteOptions.penalty
+RADIUS = pf.RouteOptions.radius
+DECAY = pf.RouteOptions.decay
+DEFAULT_MAP = os.path.join(os.path.dirname(__file__), "static", "map.png")
+
+FIELDS = ("fixture", "width", "height", "density", "backend", "stage", "call",
+          "best", "median", "repeat", "cost", "expanded")
+
+
+# -------------------------
+# Fixtures
+# -------------------------
+def synthetic_map(size, density, seed=0):
+    """
+    PNG bytes of a size x size map in COLOR_COST_MAP colors: patches of passable
+    terrain with random impassable rectangles covering about density of the area.
+    The corners holding start (2,2) and goal (size-3,size-3) are kept clear.
+    Same size/density/seed -> same bytes.
+    """
+    rng = np.random.default_rng(seed)
+    passable = np.array([c for c, v in pf.COLOR_COST_MAP.items() if math.isfinite(v)], dtype=np.uint8)
+    walls = np.array([c for c, v in pf.COLOR_COST_MAP.items() if not math.isfinite(v)], dtype=np.uint8)
+    patch = 16
+    n = -(-size // patch)
+    terrain = rng.integers(len(passable), size=(n, n))
+    rgb = passable[np.repeat(np.repeat(terrain, patch, axis=0), patch, axis=1)[:size, :size]]
+
+    blocked = np.zeros((size, size), dtype=bool)
+    lo, hi = max(1, size // 64), max(2, size // 8)
+    while blocked.mean() < density:
+        rh, rw = rng.integers(lo, hi, size=2)
+        y, x = rng.integers(0, size - rh), rng.integers(0, size - rw)
+        blocked[y:y + rh, x:x + rw] = True
+        rgb[y:y + rh, x:x + rw] = walls[rng.integers(len(walls))]
+    clear = max(4, size // 32)
+    for y, x in ((0, 0), (size - clear, size - clear)):
+        cell = terrain[0, 0] if (y, x) == (0, 0) else terrain[-1, -1]
+        rgb[y:y + clear, x:x + clear] = passable[cell]
+
+    noisy = rng.random((size, size)) < NOISE
+    jitter = rng.integers(-8, 9, size=(int(noisy.sum()), 3))
+    rgb[noisy] = np.clip(rgb[noisy].astype(np.int16) + jitter, 0, 255).astype(np.uint8)
+
+    buf = BytesIO()
+    Image.fromarray(rgb, "RGB").save(buf, format="PNG")
+    return buf.getvalue()
+
+def _passable_near(cost_grid, x, y):
+    """The passable cell closest to (x, y)."""
+    ys, xs = np.nonzero(np.isfinite(cost_grid))
+    if len(xs) == 0:
+        raise ValueError("Map has no passable cells")
+    i = int(np.argmin((xs - x) ** 2 + (ys - y) ** 2))
+    return int(xs[i]), int(ys[i])
+
+def fixtures(sizes=DEFAULT_SIZES, densities=DEFAULT_DENSITIES, maps=(), seed=0):
+    """Benchmark inputs as dicts with name, data (PNG bytes), density, start, goal."""
+    out = []
+    for size in sizes:
+        for density in densities:
+            out.append({"name": f"synthetic-{size}-{density:g}", "data": synthetic_map(size, density, seed),
+                        "density": density, "start": (2, 2), "goal": (size - 3, size - 3)})
+    for path in maps:
+        with open(path, "rb") as f:
+            data = f.read()
+        grid = pf.build_cost_grid_vectorized(Image.open(BytesIO(data)), pf.COLOR_COST_MAP, pf.COLOR_MATCH_THRESHOLD)
+        h, w = grid.shape
+        # opposite corners, 5% in from the edges
+        start = _passable_near(grid, w // 20, h // 20)
+        goal = _passable_near(grid, w - 1 - w // 20, h - 1 - h // 20)
+        out.append({"name": os.path.basename(path), "data": data, "density": None, "start": start, "goal": goal})
+    return out
+
+
+# -------------------------
+# Backends
+# -------------------------
+def _python_search(grid, start, goal, stats):
+    path, cost = pf.a_star(grid, start, goal, pf.DIAGONAL_MOVEMENT)
+    return pf.as_path_array(path), cost
+
+def _array_search(grid, start, goal, stats):
+    path, cost = pf.a_star_array(grid, start, goal, pf.DIAGONAL_MOVEMENT, stats=stats)
+    return pf.as_path_array(path), cost
+
+def _cpp_search(grid, start, goal, stats):
+    return pf.a_star_cpp(grid, start, goal, pf.DIAGONAL_MOVEMENT)
+
+def _python_build(im):
+    return pf.build_cost_grid(im, pf.COLOR_COST_MAP, threshold=pf.COLOR_MATCH_THRESHOLD)
+
+def _vectorized_build(im):
+    # what the server does without the C++ builder: terrain codes, then the float32 grid
+    codes, lut = pf.build_terrain_codes(im, pf.COLOR_COST_MAP, threshold=pf.COLOR_MATCH_THRESHOLD)
+    return pf.cost_grid_from_codes(codes, lut)
+
+
+def _reference_penalize(grid, path, base_penalty, radius, decay):
+    """The original per-pixel penalty loop, kept as the baseline for overlap.PenaltyOverlay."""
+    H, W = grid.shape
+    penalized = grid.copy()
+    for x, y in path.tolist():
+        for dy in range(-radius, radius + 1):
+            for dx in range(-radius, radius + 1):
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < W and 0 <= ny < H:
+                    d = math.hypot(dx, dy)
+                    if d <= radius and math.isfinite(penalized[ny, nx]):
+                        penalized[ny, nx] += base_penalty * (decay ** d)
+    return penalized
+
+def _reference_mask(grid, path, radius):
+    """The original per-pixel mask loop (baseline for overlap.MaskOverlay), same kept discs around the endpoints."""
+    H, W = grid.shape
+    masked = grid.copy()
+    ends = [tuple(path[0]), tuple(path[-1])]
+    for x, y in path.tolist():
+        for dy in range(-radius, radius + 1):
+            for dx in range(-radius, radius + 1):
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < W and 0 <= ny < H:
+                    if any(math.hypot(nx - ex, ny - ey) <= radius + 1 for ex, ey in ends):
+                        continue
+                    masked[ny, nx] = math.inf
+    return masked
+
+
+class _Steps:
+    """The pipeline pieces one backend uses."""
+
+    def __init__(self, backend):
+        self.reference = backend == "python"
+        self.build = _python_build if self.reference else _vectorized_build
+        self.search = {"python": _python_search, "vectorized": _array_search, "cpp": _cpp_search}[backend]
+
+    def penalize(self, grid, paths, work):
+        if self.reference:
+            for path in paths:
+                grid = _reference_penalize(grid, path, PENALTY, RADIUS, DECAY)
+            return grid
+        return ov.PenaltyOverlay(grid.shape, base_penalty=PENALTY, radius=RADIUS, decay=DECAY).sync(paths).apply(grid, out=work)
+
+    def mask(self, grid, path, work):
+        if self.reference:
+            return _reference_mask(grid, path, RADIUS)
+        return ov.MaskOverlay(grid.shape, RADIUS).sync([path]).apply(grid, keep=(path[0], path[-1]), out=work)
+
+    def simplify(self, path, grid, blocked):
+        if self.reference:
+            return pf.simplify_path([tuple(p) for p in path.tolist()], grid)
+        return pf.simplify_path_fast(path, blocked=blocked)
+
+
+# -------------------------
+# Running
+# -------------------------
+def _timed(fn, repeat):
+    """Run fn() repeat times. Returns (last result, list of seconds)."""
+    times = []
+    result = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return result, times
+
+def run_fixture(fixture, backend, repeat=DEFAULT_REPEAT, routes=DEFAULT_ROUTES):
+    """Time every stage of one fixture on one backend. Returns a list of row dicts (see FIELDS)."""
+    steps = _Steps(backend)
+    data, start, goal = fixture["data"], fixture["start"], fixture["goal"]
+    rows = []
+    shape = {}
+
+    def record(stage, times, call=None, **extra):
+        row = dict.fromkeys(FIELDS)
+        row.update(fixture=fixture["name"], density=fixture["density"], backend=backend, stage=stage,
+                   call=call, best=round(min(times), 6), median=round(statistics.median(times), 6),
+                   repeat=len(times), **shape)
+        row.update(extra)
+        rows.append(row)
+
+    im, times = _timed(lambda: Image.open(BytesIO(data)).convert("RGB"), repeat)
+    shape.update(width=im.width, height=im.height)
+    record("decode", times)
+    grid, times = _timed(lambda: steps.build(im), repeat)
+    record("build_cost_grid", times)
+
+    work = np.empty_like(grid)
+    search_grid = grid
+    paths, results = [], []
+    for k in range(routes):
+        if paths:
+            search_grid, times = _timed(lambda: steps.penalize(grid, paths, work), repeat)
+            record("penalize", times, call=k)
+        stats = {}
+
+        def search():
+            stats["expanded"] = 0
+            return steps.search(search_grid, start, goal, stats)
+        (path, cost), times = _timed(search, repeat)
+        record("astar", times, call=k + 1, cost=None if path is None else round(float(cost), 3),
+               expanded=stats.get("expanded") or None)
+        if path is None:
+            break
+        paths.append(path)
+        results.append({"path": path, "cost": cost})
+    if not paths:
+        return rows
+
+    _, times = _timed(lambda: steps.mask(grid, paths[0], work), repeat)
+    record("mask", times)
+    blocked = ~np.isfinite(grid)
+    simplified, times = _timed(lambda: [steps.simplify(p, grid, blocked) for p in paths], repeat)
+    record("simplify", times)
+    drawn = [dict(r, path=s) for r, s in zip(results, simplified)]
+    _, times = _timed(lambda: pf.draw_path_on_image(im, drawn, outpath=None), repeat)
+    record("draw", times)
+    return rows
+
+def run(fixture_list, backends=BACKENDS, repeat=DEFAULT_REPEAT, routes=DEFAULT_ROUTES, log=sys.stderr):
+    """run_fixture() for every fixture and backend, skipping what cannot run here."""
+    rows = []
+    for fixture in fixture_list:
+        for backend in backends:
+            if backend == "cpp" and not pf._HAS_CPP:
+                print(f"skip {fixture['name']}/cpp: pathfinder_cpp is not installed", file=log)
+                continue
+            if backend == "python":
+                w, h = Image.open(BytesIO(fixture["data"])).size
+                if w * h > PYTHON_MAX_PIXELS:
+                    print(f"skip {fixture['name']}/python: {w}x{h} is above PYTHON_MAX_PIXELS", file=log)
+                    continue
+            print(f"running {fixture['name']}/{backend}", file=log)
+            # the pipeline prints progress; keep stdout for the results
+            with contextlib.redirect_stdout(log):
+                rows.extend(run_fixture(fixture, backend, repeat, routes))
+    return rows
+
+def environment():
+    """Metadata stored with the results, so runs on different machines are not mixed up."""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "cpp": pf._HAS_CPP,
+    }
+
+def write_results(rows, fmt="json", out=None):
+    """Serialize rows as "json" ({"environment", "results"}) or "csv" (one row per stage). Returns str."""
+    if fmt == "json":
+        text = json.dumps({"environment": environment(), "results": rows}, indent=1)
+    elif fmt == "csv":
+        buf = StringIO()
+        writer = csv.DictWriter(buf, fieldnames=FIELDS, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+        text = buf.getvalue()
+    else:
+        raise ValueError("fmt must be 'json' or 'csv'")
+    if out is not None:
+        with open(out, "w", newline="") as f:
+            f.write(text)
+    return text
+
+
+def _csv_list(convert):
+    return lambda s: [convert(v) for v in s.split(",") if v]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the route pipeline stage by stage.")
+    parser.add_argument("--sizes", type=_csv_list(int), default=list(DEFAULT_SIZES),
+                        help="synthetic map sizes in pixels (comma separated; empty for none)")
+    parser.add_argument("--densities", type=_csv_list(float), default=list(DEFAULT_DENSITIES),
+                        help="share of impassable area in the synthetic maps")
+    parser.add_argument("--maps", nargs="*", default=[DEFAULT_MAP] if os.path.exists(DEFAULT_MAP) else [],
+                        help="real map images to include (default: the bundled map; pass no paths for none)")
+    parser.add_argument("--backends", type=_csv_list(str), default=list(BACKENDS))
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--routes", type=int, default=DEFAULT_ROUTES, help="routes per fixture (k)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--out", help="write here instead of stdout")
+    args = parser.parse_args(argv)
+    unknown = set(args.backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backend(s): {', '.join(sorted(unknown))}")
+
+    rows = run(fixtures(args.sizes, args.densities, args.maps, args.seed), args.backends, args.repeat, args.routes)
+    text = write_results(rows, args.format, args.out)
+    if args.out is None:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
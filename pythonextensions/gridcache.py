@@ -0,0 +1,147 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ---- Content-addressed cost grid cache ---------------------------------
+# Grids are keyed by the hash of the raw map bytes plus a fingerprint of the
+# palette/threshold used to build them, so the same event map is only decoded
+# and converted once. Hot grids stay in memory (LRU with a byte budget); every
+# grid is also written to disk as .npy and re-opened with mmap_mode='r', so
+# several worker processes share the same page-cache pages. The disk tier has
+# its own byte budget: files are touched when loaded, and a put that exceeds
+# the budget removes the least recently used ones.
+
+DEFAULT_CACHE_DIR = "./pythonextensions/cache/grids"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+
+
+def content_hash(data):
+    """sha256 hex digest of raw image bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+def palette_fingerprint(color_cost_map, threshold):
+    """Short digest of the color->cost mapping and match threshold."""
+    items = sorted((tuple(int(c) for c in rgb), float(cost)) for rgb, cost in color_cost_map.items())
+    return hashlib.sha256(repr((items, threshold)).encode()).hexdigest()[:16]
+
+def grid_key(image_hash, color_cost_map, threshold):
+    """Cache key for the cost grid of one map under one palette configuration."""
+    return f"{image_hash}-{palette_fingerprint(color_cost_map, threshold)}"
+
+
+class GridCache:
+    """
+    Two-tier cache for per-map arrays (the cost grid and anything derived from it).
+
+    get/put take a key (see grid_key) and an optional name, so derived arrays
+    can be stored next to the grid they belong to, e.g. name="grid".
+    Returned arrays are read-only; copy before modifying.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._mem = OrderedDict()   # (key, name) -> ndarray
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key, name):
+        return os.path.join(self.cache_dir, f"{key}.{name}.npy")
+
+    def _remember(self, slot, arr):
+        # caller holds the lock
+        if slot in self._mem:
+            self._bytes -= self._mem.pop(slot).nbytes
+        if arr.nbytes > self.max_bytes:
+            return
+        self._mem[slot] = arr
+        self._bytes += arr.nbytes
+        while self._bytes > self.max_bytes:
+            _, old = self._mem.popitem(last=False)
+            self._bytes -= old.nbytes
+
+    def get(self, key, name="grid"):
+        """Return the cached array or None. Memory first, then the mmap'ed .npy file."""
+        slot = (key, name)
+        with self._lock:
+            arr = self._mem.get(slot)
+            if arr is not None:
+                self._mem.move_to_end(slot)
+                self.hits += 1
+                return arr
+        path = self._path(key, name)
+        try:
+            arr = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)      # recently used, for _prune_disk
+        except OSError:
+            pass
+        with self._lock:
+            self._remember(slot, arr)
+            self.hits += 1
+        return arr
+
+    def put(self, key, arr, name="grid", persist=True):
+        """Store an array in memory and (by default) on disk. Returns the read-only array."""
+        arr = np.ascontiguousarray(arr)
+        arr.setflags(write=False)
+        if persist:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key, name)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, path)   # atomic, concurrent writers just race to the same content
+            self._prune_disk(keep=path)
+        with self._lock:
+            self._remember((key, name), arr)
+        return arr
+
+    def _prune_disk(self, keep=None):
+        """Remove the least recently used .npy files until the disk tier fits max_disk_bytes."""
+        files = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith(".npy") and e.path != keep:
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, e.path, st.st_size))
+        total = sum(size for _, _, size in files)
+        if keep is not None:
+            total += os.path.getsize(keep)
+        files.sort()
+        for _, path, size in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                # a process that has the file mmap'ed keeps its pages; on Windows the remove fails
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear_memory(self):
+        with self._lock:
+            self._mem.clear()
+            self._bytes = 0
+
+    @property
+    def memory_bytes(self):
+        return self._bytes
+
+
+default_cache = GridCache()
@@ -0,0 +1,242 @@
+import heapq
+import math
+import numpy as np
+
+import pythonextensions.pathfinder as pf
+
+# ---- Hierarchical path-finding (HPA*) ---------------------------------
+# The cost grid is cut into square clusters. Wherever two neighbouring
+# clusters share a passable stretch of border we place transition nodes,
+# and inside every cluster we precompute the shortest distance between its
+# transition nodes. That abstract graph is built once per map (and cached
+# next to the cost grid); a query then only searches the small graph and
+# runs a full-resolution A* restricted to the clusters it passes through.
+
+DEFAULT_CLUSTER_SIZE = 32
+# Entrances shorter than this get one transition in the middle, longer ones one at each end
+MAX_SINGLE_TRANSITION = 6
+
+
+def _border_runs(passable):
+    """[(first, last)] index runs of True values in a 1D bool array."""
+    padded = np.concatenate(([False], passable, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return [(int(a), int(b) - 1) for a, b in zip(edges[::2], edges[1::2])]
+
+def _transition_offsets(first, last):
+    if last - first + 1 < MAX_SINGLE_TRANSITION:
+        return [(first + last) // 2]
+    return [first, last]
+
+def _find_transitions(cost_grid, cluster_size):
+    """Pairs ((x1,y1), (x2,y2), cost) of adjacent passable cells on cluster borders."""
+    h, w = cost_grid.shape
+    finite = np.isfinite(cost_grid)
+    C = cluster_size
+    pairs = []
+    # vertical borders: column x0-1 | x0
+    for x0 in range(C, w, C):
+        for y0 in range(0, h, C):
+            y1 = min(y0 + C, h)
+            both = finite[y0:y1, x0 - 1] & finite[y0:y1, x0]
+            for first, last in _border_runs(both):
+                for off in _transition_offsets(first, last):
+                    y = y0 + off
+                    cost = (cost_grid[y, x0 - 1] + cost_grid[y, x0]) / 2.0
+                    pairs.append(((x0 - 1, y), (x0, y), float(cost)))
+    # horizontal borders: row y0-1 / y0
+    for y0 in range(C, h, C):
+        for x0 in range(0, w, C):
+            x1 = min(x0 + C, w)
+            both = finite[y0 - 1, x0:x1] & finite[y0, x0:x1]
+            for first, last in _border_runs(both):
+                for off in _transition_offsets(first, last):
+                    x = x0 + off
+                    cost = (cost_grid[y0 - 1, x] + cost_grid[y0, x]) / 2.0
+                    pairs.append(((x, y0 - 1), (x, y0), float(cost)))
+    return pairs
+
+
+class AbstractGraph:
+    """
+    Abstract HPA* graph for one cost grid.
+
+    nodes: (M,2) int32 array of (x,y) transition cells
+    edges: (E,3) float64 array of (u, v, cost), undirected
+    """
+
+    def __init__(self, cost_grid, nodes, edges, cluster_size=DEFAULT_CLUSTER_SIZE, diagonal=True):
+        self.cost_grid = cost_grid
+        self.nodes = nodes
+        self.edges = edges
+        self.cluster_size = cluster_size
+        self.diagonal = diagonal
+        self.adj = [[] for _ in range(len(nodes))]
+        for u, v, c in edges.tolist():
+            self.adj[int(u)].append((int(v), c))
+            self.adj[int(v)].append((int(u), c))
+        self.by_cluster = {}
+        for i, (x, y) in enumerate(nodes.tolist()):
+            self.by_cluster.setdefault(self._cluster_of(x, y), []).append(i)
+
+    def _cluster_of(self, x, y):
+        return x // self.cluster_size, y // self.cluster_size
+
+    def _cluster_bounds(self, cluster):
+        C = self.cluster_size
+        h, w = self.cost_grid.shape
+        cx, cy = cluster
+        return cx * C, cy * C, min((cx + 1) * C, w), min((cy + 1) * C, h)
+
+    # --- precomputation ---------------------------------------------------
+    @classmethod
+    def build(cls, cost_grid, cluster_size=DEFAULT_CLUSTER_SIZE, diagonal=True):
+        """Find transitions and intra-cluster distances for the whole grid."""
+        ids = {}
+        edges = []
+        for a, b, cost in _find_transitions(cost_grid, cluster_size):
+            ia = ids.setdefault(a, len(ids))
+            ib = ids.setdefault(b, len(ids))
+            edges.append((ia, ib, cost))
+        nodes = np.array(list(ids.keys()), dtype=np.int32).reshape(-1, 2)
+        graph = cls(cost_grid, nodes, np.zeros((0, 3)), cluster_size, diagonal)
+
+        for cluster, members in graph.by_cluster.items():
+            coords = [tuple(graph.nodes[m].tolist()) for m in members]
+            for si in range(len(members) - 1):
+                dists = graph._cluster_distances(cluster, coords[si], coords[si + 1:])
+                for tj, d in enumerate(dists):
+                    if math.isfinite(d):
+                        edges.append((members[si], members[si + 1 + tj], d))
+        return cls(cost_grid, nodes, np.array(edges, dtype=np.float64).reshape(-1, 3), cluster_size, diagonal)
+
+    def _cluster_distances(self, cluster, source, targets):
+        """In-cluster shortest costs from source (x,y) to each target (x,y); inf if unreachable."""
+        if not targets:
+            return []
+        x0, y0, x1, y1 = self._cluster_bounds(cluster)
+        sub = self.cost_grid[y0:y1, x0:x1]
+        local = [(x - x0, y - y0) for x, y in targets]
+        dist, _ = pf.dijkstra(sub, (source[0] - x0, source[1] - y0), self.diagonal, targets=local)
+        return [float(dist[y, x]) for x, y in local]
+
+    # --- persistence ---------------------------------------------------------
+    @classmethod
+    def load_or_build(cls, cost_grid, key=None, cache=None, cluster_size=DEFAULT_CLUSTER_SIZE, diagonal=True):
+        """Abstract graph for a cost grid, stored in / read from the grid cache under key."""
+        name = f"hpa{cluster_size}{'d' if diagonal else ''}"
+        if cache is not None and key is not None:
+            nodes = cache.get(key, name=f"{name}_nodes")
+            edges = cache.get(key, name=f"{name}_edges")
+            if nodes is not None and edges is not None:
+                return cls(cost_grid, nodes, edges, cluster_size, diagonal)
+        graph = cls.build(cost_grid, cluster_size, diagonal)
+        if cache is not None and key is not None:
+            cache.put(key, graph.nodes, name=f"{name}_nodes")
+            cache.put(key, graph.edges, name=f"{name}_edges")
+        return graph
+
+    # --- queries -------------------------------------------------------------
+    def _abstract_search(self, start, goal):
+        """A* over the abstract graph with start/goal temporarily inserted. Returns waypoint coords or None."""
+        m = len(self.nodes)
+        s_id, g_id = m, m + 1
+        coords = lambda i: start if i == s_id else goal if i == g_id else tuple(self.nodes[i])
+        s_cluster = self._cluster_of(*start)
+        g_cluster = self._cluster_of(*goal)
+        s_members = self.by_cluster.get(s_cluster, [])
+        g_members = self.by_cluster.get(g_cluster, [])
+        s_targets = [tuple(self.nodes[j].tolist()) for j in s_members]
+        if s_cluster == g_cluster:
+            s_members = s_members + [g_id]
+            s_targets = s_targets + [goal]
+        s_dists = self._cluster_distances(s_cluster, start, s_targets)
+        s_edges = [(j, d) for j, d in zip(s_members, s_dists) if math.isfinite(d)]
+        g_dists = self._cluster_distances(g_cluster, goal, [tuple(self.nodes[j].tolist()) for j in g_members])
+        g_edges = {j: d for j, d in zip(g_members, g_dists) if math.isfinite(d)}
+
+        gx, gy = goal
+        def h(i):
+            x, y = coords(i)
+            return math.hypot(gx - x, gy - y)
+
+        gscore = {s_id: 0.0}
+        came_from = {s_id: None}
+        open_set = [(h(s_id), 0.0, s_id)]
+        closed = set()
+        while open_set:
+            f, g, cur = heapq.heappop(open_set)
+            if cur in closed:
+                continue
+            if cur == g_id:
+                path = []
+                while cur is not None:
+                    path.append(cur)
+                    cur = came_from[cur]
+                return [coords(i) for i in reversed(path)]
+            closed.add(cur)
+            if cur == s_id:
+                out = s_edges
+            else:
+                out = list(self.adj[cur])
+                if cur in g_edges:
+                    out.append((g_id, g_edges[cur]))
+            for nb, c in out:
+                ng = g + c
+                if ng < gscore.get(nb, math.inf):
+                    gscore[nb] = ng
+                    came_from[nb] = cur
+                    heapq.heappush(open_set, (ng + h(nb), ng, nb))
+        return None
+
+    def _corridor_search(self, waypoints, start, goal, margin):
+        """Full-resolution A* restricted to the clusters the abstract path visits (plus margin rings)."""
+        h, w = self.cost_grid.shape
+        C = self.cluster_size
+        clusters = set()
+        for x, y in waypoints:
+            cx, cy = self._cluster_of(x, y)
+            for dy in range(-margin, margin + 1):
+                for dx in range(-margin, margin + 1):
+                    clusters.add((cx + dx, cy + dy))
+        x0 = max(0, min(cx for cx, _ in clusters) * C)
+        y0 = max(0, min(cy for _, cy in clusters) * C)
+        x1 = min(w, (max(cx for cx, _ in clusters) + 1) * C)
+        y1 = min(h, (max(cy for _, cy in clusters) + 1) * C)
+        sub = np.full((y1 - y0, x1 - x0), np.inf)
+        for cx, cy in clusters:
+            bx0, by0 = max(cx * C, x0), max(cy * C, y0)
+            bx1, by1 = min((cx + 1) * C, x1), min((cy + 1) * C, y1)
+            if bx0 < bx1 and by0 < by1:
+                sub[by0 - y0:by1 - y0, bx0 - x0:bx1 - x0] = self.cost_grid[by0:by1, bx0:bx1]
+        path, cost = pf.a_star_array(sub, (start[0] - x0, start[1] - y0), (goal[0] - x0, goal[1] - y0), self.diagonal)
+        if path is None:
+            return None, math.inf
+        return pf.as_path_array(path) + np.array([x0, y0], dtype=np.int32), cost
+
+    def find_path(self, start, goal, exact=False, margin=0):
+        """
+        Route from start to goal. Returns (path as (N,2) int array or None, cost).
+
+        By default the route is the optimal path inside the corridor of clusters
+        on the abstract path (near-optimal overall). exact=True additionally runs
+        a full-grid A* bounded by the corridor cost, which returns the true optimum.
+        """
+        start = (int(start[0]), int(start[1]))
+        goal = (int(goal[0]), int(goal[1]))
+        if not math.isfinite(self.cost_grid[start[1], start[0]]):
+            raise ValueError("Start is impassable")
+        if not math.isfinite(self.cost_grid[goal[1], goal[0]]):
+            raise ValueError("Goal is impassable")
+
+        waypoints = self._abstract_search(start, goal)
+        path, cost = None, math.inf
+        if waypoints is not None:
+            path, cost = self._corridor_search(waypoints, start, goal, margin)
+        if exact or path is None:
+            # full search; a corridor result (if any) bounds the work
+            full, full_cost = pf.a_star_array(self.cost_grid, start, goal, self.diagonal,
+                                              max_cost=cost if path is not None else None)
+            if full is not None and full_cost <= cost:
+                path, cost = pf.as_path_array(full), full_cost
+        return path, cost
@@ -0,0 +1,305 @@
+import heapq
+import math
+import threading
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+import pythonextensions.pathfinder as pf
+
+# ---- Incremental replanning (D* Lite) -----------------------------------
+# Users nudge the start a few pixels and resubmit; the k-routes loop changes
+# the costs near each accepted route. A planner searches backwards from the
+# goal and keeps its g/rhs values between queries, so a moved start or a
+# changed set of cell costs only re-expands the nodes whose distance to the
+# goal is affected (Koenig & Likhachev, D* Lite). Planners live in sessions
+# keyed by (map, goal); the number of live sessions and the bytes they hold
+# are bounded and the least recently used one is dropped first.
+#
+# Nodes use the padded column-major ids of pathfinder.a_star_array and the
+# same move costs, so routes cost exactly what a fresh A* would find. Costs
+# are kept in the grid's dtype (float32 for cached grids) and the base costs
+# are a view of the grid itself; only g and rhs need float64 per cell.
+#
+# Cost changes are cheap to repair when they are local. The penalty overlay
+# of a k-routes iteration runs along the whole previous route, though, and
+# its repair re-expands more nodes than a fresh search would, so main() only
+# uses planners for the first route and keeps fresh A* for alternatives.
+
+DEFAULT_MAX_SESSIONS = 4
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+class IncrementalPlanner:
+    """
+    D* Lite state for one cost grid and one goal.
+
+    plan(start) returns the optimal route from start; set_costs()/apply_overlay()
+    change cell costs, which are repaired on the next plan(). cost_grid is referenced,
+    not copied, and must not be modified while the planner is in use. Not thread-safe;
+    sessions hand out a lock with each planner.
+    """
+
+    def __init__(self, cost_grid, goal, diagonal=True):
+        h, w = cost_grid.shape
+        gx, gy = int(goal[0]), int(goal[1])
+        if not math.isfinite(cost_grid[gy, gx]):
+            raise ValueError("Goal is impassable")
+        self.shape = (h, w)
+        self.goal = (gx, gy)
+        self.diagonal = diagonal
+        costs, stride = pf._padded_costs(cost_grid)
+        self.stride = stride
+        self.costs = costs                      # current costs (base + overlay), padded
+        self.base = np.asarray(cost_grid).reshape(-1)   # costs without overlay, row-major view
+        self.offsets = pf._neighbor_offsets(stride, diagonal)
+        n = len(self.costs)
+        self.g = array("d", [math.inf]) * n
+        self.rhs = array("d", [math.inf]) * n
+        self.open = {}          # node -> key it is queued with
+        self.heap = []          # (k1, k2, node), stale entries skipped on pop
+        self.km = 0.0
+        self.last = None        # start of the previous plan()
+        self.goal_id = (gx + 1) * stride + (gy + 1)
+        self.rhs[self.goal_id] = 0.0
+        self.pending = set()    # nodes whose cost changed since the last plan()
+        self.overlaid = np.zeros(0, dtype=np.int64)
+        self.expanded = 0
+
+    def copy(self):
+        """Independent planner with the same state (e.g. to add overlays without touching a session)."""
+        other = object.__new__(IncrementalPlanner)
+        other.__dict__.update(self.__dict__)
+        for name in ("costs", "g", "rhs"):
+            a = getattr(self, name)
+            setattr(other, name, array(a.typecode, a))
+        other.open = dict(self.open)
+        other.heap = list(self.heap)
+        other.pending = set(self.pending)
+        return other
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by this planner (per-cell arrays and the open list)."""
+        cells = sum(a.itemsize * len(a) for a in (self.costs, self.g, self.rhs))
+        return cells + 100 * len(self.open) + 80 * len(self.heap) + self.overlaid.nbytes
+
+    def _node(self, x, y):
+        return (x + 1) * self.stride + (y + 1)
+
+    def _h(self, a, b):
+        ax, ay = divmod(a, self.stride)
+        bx, by = divmod(b, self.stride)
+        return math.hypot(ax - bx, ay - by)
+
+    def _key(self, u, start):
+        m = min(self.g[u], self.rhs[u])
+        return m + self._h(start, u) + self.km, m
+
+    def _update(self, u, start):
+        g, rhs, costs = self.g, self.rhs, self.costs
+        if u != self.goal_id:
+            c_u = costs[u]
+            best = math.inf
+            if math.isfinite(c_u):
+                for off, step_len in self.offsets:
+                    s = u + off
+                    c_s = costs[s]
+                    if math.isfinite(c_s):
+                        v = g[s] + (c_u + c_s) / 2.0 * step_len
+                        if v < best:
+                            best = v
+            rhs[u] = best
+        if g[u] != rhs[u]:
+            key = self._key(u, start)
+            self.open[u] = key
+            heapq.heappush(self.heap, (key[0], key[1], u))
+        else:
+            self.open.pop(u, None)
+
+    def _compute(self, start):
+        g, rhs, costs, open_, heap = self.g, self.rhs, self.costs, self.open, self.heap
+        offsets, stride, goal_id = self.offsets, self.stride, self.goal_id
+        sx, sy = divmod(start, stride)
+        hypot, isfinite = math.hypot, math.isfinite
+        heappop, heappush = heapq.heappop, heapq.heappush
+        while heap:
+            k1, k2, u = heap[0]
+            if open_.get(u) != (k1, k2):
+                heappop(heap)       # stale
+                continue
+            m = min(g[start], rhs[start])
+            if (k1, k2) >= (m + self.km, m) and rhs[start] == g[start]:
+                break
+            heappop(heap)
+            new_key = self._key(u, start)
+            if (k1, k2) < new_key:
+                open_[u] = new_key
+                heappush(heap, (new_key[0], new_key[1], u))
+                continue
+            del open_[u]
+            self.expanded += 1
+            if g[u] > rhs[u]:
+                # overconsistent: u is settled, it can only lower its neighbours' rhs
+                g_u = g[u] = rhs[u]
+                c_u = costs[u]
+                km = self.km
+                for off, step_len in offsets:
+                    s = u + off
+                    c_s = costs[s]
+                    if s == goal_id or not isfinite(c_s):
+                        continue
+                    v = g_u + (c_u + c_s) / 2.0 * step_len
+                    if v < rhs[s]:
+                        rhs[s] = v
+                        if g[s] != v:
+                            x, y = divmod(s, stride)
+                            m = v if v < g[s] else g[s]
+                            key = (m + hypot(sx - x, sy - y) + km, m)
+                            open_[s] = key
+                            heappush(heap, (key[0], key[1], s))
+                        else:
+                            open_.pop(s, None)
+            else:
+                # underconsistent: u got more expensive, recompute it and its neighbours
+                g[u] = math.inf
+                self._update(u, start)
+                for off, _ in offsets:
+                    s = u + off
+                    if isfinite(costs[s]):
+                        self._update(s, start)
+
+    def set_costs(self, idx, values):
+        """Set the cost of cells idx (row-major flat indices) to values (stored in the grid's dtype)."""
+        h, w = self.shape
+        idx = np.asarray(idx, dtype=np.int64).reshape(-1)
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), idx.shape)
+        nodes = ((idx % w + 1) * self.stride + (idx // w + 1)).tolist()
+        for u, v in zip(nodes, values.tolist()):
+            old = self.costs[u]
+            self.costs[u] = v
+            if self.costs[u] != old:
+                self.pending.add(u)
+
+    def apply_overlay(self, idx, values):
+        """
+        Overlay costs: cells idx get values, cells overlaid by the previous call but not
+        by this one go back to their base cost. Cells not listed keep their base cost.
+        """
+        idx = np.asarray(idx, dtype=np.int64).reshape(-1)
+        revert = np.setdiff1d(self.overlaid, idx, assume_unique=True)
+        if len(revert):
+            self.set_costs(revert, self.base[revert])
+        self.set_costs(idx, values)
+        self.overlaid = np.unique(idx)
+
+    def plan(self, start):
+        """Optimal route from start to the goal. Returns (path as (N,2) int array or None, cost)."""
+        sx, sy = int(start[0]), int(start[1])
+        h, w = self.shape
+        if not (0 <= sx < w and 0 <= sy < h) or not math.isfinite(self.costs[self._node(sx, sy)]):
+            raise ValueError("Start is impassable")
+        s_id = self._node(sx, sy)
+        if self.last is None:
+            key = self._key(self.goal_id, s_id)
+            self.open[self.goal_id] = key
+            heapq.heappush(self.heap, (key[0], key[1], self.goal_id))
+        elif self.last != s_id:
+            self.km += self._h(self.last, s_id)
+        self.last = s_id
+
+        if self.pending:
+            for u in self.pending:
+                self._update(u, s_id)
+                for off, _ in self.offsets:
+                    if math.isfinite(self.costs[u + off]) or self.g[u + off] != math.inf:
+                        self._update(u + off, s_id)
+            self.pending.clear()
+        self._compute(s_id)
+        return self._path(s_id)
+
+    def _path(self, s_id):
+        g, costs = self.g, self.costs
+        if not math.isfinite(g[s_id]):
+            return None, math.inf
+        cost = g[s_id]
+        nodes = [s_id]
+        cur = s_id
+        for _ in range(len(g)):
+            if cur == self.goal_id:
+                break
+            c_cur = costs[cur]
+            best, best_s = math.inf, None
+            for off, step_len in self.offsets:
+                s = cur + off
+                c_s = costs[s]
+                if math.isfinite(c_s):
+                    v = g[s] + (c_cur + c_s) / 2.0 * step_len
+                    if v < best:
+                        best, best_s = v, s
+            if best_s is None:
+                return None, math.inf
+            nodes.append(best_s)
+            cur = best_s
+        else:
+            return None, math.inf
+        ids = np.array(nodes, dtype=np.int64)
+        return np.stack([ids // self.stride - 1, ids % self.stride - 1], axis=1).astype(np.int32), cost
+
+
+class _Session:
+    def __init__(self, planner):
+        self.planner = planner
+        self.lock = threading.Lock()
+
+
+class PlannerSessions:
+    """
+    Bounded LRU of planners keyed by e.g. (map key, goal, diagonal).
+    Use the returned session's lock around every call on its planner.
+
+    max_sessions: number of planners kept
+    max_bytes: memory budget over all planners (see IncrementalPlanner.nbytes);
+               the session just asked for is kept even if it alone exceeds it
+    """
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """The session for key, creating its planner with factory() if there is none."""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                self._evict()
+                return session
+        session = _Session(factory())
+        with self._lock:
+            session = self._sessions.setdefault(key, session)
+            self._sessions.move_to_end(key)
+            self._evict()
+        return session
+
+    def _evict(self):
+        # caller holds the lock; planners grow while they search, so this runs on every get
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        total = sum(s.planner.nbytes for s in self._sessions.values())
+        while total > self.max_bytes and len(self._sessions) > 1:
+            _, dropped = self._sessions.popitem(last=False)
+            total -= dropped.planner.nbytes
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+
+default_sessions = PlannerSessions()
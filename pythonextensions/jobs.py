@@ -0,0 +1,182 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# ---- Background route jobs ---------------------------------------------
+# Long route computations run on a small worker pool instead of inside the
+# request thread. Submitting returns a job right away; clients poll (or
+# long-poll) its status and fetch the result when it is done. Identical
+# in-flight requests share one job, and the number of queued jobs is capped
+# so a burst is refused early instead of piling up.
+#
+# Python threads cannot be killed: a timed-out or cancelled job is marked as
+# such immediately, and the work function is asked to stop through
+# should_stop(), which it checks between stages. Its key stays reserved until
+# the worker has actually returned; an identical job submitted meanwhile
+# waits for that before it starts, so one key never computes twice at once.
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED, TIMEOUT = "queued", "running", "done", "failed", "cancelled", "timeout"
+FINISHED = (DONE, FAILED, CANCELLED, TIMEOUT)
+
+
+class QueueFull(Exception):
+    """Too many jobs are waiting; try again later."""
+
+
+class Job:
+    def __init__(self, key, timeout):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.timeout = timeout
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.after = None       # job with the same key whose worker has to exit first
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._exited = threading.Event()
+
+    def should_stop(self):
+        """True once the job was cancelled or ran past its timeout."""
+        if self.started is not None and self.timeout is not None and time.time() - self.started > self.timeout:
+            return True
+        return self._cancel.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished (or timeout seconds passed). Returns True if finished."""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        d = {"job_id": self.id, "status": self.status, "created": self.created,
+             "started": self.started, "finished": self.finished}
+        if self.error:
+            d["error"] = self.error
+        return d
+
+
+class JobQueue:
+    def __init__(self, workers=2, max_pending=16, timeout=120, keep_finished=600):
+        """
+        workers: jobs running at the same time
+        max_pending: queued (not yet running) jobs before submit raises QueueFull
+        timeout: seconds a job may run
+        keep_finished: seconds finished jobs (and their results) stay retrievable
+        """
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.keep_finished = keep_finished
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="route-job")
+        self._jobs = {}         # id -> Job
+        self._inflight = {}     # key -> Job (queued, running, or finished with its worker still running)
+        self._lock = threading.Lock()
+
+    def _purge(self):
+        # caller holds the lock
+        cutoff = time.time() - self.keep_finished
+        for job_id in [j.id for j in self._jobs.values() if j.finished is not None and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _finish(self, job, status, result=None, error=None):
+        with self._lock:
+            if job.status in FINISHED:
+                return
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+        job._done.set()
+
+    def _release(self, job):
+        """The job's worker is done with it (or will never run it): free its key."""
+        with self._lock:
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+        job._exited.set()
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            if job.after is not None:
+                job.after._exited.wait()
+            self._execute(job, fn, args, kwargs)
+        finally:
+            self._release(job)
+
+    def _execute(self, job, fn, args, kwargs):
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            job.status = RUNNING
+            job.started = time.time()
+        if job.timeout is not None:
+            timer = threading.Timer(job.timeout, self._finish, (job, TIMEOUT, None, f"timed out after {job.timeout}s"))
+            timer.daemon = True
+            timer.start()
+        else:
+            timer = None
+        try:
+            result = fn(*args, should_stop=job.should_stop, **kwargs)
+        except Exception as e:
+            if job._cancel.is_set():
+                self._finish(job, CANCELLED)
+            elif job.should_stop():
+                self._finish(job, TIMEOUT, error=f"timed out after {job.timeout}s")
+            else:
+                self._finish(job, FAILED, error=str(e))
+        else:
+            self._finish(job, DONE, result=result)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Queue fn(*args, should_stop=..., **kwargs) unless an identical job (same key)
+        is already queued or running, in which case that job is returned. If the
+        identical job was cancelled or timed out but its worker is still stopping,
+        the new job starts once that worker has returned.
+        Raises QueueFull when max_pending jobs are waiting.
+        """
+        with self._lock:
+            self._purge()
+            existing = self._inflight.get(key)
+            if existing is not None and existing.status not in FINISHED:
+                return existing
+            pending = sum(1 for j in self._inflight.values() if j.status == QUEUED)
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} route jobs are already waiting")
+            job = Job(key, self.timeout)
+            job.after = existing
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+            job.future = self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job, or None if unknown."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            # never started
+            self._finish(job, CANCELLED)
+            self._release(job)
+        elif job.status == RUNNING:
+            # the worker notices at its next should_stop() check
+            self._finish(job, CANCELLED)
+        return job
+
+    def depth(self):
+        """(queued, running) job counts."""
+        with self._lock:
+            queued = sum(1 for j in self._inflight.values() if j.status == QUEUED)
+            return queued, len(self._inflight) - queued
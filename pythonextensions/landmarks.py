@@ -0,0 +1,88 @@
+import numpy as np
+
+import pythonextensions.pathfinder as pf
+
+# ---- Landmark (ALT) heuristic -------------------------------------------
+# A handful of landmark cells is picked per map and a full Dijkstra field is
+# computed from each (once, stored in the grid cache next to the cost grid).
+# Move costs are symmetric, so for any landmark L the triangle inequality
+# gives |d(L, v) - d(L, goal)| <= d(v, goal): a lower bound that, unlike the
+# straight-line distance, knows about the detours around impassable areas.
+# Penalties and masks only ever raise costs, so the bound stays admissible
+# for the penalised grids of the k-routes loop as well.
+
+DEFAULT_LANDMARKS = 4
+# Distances are stored as float32, each off by up to half a float32 ulp of its
+# value, so a difference of two can overestimate by up to one ulp of the field's
+# largest distance: heuristic_for subtracts that (absolute) slack. _SAFETY only
+# covers the float64 sums of a_star adding up in a different order.
+_SAFETY = 1.0 - 1e-9
+
+
+def _farthest(dist):
+    """(x, y) of the largest finite value in dist, or None if there is none."""
+    finite = np.isfinite(dist)
+    if not finite.any():
+        return None
+    idx = int(np.argmax(np.where(finite, dist, -1.0)))
+    y, x = divmod(idx, dist.shape[1])
+    return x, y
+
+def select_landmarks(cost_grid, n=DEFAULT_LANDMARKS, diagonal=True):
+    """
+    Farthest-point landmarks: the first is the cell farthest from a passable cell
+    near the centre, each next one the cell farthest from all landmarks so far.
+    Returns (coords as (n,2) int32 array of (x,y), dists as (n,h,w) float32 array).
+    """
+    h, w = cost_grid.shape
+    passable = np.argwhere(np.isfinite(cost_grid))
+    if len(passable) == 0:
+        raise ValueError("Map has no passable cells")
+    centre = passable[np.argmin(np.abs(passable - (h // 2, w // 2)).sum(axis=1))]
+    seed, _ = pf.dijkstra(cost_grid, (int(centre[1]), int(centre[0])), diagonal)
+    coords, dists = [], []
+    nearest = seed
+    for _ in range(n):
+        landmark = _farthest(nearest)
+        if landmark is None or landmark in coords:
+            break
+        dist, _ = pf.dijkstra(cost_grid, landmark, diagonal)
+        coords.append(landmark)
+        dists.append(dist.astype(np.float32))
+        nearest = dist if len(dists) == 1 else np.minimum(nearest, dist)
+    return np.array(coords, dtype=np.int32).reshape(-1, 2), np.stack(dists)
+
+def load_or_build(cost_grid, key=None, cache=None, n=DEFAULT_LANDMARKS, diagonal=True):
+    """select_landmarks() for a map, stored in / read from the grid cache under key."""
+    name = f"alt{n}{'d' if diagonal else ''}"
+    if cache is not None and key is not None:
+        coords = cache.get(key, name=f"{name}_coords")
+        dists = cache.get(key, name=f"{name}_dists")
+        if coords is not None and dists is not None:
+            return coords, dists
+    print(f"Computing {n} landmark distance fields...")
+    coords, dists = select_landmarks(cost_grid, n, diagonal)
+    if cache is not None and key is not None:
+        coords = cache.put(key, coords, name=f"{name}_coords")
+        dists = cache.put(key, dists, name=f"{name}_dists")
+    return coords, dists
+
+def heuristic_for(dists, goal):
+    """
+    (h,w) float64 lower bounds on the cost from every cell to goal: the best landmark
+    bound, and never less than the straight-line distance a_star uses.
+    """
+    gx, gy = int(goal[0]), int(goal[1])
+    _, h, w = dists.shape
+    ys, xs = np.ogrid[:h, :w]
+    bound = np.hypot(xs - gx, ys - gy)
+    for dist in dists:
+        d_goal = dist[gy, gx]
+        if not np.isfinite(d_goal):
+            continue    # goal unreachable from this landmark: no information
+        finite = np.isfinite(dist)
+        slack = float(np.spacing(np.float32(dist[finite].max())))
+        with np.errstate(invalid="ignore"):
+            alt = (np.abs(dist.astype(np.float64) - float(d_goal)) - slack) * _SAFETY
+        np.fmax(bound, alt, out=bound)
+    return bound
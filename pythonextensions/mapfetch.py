@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pythonextensions import gridcache
+
+# ---- Remote map fetching -------------------------------------------------
+# Maps are downloaded through one pooled requests.Session, streamed with a
+# hard size limit and kept in a local disk cache. A repeat request for the
+# same URL is a conditional GET (If-None-Match / If-Modified-Since), so an
+# unchanged map costs a 304. Bodies are stored under their sha256, the same
+# content hash gridcache uses, so a cached map also finds its cost grid
+# without being read or hashed again. Files are touched when used; after a
+# download, files unused for max_age and the least recently used bodies
+# beyond max_cache_bytes are removed.
+
+DEFAULT_CACHE_DIR = "./pythonextensions/cache/maps"
+MAX_MAP_BYTES = 50 * 1024 * 1024
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600   # seconds
+FETCH_TIMEOUT = (5, 30)     # (connect, read) seconds
+CHUNK_SIZE = 64 * 1024
+
+
+class MapFetchError(Exception):
+    """The map could not be downloaded."""
+
+class MapTooLarge(MapFetchError):
+    """The map is larger than the configured byte limit."""
+
+
+class FetchedMap:
+    """
+    A downloaded map. content_hash is always known; the bytes are read from the
+    disk cache only when .data is first used (e.g. not at all on a grid cache hit).
+    If a concurrent fetch pruned the cached body before then, refetch() downloads
+    it again; bytes with a different hash raise MapFetchError rather than being
+    used under the old content_hash.
+    """
+
+    def __init__(self, content_hash, path=None, data=None, from_cache=False, refetch=None):
+        self.content_hash = content_hash
+        self.path = path
+        self._data = data
+        self.from_cache = from_cache
+        self._refetch = refetch
+
+    @property
+    def data(self):
+        if self._data is None:
+            try:
+                with open(self.path, "rb") as f:
+                    self._data = f.read()
+            except FileNotFoundError:
+                if self._refetch is None:
+                    raise
+                fresh = self._refetch()
+                if fresh.content_hash != self.content_hash:
+                    raise MapFetchError("map changed on the server while it was being read")
+                self._data = fresh.data
+        return self._data
+
+
+class MapFetcher:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=MAX_MAP_BYTES, timeout=FETCH_TIMEOUT,
+                 session=None, pool_size=10, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, max_age=DEFAULT_MAX_AGE):
+        """
+        max_bytes: largest map accepted
+        max_cache_bytes: disk budget for cached map bodies
+        max_age: seconds an unused cached map is kept
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_cache_bytes = max_cache_bytes
+        self.max_age = max_age
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self._lock = threading.Lock()
+
+    def _meta_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _body_path(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash + ".img")
+
+    def _read_meta(self, url):
+        try:
+            with open(self._meta_path(url)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(meta, dict) or meta.get("url") != url or not meta.get("content_hash"):
+            return None
+        if not os.path.exists(self._body_path(meta["content_hash"])):
+            return None
+        return meta
+
+    def _cached(self, url, meta):
+        """FetchedMap for the cached copy described by meta, or None if it is gone."""
+        if meta is None:
+            return None
+        body = self._body_path(meta["content_hash"])
+        try:
+            os.utime(body)      # recently used, for _prune
+            os.utime(self._meta_path(url))
+        except OSError:
+            return None         # pruned since _read_meta
+        return FetchedMap(meta["content_hash"], path=body, from_cache=True,
+                          refetch=lambda: self._download(url))
+
+    def _write(self, url, data, content_hash, resp):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = {
+            "url": url,
+            "content_hash": content_hash,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "size": len(data),
+        }
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        body = self._body_path(content_hash)
+        if not os.path.exists(body):
+            with open(body + suffix, "wb") as f:
+                f.write(data)
+            os.replace(body + suffix, body)
+        else:
+            os.utime(body)
+        meta_path = self._meta_path(url)
+        with open(meta_path + suffix, "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+        self._prune(keep=body)
+
+    def _prune(self, keep=None):
+        """
+        Remove metadata and bodies unused for max_age, then the least recently used
+        bodies until they fit max_cache_bytes. Metadata whose body is gone reads as a miss.
+        """
+        bodies = []
+        now = time.time()
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                if e.name.endswith(".json") and st.st_mtime + self.max_age < now:
+                    self._remove(e.path)
+                elif e.name.endswith(".img") and e.path != keep:
+                    bodies.append((st.st_mtime, e.path, st.st_size))
+        bodies.sort()
+        total = sum(size for _, _, size in bodies)
+        if keep is not None:
+            total += os.path.getsize(keep)
+        for mtime, path, size in bodies:
+            if total <= self.max_cache_bytes and mtime + self.max_age >= now:
+                continue
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _read_body(self, resp):
+        length = resp.headers.get("Content-Length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            raise MapTooLarge(f"map is {length} bytes, limit is {self.max_bytes}")
+        chunks = []
+        total = 0
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            total += len(chunk)
+            if total > self.max_bytes:
+                raise MapTooLarge(f"map exceeds {self.max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _get(self, url, meta=None):
+        """GET url, conditional on the cached meta if given. Returns (resp, body), body None for a 304."""
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 304:
+                return resp, None
+            resp.raise_for_status()
+            return resp, self._read_body(resp)
+
+    def fetch(self, url):
+        """Download url (or revalidate the cached copy). Returns a FetchedMap."""
+        meta = self._read_meta(url)
+        try:
+            resp, data = self._get(url, meta)
+            if data is None:
+                cached = self._cached(url, meta)
+                if cached is not None:
+                    return cached
+                # 304 without a usable cached copy (metadata missing or unreadable,
+                # body pruned meanwhile): a miss, ask again unconditionally
+                return self._download(url)
+        except requests.RequestException as e:
+            raise MapFetchError(str(e)) from e
+        return self._store(url, data, resp)
+
+    def _download(self, url):
+        """Unconditional fetch of url, stored in the cache. Returns a FetchedMap."""
+        try:
+            resp, data = self._get(url)
+        except requests.RequestException as e:
+            raise MapFetchError(str(e)) from e
+        if data is None:
+            raise MapFetchError("server answered 304 to an unconditional request")
+        return self._store(url, data, resp)
+
+    def _store(self, url, data, resp):
+        content_hash = gridcache.content_hash(data)
+        with self._lock:
+            self._write(url, data, content_hash, resp)
+        return FetchedMap(content_hash, path=self._body_path(content_hash), data=data)
+
+
+default_fetcher = MapFetcher()
@@ -0,0 +1,71 @@
+import threading
+import tracemalloc
+
+# ---- Per-request memory report -------------------------------------------
+# main() records the size of the big arrays a request holds (cost grid, work
+# grid, overlays, search state). With trace=True the request additionally
+# runs under tracemalloc and reports its peak. tracemalloc is process-wide
+# and slows the pure-Python search down by more than an order of magnitude,
+# so tracing is opt-in and meant for diagnosing single requests; with several
+# requests traced at once each peak includes the others' allocations.
+
+_trace_lock = threading.Lock()
+_tracers = 0
+
+
+def _mb(n):
+    return f"{n / (1024 * 1024):.1f}MB"
+
+
+class MemoryReport:
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.arrays = {}     # name -> largest byte count recorded
+        self.peak = None     # traced peak in bytes (trace=True only)
+        self._tracing = False
+
+    def start(self):
+        global _tracers
+        if self.trace and not self._tracing:
+            with _trace_lock:
+                if _tracers == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                _tracers += 1
+                tracemalloc.reset_peak()
+            self._tracing = True
+        return self
+
+    def stop(self):
+        global _tracers
+        if self._tracing:
+            with _trace_lock:
+                self.peak = tracemalloc.get_traced_memory()[1]
+                _tracers -= 1
+                if _tracers == 0:
+                    tracemalloc.stop()
+            self._tracing = False
+        return self
+
+    def record(self, name, nbytes):
+        """Remember nbytes for name (the largest value wins if recorded repeatedly)."""
+        self.arrays[name] = max(self.arrays.get(name, 0), int(nbytes))
+
+    @property
+    def total(self):
+        return sum(self.arrays.values())
+
+    def to_dict(self):
+        d = dict(self.arrays, total=self.total)
+        if self.peak is not None:
+            d["peak"] = self.peak
+        return d
+
+    def header(self):
+        """Compact "name=bytes;..." form, e.g. for a response header."""
+        return ";".join(f"{k}={v}" for k, v in self.to_dict().items())
+
+    def __str__(self):
+        parts = [f"{k} {_mb(v)}" for k, v in self.arrays.items()] + [f"total {_mb(self.total)}"]
+        if self.peak is not None:
+            parts.append(f"traced peak {_mb(self.peak)}")
+        return "Memory: " + ", ".join(parts)
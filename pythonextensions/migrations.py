@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+migrations.py
+Bring an existing database up to the indexes declared in models.py, and check
+that the hot queries actually use them.
+Usage:
+  python -m pythonextensions.migrations [instance/carpool.db] [--check]
+
+db.create_all() only creates missing tables, so indexes added to a model later
+never reach a database that already has the table. upgrade() creates them
+(CREATE INDEX IF NOT EXISTS); the app runs it at start-up. --check prints the
+EXPLAIN QUERY PLAN of the queries below and exits with 1 if one of them does
+not use its index.
+"""
+import argparse
+import sys
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect, select
+
+from pythonextensions.models import db, Carpool, ClubLoginToken, Comment, Race
+
+DEFAULT_DB = "instance/carpool.db"
+
+
+def missing_indexes(bind):
+    """Indexes declared on the models whose table exists but lacks them."""
+    inspector = inspect(bind)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue    # create_all() makes the table together with its indexes
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        missing.extend(ix for ix in table.indexes if ix.name not in existing)
+    return missing
+
+def upgrade(bind):
+    """Create the missing indexes. Returns their names."""
+    created = []
+    for index in missing_indexes(bind):
+        index.create(bind, checkfirst=True)
+        created.append(index.name)
+    return created
+
+
+def _hot_queries(now):
+    """(description, statement, index it should use) for the filters the pages run most."""
+    return [
+        ("home: public carpools",
+         select(Carpool).where(Carpool.departure_time >= now, Carpool.club_level == 0),
+         "ix_carpool_club_level_departure_time"),
+        ("club dashboard: a club's carpools",
+         select(Carpool).where(Carpool.club_id == 1, Carpool.departure_time >= now),
+         "ix_carpool_club_id_departure_time"),
+        ("carpool-locations: one race",
+         select(Carpool).where(Carpool.departure_time >= now, Carpool.race_id == 1),
+         "ix_carpool_race_id_departure_time"),
+        ("carpool-locations: all upcoming",
+         select(Carpool).where(Carpool.departure_time >= now),
+         "ix_carpool_departure_time"),
+        ("race-details: upcoming races",
+         select(Race).where(Race.date >= now),
+         "ix_race_date"),
+        ("club-login-token: token lookup",
+         select(ClubLoginToken).where(ClubLoginToken.token == "x", ClubLoginToken.used == False),  # noqa: E712
+         "sqlite_autoindex_club_login_token_1"),
+        ("generate-token: expired cleanup",
+         select(ClubLoginToken).where(ClubLoginToken.expires_at < now),
+         "ix_club_login_token_expires_at"),
+        ("comments of a carpool",
+         select(Comment).where(Comment.carpool_id == 1).order_by(Comment.timestamp.desc()),
+         "ix_comment_carpool_id_timestamp"),
+    ]
+
+def query_plan(conn, statement):
+    """EXPLAIN QUERY PLAN detail lines for an SQLAlchemy statement (SQLite)."""
+    sql = statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return [row[-1] for row in rows]
+
+def check_query_plans(bind):
+    """Run EXPLAIN QUERY PLAN for the hot queries. Returns [(description, index, ok, plan lines)]."""
+    report = []
+    with bind.connect() as conn:
+        for description, statement, index in _hot_queries(datetime.utcnow()):
+            plan = query_plan(conn, statement)
+            ok = any(f"INDEX {index} " in line + " " for line in plan)
+            report.append((description, index, ok, plan))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create missing indexes; optionally verify query plans.")
+    parser.add_argument("database", nargs="?", default=DEFAULT_DB, help="SQLite file")
+    parser.add_argument("--check", action="store_true", help="verify the hot queries use their indexes")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(f"sqlite:///{args.database}")
+    db.metadata.create_all(engine)
+    created = upgrade(engine)
+    print(f"Created {len(created)} index(es){': ' + ', '.join(created) if created else ''}")
+    if not args.check:
+        return 0
+    failed = 0
+    for description, index, ok, plan in check_query_plans(engine):
+        failed += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {description} (expects {index})")
+        for line in plan:
+            print(f"       {line}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,15 @@ db = SQLAlchemy()
 
 # I can add a new collumn to a sqllite table by :
 # ALTER [TABLE] passengers ADD COLUMN [COLNAME] [VARCHAR(100)];
+# New indexes don't need that: db.create_all() skips existing tables, so
+# migrations.upgrade() creates any index declared below that is missing.
+
+# Relationships load lazily; every query in app.py asks for what its page
+# uses (selectinload/joinedload/load_only). A lazy="joined" default makes
+# e.g. a club dropdown fetch every carpool, race, comment and reservation.
+
+# Indexes follow the queries: equality column(s) first, then the range
+# column (departure_time >= now, date >= now, expires_at < now).
 
 class ClubLoginToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,6 +25,11 @@ class ClubLoginToken(db.Model):
 
     club = db.relationship('Club')
 
+    # token lookups use the unique index on token; this one is for the expired-token cleanup
+    __table_args__ = (
+        db.Index('ix_club_login_token_expires_at', 'expires_at'),
+    )
+
 class Club(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     password = db.Column(db.String(100), nullable=False)
@@ -23,8 +37,8 @@ class Club(db.Model):
     description = db.Column(db.Text, nullable=True)
 
     # One club can have many carpools
-    carpools = db.relationship('Carpool', backref='club', lazy="joined")
-    races = db.relationship('Race', backref='club', lazy="joined")
+    carpools = db.relationship('Carpool', backref='club')
+    races = db.relationship('Race', backref='club')
 
 
 class Race(db.Model):
@@ -36,11 +50,16 @@ class Race(db.Model):
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     # One race can have many carpools
-    carpools = db.relationship('Carpool', backref='race', lazy="joined")
+    carpools = db.relationship('Carpool', backref='race')
 
     # foreign key to Club
     club_id = db.Column(db.Integer, db.ForeignKey('club.id'), nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_race_date', 'date'),
+        db.Index('ix_race_club_id', 'club_id'),
+    )
+
 
 class Carpool(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -58,11 +77,18 @@ class Carpool(db.Model):
     longitude = db.Column(db.Float, nullable=False)  # Fixed spelling from longtitude to longitude
 
 
-    comments = db.relationship('Comment', backref='carpool', lazy="joined")
+    comments = db.relationship('Comment', backref='carpool')
 
-    reservations = db.relationship('Reservation', backref='carpool', lazy="joined")
+    reservations = db.relationship('Reservation', backref='carpool')
     # club attribute is available via backref from Club
 
+    __table_args__ = (
+        db.Index('ix_carpool_departure_time', 'departure_time'),
+        db.Index('ix_carpool_club_level_departure_time', 'club_level', 'departure_time'),
+        db.Index('ix_carpool_club_id_departure_time', 'club_id', 'departure_time'),
+        db.Index('ix_carpool_race_id_departure_time', 'race_id', 'departure_time'),
+    )
+
 
 class Reservation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -71,6 +97,10 @@ class Reservation(db.Model):
     passenger_phone = db.Column(db.String(100), nullable=False)
     passenger_email = db.Column(db.String(100), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_reservation_carpool_id', 'carpool_id'),
+    )
+
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -78,4 +108,8 @@ class Comment(db.Model):
     author = db.Column(db.String(100), nullable=False)
     text = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_comment_carpool_id_timestamp', 'carpool_id', 'timestamp'),
+    )
     
\ No newline at end of file
@@ -1,47 +1,236 @@
 import math
+from functools import lru_cache
+import numpy as np
 # ---- Diversity helpers ------------------------------------------------
 def _jaccard_overlap(path_a, path_b):
     """Return Jaccard overlap between two paths (as sets of (x,y))."""
-    sa, sb = set(path_a), set(path_b)
-    if not sa and not sb:
+    return _jaccard_cells(_point_keys(path_a), _point_keys(path_b))
+
+def _point_keys(path):
+    """Sorted unique int64 keys (x << 32 | y) of a path, no grid shape needed."""
+    if path is None or len(path) == 0:
+        return np.zeros(0, dtype=np.int64)
+    pts = np.asarray(path, dtype=np.int64).reshape(-1, 2)
+    return np.unique((pts[:, 0] << 32) | (pts[:, 1] & 0xFFFFFFFF))
+
+def _jaccard_cells(a, b):
+    """Jaccard overlap of two sorted unique index arrays."""
+    if len(a) == 0 and len(b) == 0:
         return 0.0
-    return len(sa & sb) / len(sa | sb)
+    inter = len(np.intersect1d(a, b, assume_unique=True))
+    return inter / (len(a) + len(b) - inter)
+
+@lru_cache(maxsize=32)
+def _decay_kernel(radius, decay):
+    """Offsets (dy, dx) of the disc d <= radius and their weights decay ** d."""
+    dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    d = np.hypot(dx, dy)
+    inside = d <= radius
+    return dy[inside], dx[inside], decay ** d[inside]
+
+@lru_cache(maxsize=32)
+def _square_kernel(radius):
+    """Offsets (dy, dx) of the (2r+1)^2 window."""
+    dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    return dy.ravel(), dx.ravel()
+
+def _path_raster(path, shape):
+    """Sorted unique row-major flat indices of the in-bounds path cells."""
+    H, W = shape
+    if path is None or len(path) == 0:
+        return np.zeros(0, dtype=np.int64)
+    pts = np.asarray(path, dtype=np.int64).reshape(-1, 2)
+    inb = (pts[:, 0] >= 0) & (pts[:, 0] < W) & (pts[:, 1] >= 0) & (pts[:, 1] < H)
+    pts = pts[inb]
+    return np.unique(pts[:, 1] * W + pts[:, 0])
+
+def _stamp(cells, shape, dy, dx):
+    """
+    Place a kernel on every raster cell. Returns (flat target indices, kernel index)
+    of all in-bounds hits, i.e. the sparse form of raster (*) kernel.
+    """
+    H, W = shape
+    py, px = cells // W, cells % W
+    ny = py[:, None] + dy[None, :]
+    nx = px[:, None] + dx[None, :]
+    ok = (ny >= 0) & (ny < H) & (nx >= 0) & (nx < W)
+    k = np.broadcast_to(np.arange(len(dy)), ok.shape)[ok]
+    return ny[ok] * W + nx[ok], k
+
+def _sparse_sum(flat, values):
+    """Sum values per flat index. Returns (sorted unique indices, float64 sums)."""
+    idx, inverse = np.unique(flat, return_inverse=True)
+    return idx, np.bincount(inverse, weights=values, minlength=len(idx))
+
+def _penalty_delta(shape, path, base_penalty=5.0, radius=3, decay=0.6):
+    """
+    Penalty added around one path in sparse form (flat indices, values): the path
+    raster convolved with the base_penalty * decay ** d kernel (d <= radius).
+    Only the cells near the path are stored, not a full (H,W) array.
+    """
+    cells = _path_raster(path, shape)
+    dy, dx, weights = _decay_kernel(int(radius), float(decay))
+    flat, k = _stamp(cells, shape, dy, dx)
+    return _sparse_sum(flat, weights[k] * base_penalty)
 
 def _penalize_cost_grid(base_cost_grid, path, base_penalty=5.0, radius=3, decay=0.6):
     """
     Return a new cost grid with added penalties around the given path.
     Penalty at distance d <= radius is base_penalty * (decay ** d).
     """
-    H, W = base_cost_grid.shape
-    penalized = base_cost_grid.copy()
-    for (x, y) in path:
-        for dy in range(-radius, radius + 1):
-            for dx in range(-radius, radius + 1):
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < W and 0 <= ny < H:
-                    d = math.hypot(dx, dy)
-                    if d <= radius and math.isfinite(penalized[ny, nx]):
-                        penalized[ny, nx] += base_penalty * (decay ** d)
+    penalized = np.array(base_cost_grid)
+    idx, vals = _penalty_delta(base_cost_grid.shape, path, base_penalty, radius, decay)
+    penalized.reshape(-1)[idx] += vals.astype(penalized.dtype, copy=False)
     return penalized
 
+def _mask_cells(shape, path, radius=0):
+    """Flat indices of the square (2r+1)^2 neighbourhood of every path cell."""
+    dy, dx = _square_kernel(int(radius))
+    flat, _ = _stamp(_path_raster(path, shape), shape, dy, dx)
+    return flat
+
+def _keep_cells(shape, points, radius):
+    """
+    Flat indices of the discs of the given radius around points (x,y).
+    A single kept cell inside a masked band is walled in; the disc has to
+    reach past the band (radius + 1 for a band of radius) to be left again.
+    """
+    cells = np.array([int(y) * shape[1] + int(x) for x, y in points], dtype=np.int64)
+    dy, dx, _ = _decay_kernel(int(radius), 1.0)
+    flat, _ = _stamp(cells, shape, dy, dx)
+    return np.unique(flat)
+
 def _mask_out_path(base_cost_grid, path, radius=0):
     """
     Return a new cost grid where cells along the path (and within radius)
-    are set to inf (hard disjointness). Keeps start/goal as passable.
+    are set to inf (hard disjointness). Keeps the area around start/goal passable.
     """
-    H, W = base_cost_grid.shape
-    masked = base_cost_grid.copy()
-    if not path:
+    masked = np.array(base_cost_grid)
+    if path is None or len(path) == 0:
         return masked
-    start = path[0]
-    goal = path[-1]
-    for (x, y) in path:
-        for dy in range(-radius, radius + 1):
-            for dx in range(-radius, radius + 1):
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < W and 0 <= ny < H:
-                    # keep endpoints always passable
-                    if (nx, ny) == start or (nx, ny) == goal:
-                        continue
-                    masked[ny, nx] = math.inf
+    flat = masked.reshape(-1)
+    keep = _keep_cells(masked.shape, (path[0], path[-1]), radius + 1)
+    saved = flat[keep]
+    flat[_mask_cells(masked.shape, path, radius)] = math.inf
+    flat[keep] = saved
+    return masked
+
+
+def _work_grid(base_cost_grid, out):
+    """Copy the base grid into out (reused between iterations), or into a new array."""
+    if out is None:
+        return np.array(base_cost_grid)
+    np.copyto(out, base_cost_grid)
+    return out
+
+
+class PenaltyOverlay:
+    """
+    Running sum of path penalties for the k-routes loop: every accepted route is
+    rasterised and convolved once, later iterations just reuse the sum.
+    The sum is kept sparse (only cells near accepted routes).
+    """
+
+    def __init__(self, shape, base_penalty=5.0, radius=3, decay=0.6):
+        self.shape = shape
+        self.base_penalty = base_penalty
+        self.radius = radius
+        self.decay = decay
+        self.idx = np.zeros(0, dtype=np.int64)
+        self.vals = np.zeros(0)
+        self.n_paths = 0
+
+    def sync(self, paths):
+        """Add the penalties of any paths not seen yet (paths only ever grows)."""
+        for path in paths[self.n_paths:]:
+            idx, vals = _penalty_delta(self.shape, path, self.base_penalty, self.radius, self.decay)
+            self.idx, self.vals = _sparse_sum(np.concatenate((self.idx, idx)), np.concatenate((self.vals, vals)))
+        self.n_paths = len(paths)
+        return self
+
+    @property
+    def nbytes(self):
+        return self.idx.nbytes + self.vals.nbytes
+
+    def apply(self, base_cost_grid, out=None):
+        """Base grid plus penalties, written into out (same shape/dtype) if given."""
+        work = _work_grid(base_cost_grid, out)
+        work.reshape(-1)[self.idx] += self.vals.astype(work.dtype, copy=False)
+        return work
+
+
+class MaskOverlay:
+    """Union of masked-out neighbourhoods for "disjoint" mode, same reuse as PenaltyOverlay."""
+
+    def __init__(self, shape, radius=0):
+        self.shape = shape
+        self.radius = radius
+        self.idx = np.zeros(0, dtype=np.int64)
+        self.n_paths = 0
+
+    def sync(self, paths):
+        for path in paths[self.n_paths:]:
+            self.idx = np.union1d(self.idx, _mask_cells(self.shape, path, self.radius))
+        self.n_paths = len(paths)
+        return self
+
+    @property
+    def nbytes(self):
+        return self.idx.nbytes
+
+    def apply(self, base_cost_grid, keep=(), out=None, keep_radius=None):
+        """
+        Masked grid, written into out if given. The discs of keep_radius
+        (default radius + 1) around the points in keep ((x,y), e.g. start/goal)
+        stay unmasked, so a route can still leave start and reach goal.
+        """
+        masked = _work_grid(base_cost_grid, out)
+        flat = masked.reshape(-1)
+        if keep_radius is None:
+            keep_radius = self.radius + 1
+        keep = _keep_cells(self.shape, keep, keep_radius) if len(keep) else np.zeros(0, dtype=np.int64)
+        saved = flat[keep]
+        flat[self.idx] = math.inf
+        flat[keep] = saved
+        return masked
+
+
+class RouteFootprint:
+    """
+    An accepted route rasterised once to sorted flat indices, so candidates can be
+    scored against it with NumPy set operations instead of Python sets of tuples.
+    """
+
+    def __init__(self, path, shape):
+        self.shape = shape
+        self.cells = _path_raster(path, shape)
+        self._buffers = {}
+
+    def buffer(self, radius):
+        """Sorted flat indices of all cells within radius (Euclidean) of the route."""
+        if radius <= 0:
+            return self.cells
+        if radius not in self._buffers:
+            dy, dx, _ = _decay_kernel(int(radius), 1.0)
+            flat, _ = _stamp(self.cells, self.shape, dy, dx)
+            self._buffers[radius] = np.unique(flat)
+        return self._buffers[radius]
+
+    def jaccard(self, cells):
+        """Jaccard overlap with another raster (see _path_raster)."""
+        return _jaccard_cells(self.cells, cells)
+
+    def buffered_overlap(self, cells, radius):
+        """
+        Fraction of the other raster's cells lying within radius of this route.
+        Catches near-parallel routes that share few exact pixels.
+        """
+        if len(cells) == 0:
+            return 0.0
+        return float(np.isin(cells, self.buffer(radius), assume_unique=True).mean())
 
+    def overlap(self, cells, radius=0):
+        """Jaccard overlap for radius 0, buffered overlap otherwise."""
+        if radius > 0:
+            return self.buffered_overlap(cells, radius)
+        return self.jaccard(cells)
@@ -0,0 +1,321 @@
+import atexit
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import pythonextensions.pathfinder as pf
+import pythonextensions.overlap as overlap
+
+# ---- Parallel k-diverse route search -----------------------------------
+# For every extra route we launch several candidate searches at once, each
+# with its own (penalty, radius) setting, on a process pool. The cost grid
+# lives in one shared-memory block that all workers map, so nothing but the
+# small list of already accepted paths is pickled per task. The base setting
+# is what the sequential loop tries first; if it passes the overlap test it
+# is taken as soon as it finishes and the other searches are cancelled.
+# Only when it fails does the route wait for the rest: among the candidates
+# that pass, the cheapest one (on the unpenalised grid) wins, ties broken by
+# setting order, so the outcome does not depend on which worker finished first.
+#
+# Starting workers is expensive (under spawn/forkserver each one re-imports
+# the app), so there is one pool per process, created on first use and kept
+# until exit. Shared grids are kept per map key as well (a few, LRU) and
+# workers attach to them lazily by name. A future that already reached a
+# worker cannot be cancelled, so every candidate also gets a slot in a shared
+# block of stop flags that its search polls (see StopFlags).
+
+# (penalty multiplier, radius increment) tried in parallel for each route
+CANDIDATE_SETTINGS = [(1.0, 0), (1.5, 1), (2.25, 2), (3.0, 4)]
+
+MAX_SHARED_GRIDS = 4    # shared grids kept around for later requests (parent and each worker)
+STOP_SLOTS = 4096       # stop flags, reused round-robin
+
+_pool = None
+_stop_flags = None
+_pool_lock = threading.Lock()
+
+
+class SharedGrid:
+    """Cost grid copied once into a named shared-memory block."""
+
+    def __init__(self, grid):
+        grid = np.asarray(grid)
+        self.shape = grid.shape
+        self.dtype = grid.dtype.str
+        self.shm = shared_memory.SharedMemory(create=True, size=max(grid.nbytes, 1))
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)[...] = grid
+        self.users = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def ref(self):
+        """What a task needs to map the grid in a worker."""
+        return self.shm.name, self.shape, self.dtype
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedGrids:
+    """
+    SharedGrid per map key, reused across calls. Grids in use are never closed;
+    unused ones beyond max_grids are, least recently used first.
+    """
+
+    def __init__(self, max_grids=MAX_SHARED_GRIDS):
+        self.max_grids = max_grids
+        self._grids = OrderedDict()     # map key -> SharedGrid
+        self._lock = threading.Lock()
+
+    def acquire(self, grid, key=None):
+        """SharedGrid holding grid; key=None (uncached map) makes a private one. Pair with release()."""
+        with self._lock:
+            shared = self._grids.get(key) if key is not None else None
+            if shared is None:
+                shared = SharedGrid(grid)
+                if key is not None:
+                    self._grids[key] = shared
+            else:
+                self._grids.move_to_end(key)
+            shared.users += 1
+            return shared
+
+    def release(self, shared):
+        with self._lock:
+            shared.users -= 1
+            if shared not in self._grids.values():
+                if not shared.users:
+                    shared.close()
+                return
+            unused = [k for k, g in self._grids.items() if not g.users]
+            for k in unused[:max(0, len(self._grids) - self.max_grids)]:
+                self._grids.pop(k).close()
+
+    def close(self):
+        with self._lock:
+            for shared in self._grids.values():
+                shared.close()
+            self._grids.clear()
+
+
+shared_grids = SharedGrids()
+
+
+class StopFlags:
+    """
+    One byte per submitted candidate in shared memory; the parent sets it to stop
+    a search that is queued or running in a worker. Slots are handed out round-robin.
+    """
+
+    def __init__(self, n=STOP_SLOTS):
+        self.shared = SharedGrid(np.zeros(n, dtype=np.uint8))
+        self.flags = np.ndarray((n,), dtype=np.uint8, buffer=self.shared.shm.buf)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ref(self):
+        return self.shared.ref
+
+    def take(self, n):
+        """n fresh (cleared) slot numbers."""
+        with self._lock:
+            slots = [(self._next + i) % len(self.flags) for i in range(n)]
+            self._next = (self._next + n) % len(self.flags)
+        self.flags[slots] = 0
+        return slots
+
+    def stop(self, slots):
+        self.flags[list(slots)] = 1
+
+    def close(self):
+        del self.flags
+        self.shared.close()
+
+
+def get_pool(workers=None):
+    """
+    The process pool, created on first use with workers (default os.cpu_count())
+    processes; later calls get the same pool. A broken pool (a worker died) is replaced.
+    """
+    global _pool, _stop_flags
+    with _pool_lock:
+        if _pool is not None and getattr(_pool, "_broken", False):
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        if _stop_flags is None:
+            _stop_flags = StopFlags()
+        return _pool
+
+@atexit.register
+def shutdown():
+    """Stop the pool and remove the shared grids (registered to run at exit)."""
+    global _pool, _stop_flags
+    with _pool_lock:
+        if _pool is not None:
+            if _stop_flags is not None:
+                _stop_flags.stop(range(STOP_SLOTS))
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+        if _stop_flags is not None:
+            _stop_flags.close()
+            _stop_flags = None
+    shared_grids.close()
+
+
+# worker side: shared grids mapped so far, name -> (SharedMemory, read-only array)
+_worker_grids = OrderedDict()
+
+def _attach_grid(ref):
+    name, shape, dtype = ref
+    entry = _worker_grids.get(name)
+    if entry is None:
+        shm = shared_memory.SharedMemory(name=name)
+        grid = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        grid.setflags(write=False)
+        entry = _worker_grids[name] = (shm, grid)
+        while len(_worker_grids) > MAX_SHARED_GRIDS:
+            _, (old, _) = _worker_grids.popitem(last=False)
+            old.close()
+    else:
+        _worker_grids.move_to_end(name)
+    return entry[1]
+
+def _search_candidate(task):
+    """Worker: apply penalties/masks for the accepted paths and run one A*."""
+    ref, stop_ref, slot, idx, start, goal, paths, mode, penalty, radius, decay, use_cpp = task
+    flags = _attach_grid(stop_ref)
+    if flags[slot]:
+        return idx, None, math.inf
+    grid = _attach_grid(ref)
+    if mode == "penalize":
+        work_grid = overlap.PenaltyOverlay(grid.shape, base_penalty=penalty, radius=radius, decay=decay).sync(paths).apply(grid)
+    else:
+        work_grid = overlap.MaskOverlay(grid.shape, radius=radius).sync(paths).apply(grid, keep=(start, goal))
+    try:
+        if use_cpp and pf._HAS_CPP:
+            path, cost = pf.a_star_cpp(work_grid, start, goal, diagonal=pf.DIAGONAL_MOVEMENT)
+        else:
+            path, cost = pf.a_star_array(work_grid, start, goal, diagonal=pf.DIAGONAL_MOVEMENT,
+                                         should_stop=lambda: flags[slot] != 0)
+            path = pf.as_path_array(path)
+    except (ValueError, pf.RouteCancelled):
+        path, cost = None, math.inf
+    return idx, path, cost
+
+
+def _leg_route(grid, start, goal, use_cpp):
+    try:
+        if use_cpp and pf._HAS_CPP:
+            return pf.a_star_cpp(grid, start, goal, diagonal=pf.DIAGONAL_MOVEMENT)
+        path, cost = pf.a_star_array(grid, start, goal, diagonal=pf.DIAGONAL_MOVEMENT)
+        return pf.as_path_array(path), cost
+    except ValueError:
+        return None, math.inf
+
+def _search_leg(task):
+    """Worker: plain A* for one leg of a batch on the shared grid."""
+    ref, idx, start, goal, use_cpp = task
+    return (idx,) + tuple(_leg_route(_attach_grid(ref), start, goal, use_cpp))
+
+
+def find_legs(cost_grid, legs, use_cpp=True, workers=None, key=None):
+    """
+    Best route for each (start, goal) in legs, searched concurrently on the shared
+    process pool (see get_pool), which maps the grid from shared memory kept under key.
+    Returns [(path or None, cost)] in leg order. A single leg, or workers=1, runs in
+    this process.
+    """
+    if len(legs) == 1 or workers == 1:
+        return [_leg_route(cost_grid, a, b, use_cpp) for a, b in legs]
+
+    pool = get_pool(workers)
+    shared = shared_grids.acquire(cost_grid, key)
+    try:
+        out = [None] * len(legs)
+        for idx, path, cost in pool.map(_search_leg, [(shared.ref, i, a, b, use_cpp)
+                                                      for i, (a, b) in enumerate(legs)]):
+            out[idx] = (path, cost)
+    finally:
+        shared_grids.release(shared)
+    return out
+
+
+def find_diverse_routes(cost_grid, start, goal, first_route, k=3, overlap_max=0.5, mode="penalize",
+                        penalty=6.0, radius=10, decay=0.6, overlap_buffer=0, use_cpp=True,
+                        workers=None, time_budget=None, key=None):
+    """
+    Routes 2..k for main(), searched in parallel. first_route is {'path', 'cost'} of route 1.
+    Returns the list of accepted routes (including the first). With time_budget
+    (seconds) the search stops at the deadline and returns what has been accepted so far.
+    key: map key (see gridcache.grid_key) under which the shared grid is kept for later
+    calls. workers: pool size, only used when the pool is first created (see get_pool).
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    results = [first_route]
+    paths = [first_route['path']]
+    footprints = [overlap.RouteFootprint(first_route['path'], cost_grid.shape)]
+    settings = CANDIDATE_SETTINGS
+    if mode == "disjoint":
+        # penalty is irrelevant for masking, only vary the radius
+        settings = list(dict.fromkeys((1.0, dr) for _, dr in CANDIDATE_SETTINGS))
+
+    pool = get_pool(workers)
+    shared = shared_grids.acquire(cost_grid, key)
+    try:
+        for i in range(2, k + 1):
+            slots = _stop_flags.take(len(settings))
+            tasks = [(shared.ref, _stop_flags.ref, slot, j, start, goal, paths, mode, penalty * pm,
+                      max(0, radius + dr), decay, use_cpp)
+                     for slot, (j, (pm, dr)) in zip(slots, enumerate(settings))]
+            pending = {pool.submit(_search_candidate, t) for t in tasks}
+            best = None
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break   # out of time
+                for f in done:
+                    idx, path, cost = f.result()
+                    if path is None:
+                        continue
+                    cells = overlap._path_raster(path, cost_grid.shape)
+                    worst = max(fp.overlap(cells, overlap_buffer) for fp in footprints)
+                    if worst > overlap_max:
+                        continue
+                    rank = (pf.path_cost(cost_grid, path), worst, idx)
+                    if best is None or rank < best[0]:
+                        best = (rank, path, cost)
+                if best is not None and best[0][2] == 0:
+                    break   # the base setting passed: nothing else is needed
+            for f in pending:
+                f.cancel()
+            _stop_flags.stop(slots)     # the ones already handed to a worker
+
+            if best is None:
+                reason = "out of time" if pending else f"no candidate with overlap <= {overlap_max:.2f}"
+                print(f"Route {i}: {reason}; stopping.")
+                break
+            _, path, cost = best
+            results.append({'path': path, 'cost': cost})
+            paths.append(path)
+            footprints.append(overlap.RouteFootprint(path, cost_grid.shape))
+            print(f"Route {i}: nodes={len(path)}, cost≈{cost:.2f} (parallel, setting {best[0][2]})")
+            if deadline is not None and time.monotonic() >= deadline:
+                print("Time budget used up; returning routes found so far.")
+                break
+    finally:
+        shared_grids.release(shared)
+    return results
@@ -6,14 +6,20 @@ Usage:
   python pathfinder.py path/to/map.png [start_x,start_y] [goal_x,goal_y] [--use-cpp]
 
 If --use-cpp is passed, the compiled pybind11 module `pathfinder_cpp` is used.
-Otherwise, the original pure-Python A* implementation runs.
+Otherwise the array-backed pure-Python A* (a_star_array) runs; a_star is kept as reference.
 """
 import sys
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
 from PIL import Image, ImageDraw, ImageFont
+from io import BytesIO
 import numpy as np
 import heapq
+from array import array
 import math
 import time
+from pythonextensions import gridcache
+from pythonextensions import routeformat
 
 
 # -------------------------
@@ -41,9 +47,9 @@ COLOR_COST_MAP = {
 COLOR_MATCH_THRESHOLD = None # None => always map to nearest; set to a number 0..441 to require closeness.
 # Use 8-neighbors (including diagonals)
 DIAGONAL_MOVEMENT = True
-# Path smoothing: set to True to run a simple line-of-sight simplifier (Ramer-Douglas-Peucker would be more advanced)
+# Path smoothing: set to True to run the line-of-sight simplifier by default (main(simplify="rdp") selects Ramer-Douglas-Peucker)
 SIMPLIFY_PATH = True
-SIMPLIFY_EPSILON = 1 # larger = more simplification
+SIMPLIFY_EPSILON = 1 # RDP tolerance in pixels, larger = more simplification
 
 # -------------------------
 # Optional C++ backend
@@ -56,6 +62,9 @@ except Exception:
     pathfinder_cpp = None
     _HAS_CPP = False
 
+class RouteCancelled(Exception):
+    """Raised by main() when its should_stop callback asks it to give up."""
+
 # -------------------------
 # Implementation details
 # -------------------------
@@ -89,6 +98,80 @@ def build_cost_grid(im, color_cost_map, threshold=20):
                     cost_grid[y, x] = math.inf
     return cost_grid
 
+def _pack_rgb(rgb):
+    """Pack an (..., 3) uint8 RGB array into one uint32 key per pixel (0xRRGGBB)."""
+    rgb = rgb.astype(np.uint32, copy=False)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+def _palette_index(colors, palette, threshold):
+    """
+    Resolve a small set of RGB colors against the palette.
+    colors: (U,3) array, palette: (K,3) array
+    Returns (U,) palette indices; colors farther than threshold from every palette entry get K.
+    """
+    diff = colors[:, None, :].astype(np.float64) - palette[None, :, :].astype(np.float64)
+    dists = np.sqrt((diff * diff).sum(axis=2))   # (U,K)
+    idx = np.argmin(dists, axis=1)               # first minimum, same tie-break as build_cost_grid
+    if threshold is not None:
+        idx[dists[np.arange(len(colors)), idx] > threshold] = len(palette)
+    return idx
+
+def _palette_lookup(colors, palette, palette_costs, threshold):
+    """Like _palette_index, but returns (U,) float64 costs (inf where nothing matched)."""
+    costs = np.append(palette_costs.astype(np.float64), np.inf)
+    return costs[_palette_index(colors, palette, threshold)]
+
+def build_cost_grid_vectorized(im, color_cost_map, threshold=20):
+    """
+    NumPy version of build_cost_grid, same result without the per-pixel Python loop.
+    im: PIL Image or (H,W,3) uint8 array
+    color_cost_map: dict {(r,g,b): cost}
+    threshold: if not None, only map if nearest color distance <= threshold; else pixel is impassable.
+
+    Every pixel is packed into a 24-bit key, each distinct key is matched against
+    the palette once, and the whole grid is filled with a single gather.
+    """
+    if isinstance(im, np.ndarray):
+        pixels = im[..., :3]
+    else:
+        pixels = np.asarray(im.convert("RGB"))
+    h, w = pixels.shape[:2]
+    palette = np.array(list(color_cost_map.keys()), dtype=np.uint8)
+    palette_costs = np.array(list(color_cost_map.values()), dtype=np.float64)
+
+    keys = _pack_rgb(pixels).ravel()
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    colors = np.stack([(uniq >> 16) & 0xFF, (uniq >> 8) & 0xFF, uniq & 0xFF], axis=1)
+    lut = _palette_lookup(colors, palette, palette_costs, threshold)
+    return lut[inverse].reshape(h, w)
+
+def build_terrain_codes(im, color_cost_map, threshold=20):
+    """
+    Compact form of the cost grid: returns (codes, lut) where codes is an (H,W) uint8
+    raster of palette indices and lut the float32 cost of each index, so that
+    lut[codes] is the cost grid. Index len(color_cost_map) marks pixels that match
+    no palette color (cost inf). 1 byte per pixel instead of 8.
+    """
+    if len(color_cost_map) > 255:
+        raise ValueError("Terrain codes are uint8: at most 255 palette colors")
+    if isinstance(im, np.ndarray):
+        pixels = im[..., :3]
+    else:
+        pixels = np.asarray(im.convert("RGB"))
+    h, w = pixels.shape[:2]
+    palette = np.array(list(color_cost_map.keys()), dtype=np.uint8)
+    lut = np.append(np.array(list(color_cost_map.values()), dtype=np.float32), np.float32(np.inf))
+
+    keys = _pack_rgb(pixels).ravel()
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    colors = np.stack([(uniq >> 16) & 0xFF, (uniq >> 8) & 0xFF, uniq & 0xFF], axis=1)
+    codes = _palette_index(colors, palette, threshold).astype(np.uint8)
+    return codes[inverse].reshape(h, w), lut
+
+def cost_grid_from_codes(codes, lut):
+    """float32 cost grid for a terrain code raster (see build_terrain_codes)."""
+    return np.take(np.asarray(lut, dtype=np.float32), codes)
+
 def neighbors(x, y, w, h, diagonal=True):
     deltas = [(-1,0),(1,0),(0,-1),(0,1)]
     if diagonal:
@@ -151,6 +234,246 @@ def a_star(cost_grid, start, goal, diagonal=True):
             heapq.heappush(open_set, (fscore, tentative_g, (nx, ny), current))
     return None, math.inf # no path
 
+def _neighbor_offsets(stride, diagonal=True):
+    """(node offset, step length) pairs for column-major node ids with the given column stride."""
+    deltas = [(-1,0),(1,0),(0,-1),(0,1)]
+    if diagonal:
+        deltas += [(-1,-1),(-1,1),(1,-1),(1,1)]
+    return [(dx * stride + dy, math.hypot(dx, dy)) for dx, dy in deltas]
+
+def _padded_costs(cost_grid):
+    """
+    Flatten the grid column-major with a one-cell inf border.
+    Node id = (x+1)*(h+2) + (y+1), so ids sort like (x, y) tuples (same heap tie-break
+    as a_star) and out-of-bounds neighbours are just impassable cells.
+    Also used for per-cell heuristic arrays, which share the node ids.
+    """
+    h, w = cost_grid.shape
+    # float32 grids stay 4 bytes per cell; anything else is searched in float64
+    single = np.asarray(cost_grid).dtype == np.float32
+    padded = np.full((w + 2, h + 2), np.inf, dtype=np.float32 if single else np.float64)
+    padded[1:-1, 1:-1] = np.asarray(cost_grid).T
+    costs = array("f" if single else "d")
+    costs.frombytes(memoryview(padded).cast("B"))   # no intermediate bytes copy
+    return costs, h + 2
+
+def a_star_array(cost_grid, start, goal, diagonal=True, max_cost=None, heuristic=None, stats=None,
+                 should_stop=None):
+    """
+    Drop-in replacement for a_star with identical paths and costs.
+    Uses flat integer node ids, preallocated g-score/parent arrays, a closed
+    bitmap and precomputed neighbour offsets instead of dicts, sets and tuples.
+    max_cost: optional known upper bound on the path cost; nodes whose f-score
+    exceeds it are never pushed (does not change the result, only the work).
+    heuristic: optional (h,w) array of admissible cost-to-goal bounds (e.g.
+    landmarks.heuristic_for) used instead of the straight-line distance; the cost
+    stays optimal, ties between equally cheap paths may break differently.
+    stats: optional dict; the number of expanded nodes and heap pushes are added to
+    stats["expanded"] and stats["pushes"], the largest open-set size (stale heap
+    entries included) is kept in stats["peak_open"].
+    should_stop: optional zero-argument callable, checked every 1024 expansions;
+    the search raises RouteCancelled once it returns True.
+    """
+    h, w = cost_grid.shape
+    sx, sy = start
+    gx, gy = goal
+    if not math.isfinite(cost_grid[sy, sx]):
+        raise ValueError("Start is impassable")
+    if not math.isfinite(cost_grid[gy, gx]):
+        raise ValueError("Goal is impassable")
+
+    costs, stride = _padded_costs(cost_grid)
+    hvals = None if heuristic is None else _padded_costs(np.asarray(heuristic, dtype=np.float64))[0]
+    n = len(costs)
+    offsets = _neighbor_offsets(stride, diagonal)
+    gscore = array("d", [math.inf]) * n
+    parent = array("i", [-1]) * n
+    closed = bytearray(n)
+    expanded = pops = peak = 0
+
+    start_id = (sx + 1) * stride + (sy + 1)
+    goal_id = (gx + 1) * stride + (gy + 1)
+    gxp, gyp = gx + 1, gy + 1
+    hypot = math.hypot
+    isfinite = math.isfinite
+    heappush, heappop = heapq.heappush, heapq.heappop
+
+    bound = math.inf if max_cost is None else max_cost + 1e-9
+    gscore[start_id] = 0.0
+    h_start = hypot(gx - sx, gy - sy) if hvals is None else hvals[start_id]
+    open_set = [(h_start, 0.0, start_id)]
+    while open_set:
+        if len(open_set) > peak:
+            peak = len(open_set)
+        f, g, current = heappop(open_set)
+        pops += 1
+        if closed[current]:
+            continue
+        if current == goal_id:
+            if stats is not None:
+                _add_search_stats(stats, expanded, pops + len(open_set), peak)
+            path = []
+            cur = current
+            while cur != -1:
+                x, y = divmod(cur, stride)
+                path.append((x - 1, y - 1))
+                cur = parent[cur]
+            path.reverse()
+            return path, gscore[current]
+        closed[current] = 1
+        expanded += 1
+        if should_stop is not None and not expanded & 1023 and should_stop():
+            raise RouteCancelled()
+        g_cur = gscore[current]
+        c_cur = costs[current]
+        for off, step_len in offsets:
+            nb = current + off
+            c_nb = costs[nb]
+            if not isfinite(c_nb):
+                continue
+            tentative_g = g_cur + (c_cur + c_nb) / 2.0 * step_len
+            if tentative_g >= gscore[nb]:
+                continue
+            gscore[nb] = tentative_g
+            if closed[nb]:
+                continue # a_star only records parents when a node is popped
+            parent[nb] = current
+            if hvals is None:
+                x, y = divmod(nb, stride)
+                f_nb = tentative_g + hypot(gxp - x, gyp - y)
+            else:
+                f_nb = tentative_g + hvals[nb]
+            if f_nb > bound:
+                continue
+            heappush(open_set, (f_nb, tentative_g, nb))
+    if stats is not None:
+        _add_search_stats(stats, expanded, pops, peak)
+    return None, math.inf # no path
+
+def _add_search_stats(stats, expanded, pushes, peak_open):
+    stats["expanded"] = stats.get("expanded", 0) + expanded
+    stats["pushes"] = stats.get("pushes", 0) + pushes
+    stats["peak_open"] = max(stats.get("peak_open", 0), peak_open)
+
+def _unpad_ids(ids, stride, w):
+    """Padded column-major node ids -> row-major flat indices of the unpadded grid (-1 stays -1)."""
+    x = ids // stride - 1
+    y = ids % stride - 1
+    return np.where(ids < 0, -1, y * w + x).astype(np.int32)
+
+def dijkstra(cost_grid, source, diagonal=True, targets=None):
+    """
+    Single-source shortest path costs over the grid, same move costs as a_star.
+    Returns (dist, parent): dist is an (h,w) float64 array (inf = unreachable),
+    parent holds the row-major flat index (y*w+x) of each cell's predecessor, -1 if none.
+    Move costs are symmetric, so following parent from any cell walks a shortest
+    path back to source.
+    targets: optional iterable of (x,y); the search stops once all of them are settled.
+    """
+    h, w = cost_grid.shape
+    sx, sy = source
+    if not math.isfinite(cost_grid[sy, sx]):
+        raise ValueError("Source is impassable")
+    costs, stride = _padded_costs(cost_grid)
+    n = len(costs)
+    offsets = _neighbor_offsets(stride, diagonal)
+    dist = array("d", [math.inf]) * n
+    parent = array("i", [-1]) * n
+    closed = bytearray(n)
+    remaining = None
+    if targets is not None:
+        remaining = {(x + 1) * stride + (y + 1) for x, y in targets}
+    isfinite = math.isfinite
+    heappush, heappop = heapq.heappush, heapq.heappop
+
+    source_id = (sx + 1) * stride + (sy + 1)
+    dist[source_id] = 0.0
+    open_set = [(0.0, source_id)]
+    while open_set:
+        d, current = heappop(open_set)
+        if closed[current]:
+            continue
+        closed[current] = 1
+        if remaining is not None:
+            remaining.discard(current)
+            if not remaining:
+                break
+        c_cur = costs[current]
+        for off, step_len in offsets:
+            nb = current + off
+            c_nb = costs[nb]
+            if closed[nb] or not isfinite(c_nb):
+                continue
+            nd = d + (c_cur + c_nb) / 2.0 * step_len
+            if nd < dist[nb]:
+                dist[nb] = nd
+                parent[nb] = current
+                heappush(open_set, (nd, nb))
+
+    dist_grid = np.frombuffer(dist, dtype=np.float64).reshape(w + 2, stride)[1:-1, 1:-1].T.copy()
+    parent_ids = np.frombuffer(parent, dtype=np.int32).reshape(w + 2, stride)[1:-1, 1:-1].T
+    return dist_grid, _unpad_ids(parent_ids, stride, w)
+
+def goal_field(cost_grid, goal, key=None, cache=None, diagonal=True):
+    """
+    Distance/predecessor field rooted at goal (see dijkstra), cached per (map, goal)
+    next to the cost grid when a cache and map key are given. Goals are arbitrary
+    pixels, so fields stay in the cache's memory LRU only (never written to disk)
+    and distances are kept as float32 (one field = 8 bytes per cell).
+    """
+    gx, gy = int(goal[0]), int(goal[1])
+    if not math.isfinite(cost_grid[gy, gx]):
+        raise ValueError("Goal is impassable")     # dijkstra would call it the source
+    name = f"field{'d' if diagonal else ''}_{gx}_{gy}"
+    if cache is not None and key is not None:
+        dist = cache.get(key, name=f"{name}_dist")
+        parent = cache.get(key, name=f"{name}_parent")
+        if dist is not None and parent is not None:
+            return dist, parent
+    dist, parent = dijkstra(cost_grid, (gx, gy), diagonal)
+    dist = dist.astype(np.float32)
+    if cache is not None and key is not None:
+        dist = cache.put(key, dist, name=f"{name}_dist", persist=False)
+        parent = cache.put(key, parent, name=f"{name}_parent", persist=False)
+    return dist, parent
+
+def path_from_field(dist, parent, start):
+    """Walk a goal-rooted field from start. Returns (path as (N,2) int array, cost) or (None, inf)."""
+    h, w = dist.shape
+    sx, sy = int(start[0]), int(start[1])
+    cost = float(dist[sy, sx])
+    if not math.isfinite(cost):
+        return None, math.inf
+    flat_parent = parent.reshape(-1)
+    idx = sy * w + sx
+    nodes = []
+    while idx != -1:
+        nodes.append(idx)
+        idx = int(flat_parent[idx])
+    nodes = np.array(nodes, dtype=np.int64)
+    return np.stack([nodes % w, nodes // w], axis=1).astype(np.int32), cost
+
+def path_cost(cost_grid, path):
+    """Cost of walking path on cost_grid with the same move costs as a_star."""
+    pts = np.asarray(path, dtype=np.int64).reshape(-1, 2)
+    if len(pts) < 2:
+        return 0.0
+    c = np.asarray(cost_grid)[pts[:, 1], pts[:, 0]]
+    step = np.hypot(*np.diff(pts, axis=0).T)
+    return float(((c[:-1] + c[1:]) / 2.0 * step).sum())
+
+def as_path_array(path):
+    """Path as an (N,2) int32 array of (x,y) rows; None/empty -> None."""
+    if path is None or len(path) == 0:
+        return None
+    return np.asarray(path, dtype=np.int32).reshape(-1, 2)
+
+def a_star_cpp(cost_grid, start, goal, diagonal=True):
+    """Run pathfinder_cpp.a_star and return (path, cost) with path as an (N,2) int32 array."""
+    # pathfinder_cpp expects list-of-lists
+    path_cpp, total_cost = pathfinder_cpp.a_star(np.asarray(cost_grid).tolist(), start, goal, diagonal)
+    return as_path_array(path_cpp), total_cost
+
 # Path simplification using line-of-sight check
 def line_of_sight_clear(p1, p2, cost_grid):
     # Bresenham-like sampling between p1 and p2; ensure no impassable pixel intersects the segment.
@@ -186,10 +509,213 @@ def simplify_path(path, cost_grid):
         i = j
     return simplified
 
+def _segments_clear(p, ends, blocked):
+    """
+    Line-of-sight from point p to each of ends ((m,2) array) in one batch.
+    Samples every segment like line_of_sight_clear, but all samples of all
+    segments are rounded and looked up in the blocked mask at once.
+    """
+    H, W = blocked.shape
+    x1, y1 = int(p[0]), int(p[1])
+    ends = np.asarray(ends, dtype=np.int64).reshape(-1, 2)
+    dx = ends[:, 0] - x1
+    dy = ends[:, 1] - y1
+    steps = np.maximum(np.abs(dx), np.abs(dy))
+    counts = steps + 1
+    seg = np.repeat(np.arange(len(ends)), counts)
+    i = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = i / np.maximum(steps, 1)[seg]
+    xi = np.round(x1 + dx[seg] * t).astype(np.int64)
+    yi = np.round(y1 + dy[seg] * t).astype(np.int64)
+    inb = (xi >= 0) & (xi < W) & (yi >= 0) & (yi < H)
+    bad = ~inb
+    bad[inb] = blocked[yi[inb], xi[inb]]
+    clear = np.bincount(seg, weights=bad, minlength=len(ends)) == 0
+    return clear | (steps == 0)
+
+def _simplify_los(pts, blocked, batch=64):
+    """Greedy farthest-visible simplification (same result as simplify_path), batched per origin."""
+    n = len(pts)
+    keep = [0]
+    i = 0
+    while i < n - 1:
+        j = i + 1
+        hi = n - 1
+        while hi > i + 1:
+            lo = max(i + 2, hi - batch + 1)
+            cand = np.arange(hi, lo - 1, -1)   # farthest first
+            clear = _segments_clear(pts[i], pts[cand], blocked)
+            if clear.any():
+                j = int(cand[np.argmax(clear)])
+                break
+            hi = lo - 1
+        keep.append(j)
+        i = j
+    return pts[keep]
+
+def _simplify_rdp(pts, blocked, epsilon):
+    """
+    Ramer-Douglas-Peucker that respects obstacles: a span is collapsed to its
+    endpoints only if every point lies within epsilon of the chord and the
+    chord itself has line of sight.
+    """
+    n = len(pts)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    fpts = pts.astype(np.float64)
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        (ax, ay), (bx, by) = fpts[a], fpts[b]
+        inner = fpts[a + 1:b]
+        length = math.hypot(bx - ax, by - ay)
+        if length == 0:
+            d = np.hypot(inner[:, 0] - ax, inner[:, 1] - ay)
+        else:
+            d = np.abs((bx - ax) * (ay - inner[:, 1]) - (ax - inner[:, 0]) * (by - ay)) / length
+        k = int(np.argmax(d))
+        if d[k] <= epsilon and _segments_clear(pts[a], pts[b:b + 1], blocked)[0]:
+            continue
+        m = a + 1 + k if d[k] > 0 else (a + b) // 2
+        keep[m] = True
+        stack.append((a, m))
+        stack.append((m, b))
+    return pts[keep]
+
+def simplify_path_fast(path, cost_grid=None, method="los", epsilon=SIMPLIFY_EPSILON, blocked=None):
+    """
+    Vectorized path simplification. Returns an (N,2) int array.
+    method: "los" = greedy line-of-sight (same output as simplify_path),
+            "rdp" = obstacle-aware Ramer-Douglas-Peucker with tolerance epsilon (pixels).
+    blocked: precomputed impassable mask (~isfinite(cost_grid)); pass it when
+             simplifying several paths on the same grid.
+    """
+    pts = as_path_array(path)
+    if pts is None or len(pts) <= 2:
+        return pts
+    if blocked is None:
+        blocked = ~np.isfinite(cost_grid)
+    if method == "los":
+        return _simplify_los(pts, blocked)
+    if method == "rdp":
+        return _simplify_rdp(pts, blocked, epsilon)
+    raise ValueError("method must be 'los' or 'rdp'")
+
+def _build_cost_grid_from_rgb(rgb, key=None, cache=None):
+    """
+    float32 cost grid for an (H,W,3) uint8 array, using the C++ builder if available.
+    With a cache, the terrain codes and their cost table are stored under key
+    (1 byte per pixel on disk); the float32 grid itself is only kept in memory.
+    """
+    use_cpp_cost_builder = _HAS_CPP and hasattr(pathfinder_cpp, "build_cost_grid")
+    if use_cpp_cost_builder:
+        # Optional C++ build_cost_grid if you implemented it
+        palette = np.array(list(COLOR_COST_MAP.keys()), dtype=np.uint8)   # (K,3)
+        costs   = np.array(list(COLOR_COST_MAP.values()), dtype=np.float64)
+        thr     = -1.0 if COLOR_MATCH_THRESHOLD is None else float(COLOR_MATCH_THRESHOLD)
+        cost_grid = np.asarray(pathfinder_cpp.build_cost_grid(rgb, palette, costs, thr), dtype=np.float32)
+        if cache is not None:
+            cost_grid = cache.put(key, cost_grid, name="grid32")
+        return cost_grid
+    codes, lut = build_terrain_codes(rgb, COLOR_COST_MAP, threshold=COLOR_MATCH_THRESHOLD)
+    cost_grid = cost_grid_from_codes(codes, lut)
+    if cache is not None:
+        cache.put(key, codes, name="codes")
+        cache.put(key, lut, name="lut")
+        cost_grid = cache.put(key, cost_grid, name="grid32", persist=False)
+    return cost_grid
+
+def _cached_cost_grid(key, cache):
+    """The float32 cost grid for key from memory, else rebuilt from cached terrain codes; None on a miss."""
+    if cache is None:
+        return None
+    cost_grid = cache.get(key, name="grid32")
+    if cost_grid is not None:
+        return cost_grid
+    codes = cache.get(key, name="codes")
+    lut = cache.get(key, name="lut")
+    if codes is None or lut is None:
+        return None
+    return cache.put(key, cost_grid_from_codes(codes, lut), name="grid32", persist=False)
+
+def _map_bytes(data):
+    """Raw bytes of a map source: bytes, or an object with a lazy .data (mapfetch.FetchedMap)."""
+    return data.data if hasattr(data, "content_hash") else data
+
+def load_cost_grid(data, cache=None):
+    """
+    Cost grid for raw image bytes (or a mapfetch.FetchedMap, whose known content
+    hash is used as is and whose bytes are only read on a cache miss).
+    Returns (cost_grid, key, im): key is the content-addressed cache key, im is the
+    decoded RGB image or None when the grid came from the cache (decoding was skipped).
+    """
+    if hasattr(data, "content_hash"):
+        image_hash = data.content_hash
+    else:
+        image_hash = gridcache.content_hash(data)
+    key = gridcache.grid_key(image_hash, COLOR_COST_MAP, COLOR_MATCH_THRESHOLD)
+    cost_grid = _cached_cost_grid(key, cache)
+    if cost_grid is not None:
+        return cost_grid, key, None
+    im = Image.open(BytesIO(_map_bytes(data))).convert("RGB")
+    print("Building cost grid from colors...")
+    cost_grid = _build_cost_grid_from_rgb(np.asarray(im, dtype=np.uint8), key, cache)
+    return cost_grid, key, im
+
+def load_cost_grid_from_image(im, cache=None):
+    """
+    Cost grid for an already decoded PIL image or (H,W,3) uint8 array.
+    Keyed by a hash of the pixel data, so the same picture hits the cache no matter
+    how it was delivered. Returns (cost_grid, key, im) with im as an RGB PIL image.
+    """
+    if isinstance(im, np.ndarray):
+        rgb = np.ascontiguousarray(im[..., :3], dtype=np.uint8)
+        im = Image.fromarray(rgb, "RGB")
+    else:
+        im = im.convert("RGB")
+        rgb = np.asarray(im, dtype=np.uint8)
+    digest = gridcache.content_hash(repr(rgb.shape).encode() + rgb.tobytes())
+    key = gridcache.grid_key(digest, COLOR_COST_MAP, COLOR_MATCH_THRESHOLD)
+    cost_grid = _cached_cost_grid(key, cache)
+    if cost_grid is None:
+        print("Building cost grid from colors...")
+        cost_grid = _build_cost_grid_from_rgb(rgb, key, cache)
+    return cost_grid, key, im
+
+def _load_map(source, cache=None):
+    """
+    main() accepts a file path, raw image bytes, a mapfetch.FetchedMap, a PIL image or an RGB array.
+    Returns (cost_grid, key, im, data); im may be None (grid from cache, decode
+    later from data if a picture is needed).
+    """
+    if hasattr(source, "content_hash"):
+        data = source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    elif isinstance(source, (Image.Image, np.ndarray)):
+        return load_cost_grid_from_image(source, cache) + (None,)
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    return load_cost_grid(data, cache=cache) + (data,)
+
 # -------------------------
 # Main CLI
 # -------------------------
 
+def check_viewport(viewport, shape):
+    """Raise ValueError unless viewport (x0, y0, x1, y1) is a non-empty rectangle inside a map of shape (h, w)."""
+    if viewport is None:
+        return
+    h, w = shape
+    if len(viewport) != 4:
+        raise ValueError("viewport must be x0,y0,x1,y1")
+    x0, y0, x1, y1 = viewport
+    if not (0 <= x0 < x1 <= w and 0 <= y0 < y1 <= h):
+        raise ValueError(f"viewport must satisfy 0 <= x0 < x1 <= {w} and 0 <= y0 < y1 <= {h}")
+
 def parse_point(s, w, h):
     """Parse 'x,y' or 'x y' and clamp within image bounds."""
     if s is None:
@@ -206,32 +732,130 @@ def parse_point(s, w, h):
     y = max(0, min(h - 1, y))
     return x, y
 
+@dataclass(frozen=True)
+class RouteOptions:
+    """
+    Everything that shapes the routes main() finds and how they are returned; start,
+    goal and the per-call hooks (should_stop, memory_report, search_stats,
+    route_stats) stay arguments of main(). route_legs() uses the backend, cache,
+    hierarchical/exact/field, workers and output fields and ignores the rest.
+
+    :param use_cpp: Use C++ A* if available
+    :param k: number of diverse routes to find
+    :param overlap_max: max Jaccard overlap allowed between any two kept routes
+    :param mode: "penalize" (soft diversity) or "disjoint" (hard masking)
+    :param penalty: base penalty to add near previous paths (penalize mode)
+    :param radius: neighborhood radius used by penalty/masking
+    :param decay: penalty decay factor with distance (0..1]
+    :param use_cache: look up / store the cost grid in gridcache.default_cache
+    :param hierarchical: find the first route through the HPA* abstract graph (built once per map)
+    :param exact: with hierarchical, return the exact optimum instead of the corridor route
+    :param field: answer the first route by walking a distance field rooted at goal,
+                  computed once per (map, goal) and cached; routes 2..k still need
+                  a search each, so use k=1 for repeat goals without any search
+    :param pyramid: run every A* coarse-to-fine: solve on a pooled grid, then at full
+                    resolution inside a corridor around that route (see pyramid.find_path);
+                    falls back to a full search when the corridor has no route
+    :param pyramid_factor: pooling factor for pyramid mode
+    :param landmarks: number of ALT landmarks; their distance fields are computed once per
+                      map and cached, and full-grid A* searches then use the landmark
+                      lower bound instead of the straight-line heuristic (same costs,
+                      fewer expansions). Not used for pyramid/hierarchical/parallel searches
+    :param incremental: answer the first route with the session planner for (map, goal)
+                        (see incremental.py); a start moved a few pixels since the last
+                        call only re-expands the few nodes affected. Routes 2..k are
+                        fresh searches on the penalised grid, so use k=1 to stay incremental
+    :param overlap_buffer: if > 0, overlap is the fraction of a candidate lying within this
+                           radius of an accepted route (catches near-parallel routes)
+                           instead of exact-pixel Jaccard
+    :param parallel: run candidate searches with different penalty/radius settings
+                     in parallel (see parallel_routes), picking the cheapest acceptable one
+    :param workers: number of worker processes for parallel mode (default: one per CPU); the
+                    pool is created by the first parallel call and reused afterwards
+    :param time_budget: wall-clock limit for finding routes 2..k; the routes accepted
+                        by then are returned
+    :param simplify: path simplifier: "los" (greedy line of sight), "rdp" (obstacle-aware
+                     Ramer-Douglas-Peucker) or "none"; None uses "los" if SIMPLIFY_PATH
+    :param simplify_epsilon: RDP tolerance in pixels
+    :param outpath: where the rendered routes are saved (ignored with return_image)
+    :param return_image: don't touch the filesystem; return (results, image_bytes),
+                         or (None, None) if no route was found
+    :param viewport, scale, image_format, quality: rendering options, see draw_path_on_image.
+                  image_format "json", "geojson" or "polyline" skips rendering and returns the
+                  routes encoded by routeformat.encode_routes instead of an image
+    :param bounds: with vector output, give coordinates as lat/lng inside these map bounds
+    """
+    use_cpp: bool = True
+    k: int = 3                          # how many routes to try to find
+    overlap_max: float = 0.50           # max allowed Jaccard overlap with any accepted route
+    mode: str = "penalize"              # "penalize" or "disjoint"
+    penalty: float = 6.0                # base penalty for "penalize" mode
+    radius: int = 10                    # radius for penalty/masking around a path
+    decay: float = 0.6                  # penalty decays with distance in "penalize" mode
+    use_cache: bool = True              # reuse cost grids of previously seen maps
+    hierarchical: bool = False          # first route via the cached HPA* abstraction
+    exact: bool = False                 # with hierarchical: refine to the true optimum
+    field: bool = False                 # first route from a cached goal-rooted distance field
+    pyramid: bool = False               # coarse-to-fine search in a corridor around a downsampled route
+    pyramid_factor: int = None          # downsampling factor for pyramid (None: longest side ~512 cells)
+    landmarks: int = 0                  # >0: A* guided by this many cached landmark (ALT) distance fields
+    incremental: bool = False           # first route from a D* Lite planner kept per (map, goal) across calls
+    overlap_buffer: int = 0             # >0: score overlap within this many pixels of earlier routes
+    parallel: bool = False              # search candidates for routes 2..k on a process pool
+    workers: int = None                 # pool size for parallel mode
+    time_budget: float = None           # seconds; stop looking for more routes after this
+    simplify: str = None                # "los", "rdp" or "none"; None -> SIMPLIFY_PATH
+    simplify_epsilon: float = SIMPLIFY_EPSILON
+    outpath: str = "./static/path_result.png"
+    return_image: bool = False          # render in memory and return (results, image_bytes)
+    viewport: tuple = None              # (x0, y0, x1, y1) to render only part of the map
+    scale: float = 1.0                  # < 1 for a downscaled preview
+    image_format: str = "png"           # "png", "webp", "jpeg", or "json"/"geojson"/"polyline" for vector output
+    quality: int = 85                   # webp/jpeg quality
+    bounds: tuple = None                # (north, west, south, east) of the map for lat/lng vector output
+
+    @classmethod
+    def merge(cls, options=None, overrides=None):
+        """options (None: the defaults) with the fields named in overrides replaced; unknown names raise TypeError."""
+        options = cls() if options is None else options
+        return replace(options, **overrides) if overrides else options
+
 def main(
     fname: str,
     start: tuple = None,
     goal: tuple = None,
-    use_cpp: bool = True,
-    k: int = 3,                 # how many routes to try to find
-    overlap_max: float = 0.50,  # max allowed Jaccard overlap with any accepted route
-    mode: str = "penalize",     # "penalize" or "disjoint"
-    penalty: float = 6.0,       # base penalty for "penalize" mode
-    radius: int = 10,            # radius for penalty/masking around a path
-    decay: float = 0.6          # penalty decays with distance in "penalize" mode
+    options: RouteOptions = None,
+    should_stop=None,           # callable; main raises RouteCancelled between stages once it returns True
+    memory_report=None,         # memreport.MemoryReport to record this request's array sizes in
+    search_stats: dict = None,  # filled with search counters, e.g. {"expanded": nodes}
+    route_stats=None,           # routestats.RouteStats to record stage timings, counters and cache outcome in
+    **overrides                 # RouteOptions fields, e.g. main(fname, k=1, field=True)
     ):
     """
     Run pathfinding on an image and return up to K diverse routes.
 
-    :param fname: Path to the map image (PNG/JPG)
+    :param fname: Path to the map image (PNG/JPG), its raw bytes, a mapfetch.FetchedMap,
+                  a PIL image or an (H,W,3) array
     :param start: Optional (x,y)
     :param goal : Optional (x,y)
-    :param use_cpp: Use C++ A* if available
-    :param k: number of diverse routes to find
-    :param overlap_max: max Jaccard overlap allowed between any two kept routes
-    :param mode: "penalize" (soft diversity) or "disjoint" (hard masking)
-    :param penalty: base penalty to add near previous paths (penalize mode)
-    :param radius: neighborhood radius used by penalty/masking
-    :param decay: penalty decay factor with distance (0..1]
+    :param options: RouteOptions for the search and the output; None for the defaults
+    :param overrides: RouteOptions fields to replace in options, so main(fname, k=1)
+                      still works
+    :param should_stop: optional zero-argument callable checked between stages (after the
+                        grid, after each route, before simplifying and drawing); when it
+                        returns True main raises RouteCancelled
+    :param memory_report: optional memreport.MemoryReport; main records the bytes of the
+                          grid, work grid, overlays and search state in it (the caller
+                          starts/stops it, e.g. around the whole request for a traced peak)
+    :param search_stats: optional dict; "expanded" receives the number of nodes the Python
+                         A* expanded over all searches, "pushes" its heap pushes and
+                         "peak_open" the largest open set (the C++ engine reports none of these)
+    :param route_stats: optional routestats.RouteStats; main adds the time spent building
+                        the grid, searching, applying overlays, simplifying and rendering,
+                        whether the cost grid came from the cache, the simplification ratio
+                        and the total time. Its counters are the search_stats dict
     """
+    opts = RouteOptions.merge(options, overrides)
     # --- optional import of external overlap helper ---
  
     import pythonextensions.overlap as _overlap_mod
@@ -240,155 +864,435 @@ def main(
 
 
     start_time = time.time()
+    _stage = route_stats.stage if route_stats is not None else (lambda name: nullcontext())
 
-    im = Image.open(fname).convert("RGB")
-    w, h = im.size
-    print(f"Loaded image {fname} ({w}x{h})")
-
-    # --- Build cost grid -----------------------------------------------
-    rgb     = np.asarray(im.convert("RGB"), dtype=np.uint8)
-    palette = np.array(list(COLOR_COST_MAP.keys()), dtype=np.uint8)   # (K,3)
-    costs   = np.array(list(COLOR_COST_MAP.values()), dtype=np.float64)
-    thr     = -1.0 if COLOR_MATCH_THRESHOLD is None else float(COLOR_MATCH_THRESHOLD)
+    def _checkpoint():
+        if should_stop is not None and should_stop():
+            raise RouteCancelled()
 
-    print("Building cost grid from colors...")
-    use_cpp_cost_builder = _HAS_CPP and hasattr(pathfinder_cpp, "build_cost_grid")
-    if use_cpp_cost_builder:
-        # Optional C++ build_cost_grid if you implemented it
-        cost_grid = pathfinder_cpp.build_cost_grid(rgb, palette, costs, thr)
-    else:
-        cost_grid = build_cost_grid(im, COLOR_COST_MAP, threshold=COLOR_MATCH_THRESHOLD)
+    cache = gridcache.default_cache if opts.use_cache else None
+    with _stage("grid"):
+        cost_grid, map_key, im, data = _load_map(fname, cache=cache)
+    if route_stats is not None and cache is not None and data is not None:
+        # decoded image sources always come back with im; only byte sources tell a hit apart
+        route_stats.cache["grid"] = "hit" if im is None else "miss"
+    h, w = cost_grid.shape
+    check_viewport(opts.viewport, cost_grid.shape)
+    source = fname if isinstance(fname, str) else type(fname).__name__
+    print(f"Loaded map {source} ({w}x{h}), cost grid {'from cache' if im is None else 'ready'}")
+    _record = memory_report.record if memory_report is not None else lambda name, nbytes: None
+    _record("grid", cost_grid.nbytes)
+    _record("search", _search_bytes(cost_grid))
+    _checkpoint()
 
     # --- Defaults for start/goal ---------------------------------------
     start = start if start else (0, 0)
     goal  = goal  if goal  else (w - 1, h - 1)
+    for x, y in (start, goal):
+        if not (0 <= x < w and 0 <= y < h):
+            raise ValueError(f"Point {(x, y)} is outside the map")
     print(f"Start: {start}, Goal: {goal}")
 
     # --- A* backend picker ---------------------------------------------
-    def _run_astar(grid):
-        if use_cpp and _HAS_CPP:
-            # pathfinder_cpp expects list-of-lists
-            path_cpp, total_cost = pathfinder_cpp.a_star(grid.tolist(), start, goal, DIAGONAL_MOVEMENT)
-            path = [(int(x), int(y)) for (x, y) in path_cpp] if path_cpp else None
-            return path, total_cost
+    # Both backends hand back paths as (N,2) int arrays (or None).
+    stats = search_stats if search_stats is not None else {}
+    stats.setdefault("expanded", 0)
+    if route_stats is not None:
+        route_stats.counters = stats
+
+    def _search(grid, s, g, diagonal, heuristic=None):
+        # the compiled module has no heuristic input, so landmark searches stay in Python
+        if opts.use_cpp and _HAS_CPP and heuristic is None:
+            return a_star_cpp(grid, s, g, diagonal=diagonal)
         else:
-            return a_star(grid, start, goal, diagonal=DIAGONAL_MOVEMENT)
+            path, total_cost = a_star_array(grid, s, g, diagonal=diagonal, heuristic=heuristic, stats=stats)
+            return as_path_array(path), total_cost
+
+    # Landmark lower bounds towards goal; valid for every penalised/masked grid below too
+    alt_heuristic = None
+    if opts.landmarks and not (opts.pyramid or opts.hierarchical or opts.field or opts.incremental):
+        import pythonextensions.landmarks as _landmarks
+        with _stage("landmarks"):
+            _, landmark_dists = _landmarks.load_or_build(cost_grid, map_key, cache, n=opts.landmarks,
+                                                         diagonal=DIAGONAL_MOVEMENT)
+            alt_heuristic = _landmarks.heuristic_for(landmark_dists, goal)
+        _record("landmarks", landmark_dists.nbytes)
+        _record("heuristic", alt_heuristic.nbytes)
+
+    pyramid_factor = opts.pyramid_factor
+    if opts.pyramid:
+        import pythonextensions.pyramid as _pyramid
+        pyramid_factor = pyramid_factor or _pyramid.pick_factor(cost_grid.shape)
+
+    def _run_astar(grid, coarse=None):
+        if opts.pyramid:
+            return _pyramid.find_path(grid, start, goal, factor=pyramid_factor, diagonal=DIAGONAL_MOVEMENT,
+                                      coarse=coarse, search=_search)
+        return _search(grid, start, goal, DIAGONAL_MOVEMENT, heuristic=alt_heuristic)
 
     # --- Find the first (shortest) route --------------------------------
     try:
-        path0, cost0 = _run_astar(cost_grid)
+        with _stage("search"):
+            if opts.field:
+                if not math.isfinite(cost_grid[start[1], start[0]]):
+                    raise ValueError("Start is impassable")
+                dist, parent = goal_field(cost_grid, goal, map_key, cache, diagonal=DIAGONAL_MOVEMENT)
+                _record("field", dist.nbytes + parent.nbytes)
+                path0, cost0 = path_from_field(dist, parent, start)
+            elif opts.hierarchical:
+                from pythonextensions.hpa import AbstractGraph
+                # fail before paying for a graph build
+                if not math.isfinite(cost_grid[start[1], start[0]]):
+                    raise ValueError("Start is impassable")
+                if not math.isfinite(cost_grid[goal[1], goal[0]]):
+                    raise ValueError("Goal is impassable")
+                graph = AbstractGraph.load_or_build(cost_grid, map_key, cache, diagonal=DIAGONAL_MOVEMENT)
+                path0, cost0 = graph.find_path(start, goal, exact=opts.exact)
+            elif opts.incremental:
+                import pythonextensions.incremental as _incremental
+                session = _incremental.default_sessions.get(
+                    (map_key, tuple(goal), DIAGONAL_MOVEMENT),
+                    lambda: _incremental.IncrementalPlanner(cost_grid, goal, DIAGONAL_MOVEMENT))
+                with session.lock:
+                    before = session.planner.expanded
+                    path0, cost0 = session.planner.plan(start)
+                    stats["expanded"] += session.planner.expanded - before
+            elif opts.pyramid and pyramid_factor > 1:
+                # the base grid's coarse level is cached with the map
+                coarse = _pyramid.coarse_grid(cost_grid, pyramid_factor, map_key, cache)
+                path0, cost0 = _run_astar(cost_grid, coarse)
+            else:
+                path0, cost0 = _run_astar(cost_grid)
     except ValueError as e:
         print("Error:", e)
-        return
+        return (None, None) if opts.return_image else None
 
-    if not path0:
+    if path0 is None:
         print("No path found.")
-        return
+        return (None, None) if opts.return_image else None
 
     results = [{'path': path0, 'cost': cost0}]
     print(f"Route 1: nodes={len(path0)}, cost≈{cost0:.2f}")
 
+    if opts.mode not in ("penalize", "disjoint"):
+        raise ValueError("mode must be 'penalize' or 'disjoint'")
+    deadline = None if opts.time_budget is None else start_time + opts.time_budget
+    k = opts.k
+
+    # --- Parallel diverse routes ------------------------------------------
+    if opts.parallel and k > 1:
+        from pythonextensions.parallel_routes import find_diverse_routes
+        remaining = None if deadline is None else max(0.0, deadline - time.time())
+        with _stage("search"):
+            results = find_diverse_routes(cost_grid, start, goal, results[0], k=k,
+                                          overlap_max=opts.overlap_max, mode=opts.mode,
+                                          penalty=opts.penalty, radius=opts.radius, decay=opts.decay,
+                                          overlap_buffer=opts.overlap_buffer, use_cpp=opts.use_cpp,
+                                          workers=opts.workers, time_budget=remaining, key=map_key)
+        k = 1   # skip the sequential loop below
+
     # --- Iteratively find more diverse routes ---------------------------
+    # Overlays accumulate the penalty/mask of each accepted route once and are
+    # reused by every later iteration (the escalated one is only built if needed).
+    if opts.mode == "penalize":
+        overlay = _overlap_mod.PenaltyOverlay(cost_grid.shape, base_penalty=opts.penalty, radius=opts.radius,
+                                              decay=opts.decay)
+    else:
+        overlay = _overlap_mod.MaskOverlay(cost_grid.shape, radius=opts.radius)
+    escalated = None
+    # one work grid, overwritten by the overlays in every iteration
+    work = np.empty_like(cost_grid) if k > 1 else None
+    if work is not None:
+        _record("work", work.nbytes)
+    paths = [path0]
+    footprints = [_overlap_mod.RouteFootprint(path0, cost_grid.shape)]
+
+    def _overlap_ok(path):
+        cells = _overlap_mod._path_raster(path, cost_grid.shape)
+        return all(fp.overlap(cells, opts.overlap_buffer) <= opts.overlap_max for fp in footprints)
+
     for i in range(2, k + 1):
-        # Start from the base grid each iteration (fresh penalties/masks)
-        work_grid = cost_grid
-        if mode == "penalize":
-            # Apply soft penalties around *all* previously accepted paths
-            for r in results:
-                work_grid = _overlap_mod._penalize_cost_grid(work_grid, r['path'],
-                                                base_penalty=penalty, radius=radius, decay=decay)
-        elif mode == "disjoint":
-            for r in results:
-                work_grid = _overlap_mod._mask_out_path(work_grid, r['path'], radius=radius)
-        else:
-            raise ValueError("mode must be 'penalize' or 'disjoint'")
+        _checkpoint()
+        if deadline is not None and time.time() >= deadline:
+            print(f"Route {i}: time budget used up; returning routes found so far.")
+            break
+        with _stage("overlay"):
+            if opts.mode == "penalize":
+                # Apply soft penalties around *all* previously accepted paths
+                work_grid = overlay.sync(paths).apply(cost_grid, out=work)
+            else:
+                work_grid = overlay.sync(paths).apply(cost_grid, keep=(start, goal), out=work)
 
-        cand_path, cand_cost = _run_astar(work_grid)
-        if not cand_path:
+        with _stage("search"):
+            cand_path, cand_cost = _run_astar(work_grid)
+        if cand_path is None:
             print(f"Route {i}: no path (stopping).")
             break
 
         # Check overlap against all accepted routes
-        ok = all(_overlap_mod._jaccard_overlap(r['path'], cand_path) <= overlap_max for r in results)
+        ok = _overlap_ok(cand_path)
 
         # In penalize mode we can try once with stronger settings if too similar
-        if not ok and mode == "penalize":
-            work_grid = cost_grid
+        if not ok and opts.mode == "penalize":
             # escalate penalty / radius a bit
-            for r in results:
-                work_grid = _overlap_mod._penalize_cost_grid(work_grid, r['path'],
-                                                base_penalty=penalty * 1.5, radius=radius + 1, decay=decay)
-            cand_path, cand_cost = _run_astar(work_grid)
-            if cand_path:
-                ok = all(_overlap_mod._jaccard_overlap(r['path'], cand_path) <= overlap_max for r in results)
+            if escalated is None:
+                escalated = _overlap_mod.PenaltyOverlay(cost_grid.shape, base_penalty=opts.penalty * 1.5,
+                                                        radius=opts.radius + 1, decay=opts.decay)
+            with _stage("overlay"):
+                work_grid = escalated.sync(paths).apply(cost_grid, out=work)
+            with _stage("search"):
+                cand_path, cand_cost = _run_astar(work_grid)
+            if cand_path is not None:
+                ok = _overlap_ok(cand_path)
 
-        if ok and cand_path:
+        if ok and cand_path is not None:
             results.append({'path': cand_path, 'cost': cand_cost})
+            paths.append(cand_path)
+            footprints.append(_overlap_mod.RouteFootprint(cand_path, cost_grid.shape))
             print(f"Route {i}: nodes={len(cand_path)}, cost≈{cand_cost:.2f}")
         else:
-            print(f"Route {i}: too similar (overlap > {overlap_max:.2f}); stopping.")
+            print(f"Route {i}: too similar (overlap > {opts.overlap_max:.2f}); stopping.")
             break
+    if k > 1:
+        _record("overlay", overlay.nbytes + (escalated.nbytes if escalated is not None else 0))
 
     # --- Save images for all routes ------------------------------------
     
-    if SIMPLIFY_PATH:
-        for r in results:
-            before = len(r['path'])
-            r['path'] = simplify_path(r['path'], cost_grid)
-            after = len(r['path'])
-            print(f"Simplified route from {before} -> {after} nodes")
-            
-    draw_path_on_image(im, results, width=5)
-    
+    _checkpoint()
+    image_bytes = _simplify_and_render(results, cost_grid, im, data, opts.simplify, opts.simplify_epsilon,
+                                       None if opts.return_image else opts.outpath, opts.viewport, opts.scale,
+                                       opts.image_format, opts.quality, opts.bounds, _checkpoint,
+                                       memory_report=memory_report, route_stats=route_stats)
 
     end_time = time.time()
+    if stats["expanded"]:
+        print(f"Expanded {stats['expanded']} nodes{' (landmarks)' if alt_heuristic is not None else ''}")
     print(f"Took {end_time - start_time:.3f} seconds total")
+    if memory_report is not None:
+        print(memory_report)
+    if route_stats is not None:
+        route_stats.total = end_time - start_time
+        print(route_stats)
+
+    if opts.return_image:
+        return results, image_bytes
+    return results
+
+def _search_bytes(cost_grid):
+    """Approximate memory of one a_star_array/dijkstra run: padded costs, g-scores, parents, closed flags."""
+    h, w = cost_grid.shape
+    itemsize = 4 if np.asarray(cost_grid).dtype == np.float32 else 8
+    return (h + 2) * (w + 2) * (itemsize + 8 + 4 + 1)
+
+def _simplify_and_render(results, cost_grid, im, data, simplify, simplify_epsilon, outpath,
+                         viewport, scale, image_format, quality, bounds, checkpoint, extra=None,
+                         memory_report=None, route_stats=None):
+    """Simplify the routes in place, then draw them (or encode them as vectors). Returns the bytes or None if saved."""
+    stage = route_stats.stage if route_stats is not None else (lambda name: nullcontext())
+    if simplify is None:
+        simplify = "los" if SIMPLIFY_PATH else "none"
+    if simplify != "none":
+        with stage("simplify"):
+            blocked = ~np.isfinite(cost_grid)
+            for r in results:
+                before = r['raw_nodes'] = len(r['path'])
+                r['path'] = simplify_path_fast(r['path'], method=simplify, epsilon=simplify_epsilon,
+                                               blocked=blocked)
+                after = len(r['path'])
+                if route_stats is not None:
+                    route_stats.simplified(before, after)
+                print(f"Simplified route from {before} -> {after} nodes ({simplify})")
+
+    checkpoint()
+    with stage("render"):
+        if image_format in routeformat.VECTOR_FORMATS:
+            # the client draws the routes; no need to decode the map at all
+            image_bytes = routeformat.encode_routes(results, image_format, cost_grid.shape, bounds=bounds,
+                                                    extra=extra)
+            if outpath is None:
+                return image_bytes
+            with open(outpath, "wb") as f:
+                f.write(image_bytes)
+            return None
+        if im is None:
+            im = Image.open(BytesIO(_map_bytes(data))).convert("RGB")
+        if memory_report is not None:
+            memory_report.record("image", im.width * im.height * 3)
+        return draw_path_on_image(im, results, outpath=outpath, width=5,
+                                  viewport=viewport, scale=scale, image_format=image_format, quality=quality)
 
+# Multi-leg courses: a batch of (start, goal) legs on one map
+MAX_LEGS = 50
+
+def route_legs(
+    fname,
+    points: list = None,        # ordered controls; leg i runs points[i] -> points[i+1]
+    legs: list = None,          # or an explicit list of (start, goal) pairs
+    options: RouteOptions = None,
+    should_stop=None,
+    memory_report=None,
+    **overrides                 # RouteOptions fields, as for main()
+    ):
+    """
+    Best route for every leg of a course, on a cost grid that is loaded once.
+
+    Either points (consecutive controls) or legs ((start, goal) pairs) must be given.
+    Identical legs are computed once. Plain A* legs run concurrently on a process pool
+    sharing the grid (see parallel_routes.find_legs); field/hierarchical legs reuse the
+    cached per-map structures and run in this process.
+    All legs are drawn into one image (or encoded together as vectors, with the total cost).
+
+    Returns results (one {'path', 'cost', 'start', 'goal', 'label'} per leg), or
+    (results, image_bytes) with return_image. If a leg has no route, nothing is
+    rendered and None / (None, None) is returned. options, should_stop and memory_report
+    as in main(); hierarchical and field legs run in this process, plain A* legs on the
+    shared pool of opts.workers processes (1 runs them in-process).
+    """
+    opts = RouteOptions.merge(options, overrides)
+    start_time = time.time()
+
+    def _checkpoint():
+        if should_stop is not None and should_stop():
+            raise RouteCancelled()
+
+    if legs is None:
+        if not points or len(points) < 2:
+            raise ValueError("Need at least two points")
+        legs = list(zip(points[:-1], points[1:]))
+    legs = [((int(a[0]), int(a[1])), (int(b[0]), int(b[1]))) for a, b in legs]
+    if not legs:
+        raise ValueError("Need at least one leg")
+    if len(legs) > MAX_LEGS:
+        raise ValueError(f"At most {MAX_LEGS} legs per batch")
+
+    cache = gridcache.default_cache if opts.use_cache else None
+    cost_grid, map_key, im, data = _load_map(fname, cache=cache)
+    h, w = cost_grid.shape
+    check_viewport(opts.viewport, cost_grid.shape)
+    print(f"Loaded map ({w}x{h}) for {len(legs)} legs")
+    if memory_report is not None:
+        memory_report.record("grid", cost_grid.nbytes)
+    _checkpoint()
+
+    unique = list(dict.fromkeys(legs))
+    found = {}
+    for a, b in unique:
+        for x, y in (a, b):
+            if not (0 <= x < w and 0 <= y < h):
+                raise ValueError(f"Point {(x, y)} is outside the map")
+    # a leg with a blocked end fails the whole batch; find out before building or searching anything
+    for i, (a, b) in enumerate(legs):
+        if not (math.isfinite(cost_grid[a[1], a[0]]) and math.isfinite(cost_grid[b[1], b[0]])):
+            print(f"Leg {i + 1} {a} -> {b}: start or goal is impassable.")
+            return (None, None) if opts.return_image else None
+    if opts.field or opts.hierarchical:
+        graph = None
+        if opts.hierarchical:
+            from pythonextensions.hpa import AbstractGraph
+            graph = AbstractGraph.load_or_build(cost_grid, map_key, cache, diagonal=DIAGONAL_MOVEMENT)
+        for a, b in unique:
+            _checkpoint()
+            try:
+                if graph is not None:
+                    found[(a, b)] = graph.find_path(a, b, exact=opts.exact)
+                elif not math.isfinite(cost_grid[a[1], a[0]]):
+                    found[(a, b)] = (None, math.inf)
+                else:
+                    dist, parent = goal_field(cost_grid, b, map_key, cache, diagonal=DIAGONAL_MOVEMENT)
+                    found[(a, b)] = path_from_field(dist, parent, a)
+            except ValueError:
+                found[(a, b)] = (None, math.inf)
+    else:
+        from pythonextensions.parallel_routes import find_legs
+        found = dict(zip(unique, find_legs(cost_grid, unique, use_cpp=opts.use_cpp, workers=opts.workers, key=map_key)))
+
+    results = []
+    for i, (a, b) in enumerate(legs):
+        path, cost = found[(a, b)]
+        if path is None:
+            print(f"Leg {i + 1} {a} -> {b}: no path found.")
+            return (None, None) if opts.return_image else None
+        results.append({'path': as_path_array(path).copy(), 'cost': cost, 'start': a, 'goal': b,
+                        'label': f"Leg {i + 1} ({cost:.2f})"})
+        print(f"Leg {i + 1}: nodes={len(path)}, cost≈{cost:.2f}")
+    total = sum(r['cost'] for r in results)
+    print(f"Total cost≈{total:.2f}")
+
+    _checkpoint()
+    image_bytes = _simplify_and_render(results, cost_grid, im, data, opts.simplify, opts.simplify_epsilon,
+                                       None if opts.return_image else opts.outpath, opts.viewport, opts.scale,
+                                       opts.image_format, opts.quality, opts.bounds, _checkpoint,
+                                       extra={"total_cost": round(float(total), 3)}, memory_report=memory_report)
+    print(f"Took {time.time() - start_time:.3f} seconds total")
+    if opts.return_image:
+        return results, image_bytes
     return results
 
-# Visualization helper (unchanged)
-def draw_path_on_image(im, results, outpath="./static/path_result.png", colors=[(255, 139, 13),(255, 0, 0),(45,16,255)], width=5, times = 1):
+# Visualization helper
+IMAGE_FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+
+def draw_path_on_image(im, results, outpath="./static/path_result.png", colors=[(255, 139, 13),(255, 0, 0),(45,16,255)], width=5, times = 1,
+                       viewport=None, scale=1.0, image_format="png", quality=85):
+    """
+    Draw the routes on the map. im may be a PIL image or an RGB array.
+    All routes, labels and endpoints go onto one overlay that is composited once.
+
+    viewport: optional (x0, y0, x1, y1) in map pixels; only that part is rendered
+    scale: < 1 renders a downscaled preview (line width stays in output pixels)
+    image_format: "png", "webp" or "jpeg"; quality applies to webp/jpeg
+    Saves to outpath, or with outpath=None returns the encoded image as bytes (no files touched).
+    """
     print("trying to draw lines")
     
-    im_rgb = im.convert("RGBA")
+    if isinstance(im, np.ndarray):
+        im = Image.fromarray(np.ascontiguousarray(im[..., :3], dtype=np.uint8), "RGB")
+    ox, oy = 0, 0
+    if viewport is not None:
+        ox, oy, x1, y1 = (int(v) for v in viewport)
+        ox, oy = max(0, ox), max(0, oy)
+        im = im.crop((ox, oy, min(x1, im.width), min(y1, im.height)))
+    if scale != 1.0:
+        im = im.resize((max(1, round(im.width * scale)), max(1, round(im.height * scale))), Image.BILINEAR)
+    base = im if im.mode == "RGBA" else im.convert("RGBA")
     font = ImageFont.load_default()
-    
+    overlay = Image.new("RGBA", base.size, (255,255,255,0))
+    draw = ImageDraw.Draw(overlay)
+    pad = 4
+    dot = max(2, width+2)
+
+    def to_px(path):
+        # center of pixels, shifted into the viewport and scaled
+        p = (np.asarray(path, dtype=np.float64).reshape(-1, 2) + 0.5 - (ox, oy)) * scale
+        return [tuple(q) for q in p.tolist()]
+
+    labels = []
     for i, r in enumerate(results):
-        color = colors[i%len(results)]
-        print("::inside loop::")
-        overlay = Image.new("RGBA", im.size, (255,255,255,0))
-        draw = ImageDraw.Draw(overlay)
-        # path is list of (x,y)
-        pts = [(x + 0.5, y + 0.5) for (x,y) in r['path']] # center of pixels
+        color = colors[i % len(colors)]
+        pts = to_px(r['path'])
         if len(pts) >= 2:
             draw.line(pts, fill=color + (200,), width=width, joint='curve')
-            
-            # draw endpoints
-            mid_idx = len(pts) // 2
-            label_pos = pts[mid_idx]
-
-            # draw label
-            label = r.get("label", f"Route {i+1} ({r['cost']:.2f})")
-            
-            bbox = draw.textbbox(label_pos, label, font=font)
-            x0, y0, x1, y1 = bbox
-
-            # add some padding around text
-            pad = 4
-            rect_coords = (x0 - pad, y0 - pad, x1 + pad, y1 + pad)
-
-            # draw white rectangle with slight transparency
-            draw.rectangle(rect_coords, fill=(255,255,255,200))
-            # Write text
-            draw.text(label_pos, label, fill=(0,0,0,255), font=font)
-            
+            labels.append((pts[len(pts) // 2], r.get("label", f"Route {i+1} ({r['cost']:.2f})")))
+    # labels and endpoints last so no route line covers them
+    for label_pos, label in labels:
+        x0, y0, x1, y1 = draw.textbbox(label_pos, label, font=font)
+        draw.rectangle((x0 - pad, y0 - pad, x1 + pad, y1 + pad), fill=(255,255,255,200))
+        draw.text(label_pos, label, fill=(0,0,0,255), font=font)
+    for r in results:
+        pts = to_px(r['path'])
         if pts:
-            r = max(2, width+2)
-            draw.ellipse([pts[0][0]-r, pts[0][1]-r, pts[0][0]+r, pts[0][1]+r], fill=(0,255,0,255))
-            draw.ellipse([pts[-1][0]-r, pts[-1][1]-r, pts[-1][0]+r, pts[-1][1]+r], fill=(0,0,255,255))
-        im_rgb = Image.alpha_composite(im_rgb, overlay)
-        
-    im_rgb.save(outpath)
+            draw.ellipse([pts[0][0]-dot, pts[0][1]-dot, pts[0][0]+dot, pts[0][1]+dot], fill=(0,255,0,255))
+            draw.ellipse([pts[-1][0]-dot, pts[-1][1]-dot, pts[-1][0]+dot, pts[-1][1]+dot], fill=(0,0,255,255))
+    out = Image.alpha_composite(base, overlay)
+
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    if pil_format == "JPEG":
+        out = out.convert("RGB")
+    save_kwargs = {} if pil_format == "PNG" else {"quality": quality}
+    if outpath is None:
+        buf = BytesIO()
+        out.save(buf, format=pil_format, **save_kwargs)
+        return buf.getvalue()
+    out.save(outpath, format=pil_format, **save_kwargs)
     print(f"Saved result to {outpath}")
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+import math
+import numpy as np
+
+import pythonextensions.pathfinder as pf
+
+# ---- Coarse-to-fine (pyramid) search ------------------------------------
+# On large scans most of the map is irrelevant to a route. We pool the cost
+# grid down by a factor, solve on the small grid, and then run the full
+# resolution A* only inside a corridor of coarse cells around the coarse
+# path (dilated by a margin). A coarse block counts as impassable only when
+# most of it is; blocks with some walls take the cost of their worst
+# passable pixel, so the coarse route avoids squeezing past obstacles. If the
+# corridor holds no route (the coarse level hid a wall or closed a gap) the
+# search falls back to the full grid. Routes are the optimum inside the
+# corridor: usually the true optimum, occasionally a few percent longer.
+
+# the coarse grid's longest side is brought down to about this many cells
+COARSE_TARGET = 512
+DEFAULT_MARGIN = 2
+# fraction of impassable pixels from which a coarse block is impassable
+MAX_BLOCKED = 0.5
+
+
+def pick_factor(shape, target=COARSE_TARGET):
+    """Smallest power-of-two factor that brings the longest side to <= target (1 if already small)."""
+    factor = 1
+    while max(shape) / factor > target:
+        factor *= 2
+    return factor
+
+def downsample(cost_grid, factor, pooling="mean", max_blocked=MAX_BLOCKED):
+    """
+    Pool cost_grid by factor x factor blocks. Returns a float64 grid of shape ceil(h/f) x ceil(w/f).
+
+    pooling: "max" (worst passable pixel) or "mean" of the passable pixels in a block;
+             blocks containing any impassable pixel always use the max
+    max_blocked: blocks with at least this fraction of impassable pixels are impassable
+    Costs are multiplied by factor, since one coarse step spans factor pixels.
+    """
+    h, w = cost_grid.shape
+    f = int(factor)
+    H, W = -(-h // f), -(-w // f)
+    padded = np.full((H * f, W * f), np.inf, dtype=np.float32 if cost_grid.dtype == np.float32 else np.float64)
+    padded[:h, :w] = cost_grid
+    real = np.zeros(padded.shape, dtype=bool)
+    real[:h, :w] = True
+    blocks = padded.reshape(H, f, W, f)
+    finite = np.isfinite(blocks)
+    n_real = real.reshape(H, f, W, f).sum(axis=(1, 3))
+    n_finite = finite.sum(axis=(1, 3))
+
+    worst = np.where(finite, blocks, -np.inf).max(axis=(1, 3))
+    if pooling == "max":
+        pooled = worst
+    elif pooling == "mean":
+        mean = np.where(finite, blocks, 0.0).sum(axis=(1, 3)) / np.maximum(n_finite, 1)
+        pooled = np.where(n_finite < n_real, worst, mean)
+    else:
+        raise ValueError("pooling must be 'max' or 'mean'")
+    blocked = (n_real - n_finite) >= max_blocked * n_real
+    return np.where(blocked | (n_finite == 0), np.inf, pooled * f)
+
+def coarse_grid(cost_grid, factor, key=None, cache=None, pooling="mean"):
+    """downsample() of a map's cost grid, stored in / read from the grid cache under key."""
+    name = f"pyr{factor}{pooling}"
+    if cache is not None and key is not None:
+        coarse = cache.get(key, name=name)
+        if coarse is not None:
+            return coarse
+    coarse = downsample(cost_grid, factor, pooling)
+    if cache is not None and key is not None:
+        coarse = cache.put(key, coarse, name=name)
+    return coarse
+
+
+def corridor_mask(coarse_path, coarse_shape, margin=DEFAULT_MARGIN):
+    """Bool mask over the coarse grid: the cells of coarse_path dilated by margin cells (square)."""
+    mask = np.zeros(coarse_shape, dtype=bool)
+    p = np.asarray(coarse_path).reshape(-1, 2)
+    mask[p[:, 1], p[:, 0]] = True
+    if margin > 0:
+        # separable square dilation by shifted ORs
+        for axis in (0, 1):
+            grown = mask.copy()
+            n = mask.shape[axis]
+            for d in range(1, min(margin, n - 1) + 1):
+                lo = [slice(None)] * 2
+                hi = [slice(None)] * 2
+                lo[axis], hi[axis] = slice(d, None), slice(None, -d)
+                grown[tuple(lo)] |= mask[tuple(hi)]
+                grown[tuple(hi)] |= mask[tuple(lo)]
+            mask = grown
+    return mask
+
+def _default_search(grid, start, goal, diagonal):
+    path, cost = pf.a_star_array(grid, start, goal, diagonal=diagonal)
+    return pf.as_path_array(path), cost
+
+def find_path(cost_grid, start, goal, factor=None, margin=DEFAULT_MARGIN, diagonal=True,
+              coarse=None, search=None, pooling="mean"):
+    """
+    Coarse-to-fine route from start to goal. Returns (path as (N,2) int array or None, cost).
+
+    factor: pooling factor (default: pick_factor)
+    margin: corridor half-width in coarse cells
+    coarse: precomputed downsample(cost_grid, factor) (e.g. from coarse_grid)
+    search: search(grid, start, goal, diagonal) -> (path array or None, cost) used for the
+            coarse, corridor and fallback searches; plain a_star_array by default
+    The result is the optimum inside the corridor; only the fallback is a full search.
+    """
+    search = search or _default_search
+    start = (int(start[0]), int(start[1]))
+    goal = (int(goal[0]), int(goal[1]))
+    h, w = cost_grid.shape
+    factor = factor or pick_factor(cost_grid.shape)
+    if factor <= 1:
+        return search(cost_grid, start, goal, diagonal)
+    if not math.isfinite(cost_grid[start[1], start[0]]):
+        raise ValueError("Start is impassable")
+    if not math.isfinite(cost_grid[goal[1], goal[0]]):
+        raise ValueError("Goal is impassable")
+
+    if coarse is None:
+        coarse = downsample(cost_grid, factor, pooling)
+    cs = (start[0] // factor, start[1] // factor)
+    cg = (goal[0] // factor, goal[1] // factor)
+    if not (np.isfinite(coarse[cs[1], cs[0]]) and np.isfinite(coarse[cg[1], cg[0]])):
+        # the endpoints sit in mostly-blocked blocks; open just those two
+        coarse = np.array(coarse)
+        for (x, y), (cx, cy) in ((start, cs), (goal, cg)):
+            if not np.isfinite(coarse[cy, cx]):
+                coarse[cy, cx] = cost_grid[y, x] * factor
+
+    coarse_path, _ = search(coarse, cs, cg, diagonal)
+    if coarse_path is not None:
+        mask = corridor_mask(coarse_path, coarse.shape, margin)
+        ys, xs = np.nonzero(mask)
+        x0, y0 = xs.min() * factor, ys.min() * factor
+        x1, y1 = min(w, (xs.max() + 1) * factor), min(h, (ys.max() + 1) * factor)
+        fine_mask = np.repeat(np.repeat(mask, factor, axis=0), factor, axis=1)[y0:y1, x0:x1]
+        sub = np.where(fine_mask, cost_grid[y0:y1, x0:x1], np.inf)
+        path, cost = search(sub, (start[0] - x0, start[1] - y0), (goal[0] - x0, goal[1] - y0), diagonal)
+        if path is not None:
+            return np.asarray(path, dtype=np.int32) + np.array([x0, y0], dtype=np.int32), cost
+        print("Pyramid: no route inside the corridor; falling back to a full search.")
+    else:
+        print("Pyramid: no coarse route; falling back to a full search.")
+    return search(cost_grid, start, goal, diagonal)
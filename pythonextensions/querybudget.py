@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+querybudget.py
+Count the SQL statements and result rows each page costs, and fail when a page
+goes over its budget (e.g. after a relationship went back to lazy="joined" or a
+loop started lazy-loading per row).
+Usage:
+  python -m pythonextensions.querybudget [--verbose]
+
+Seeds a throwaway SQLite database with a fixed set of clubs, races, carpools,
+comments and reservations, requests every page through the Flask test client
+and records the statements and the rows they returned per request. Exits with
+1 if any page exceeds its budget. DATABASE_URL is set before the app is
+imported, so the real database is never touched.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# seed sizes the budgets below are written for
+CLUBS = 5
+RACES_PER_CLUB = 2
+CARPOOLS_PER_RACE = 4
+COMMENTS_PER_CARPOOL = 3
+RESERVATIONS_PER_CARPOOL = 2
+
+# page -> (path, session values, max statements, max rows)
+BUDGETS = {
+    "home":            ("/", {}, 4, 125),
+    "for-klubber":     ("/for-klubber", {}, 4, 125),
+    "club-login":      ("/club-login", {}, 1, 5),
+    "club-dashboard":  ("/club-dashboard?club_name=club-0", {"club_id": 1, "club_name": "club-0"}, 5, 54),
+    "admin":           ("/admin", {"admin_login": "PASS"}, 3, 55),
+    "race-details":    ("/api/race-details", {}, 2, 50),
+    "carpool-locations": ("/api/carpool-locations", {}, 1, 40),
+}
+
+
+def seed(db, models):
+    """Fill an empty database with the fixed data set."""
+    Club, Race, Carpool, Comment, Reservation = models
+    soon = datetime.utcnow() + timedelta(days=7)
+    for c in range(CLUBS):
+        club = Club(name=f"club-{c}", password="pw", description=f"Club {c}")
+        db.session.add(club)
+        db.session.flush()
+        for r in range(RACES_PER_CLUB):
+            race = Race(name=f"race-{c}-{r}", club_id=club.id, club_level=bool(r % 2), description="",
+                        date=soon, latitude=55.0, longitude=12.0)
+            db.session.add(race)
+            db.session.flush()
+            for p in range(CARPOOLS_PER_RACE):
+                carpool = Carpool(club_level=bool(p % 2), event=race.name, owner=f"owner-{p}",
+                                  owner_email="owner@example.com", club_id=club.id, race_id=race.id,
+                                  description="", vacant_seats=3, departure_time=soon,
+                                  departure_place="here", latitude=55.0, longitude=12.0)
+                db.session.add(carpool)
+                db.session.flush()
+                for i in range(COMMENTS_PER_CARPOOL):
+                    db.session.add(Comment(carpool_id=carpool.id, author=f"author-{i}", text="hi"))
+                for i in range(RESERVATIONS_PER_CARPOOL):
+                    db.session.add(Reservation(carpool_id=carpool.id, passenger_name=f"p-{i}",
+                                               passenger_phone="1", passenger_email="p@example.com"))
+    db.session.commit()
+
+
+class StatementCounter:
+    """Engine listener counting statements and the rows each SELECT returns."""
+
+    def __init__(self):
+        self.statements = []    # (sql, rows)
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        rows = None
+        if statement.lstrip().upper().startswith("SELECT"):
+            # count on a separate cursor so the caller's result is left alone
+            rows = conn.connection.driver_connection.execute(
+                f"SELECT count(*) FROM ({statement})", parameters).fetchone()[0]
+        self.statements.append((statement, rows))
+
+    def reset(self):
+        self.statements = []
+
+    @property
+    def rows(self):
+        return sum(r for _, r in self.statements if r)
+
+
+def run(verbose=False):
+    """Request every page in BUDGETS. Returns [(page, statements, rows, max statements, max rows)]."""
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp.name, 'budget.db')}"
+    from sqlalchemy import event
+    import app as web
+    from pythonextensions.models import db, Club, Race, Carpool, Comment, Reservation
+
+    counter = StatementCounter()
+    report = []
+    with web.app.app_context():
+        seed(db, (Club, Race, Carpool, Comment, Reservation))
+        event.listen(db.engine, "after_cursor_execute", counter.after_cursor_execute)
+        try:
+            for page, (path, values, max_statements, max_rows) in BUDGETS.items():
+                client = web.app.test_client()
+                if values:
+                    with client.session_transaction() as sess:
+                        sess.update(values)
+                counter.reset()
+                response = client.get(path)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{page}: {path} answered {response.status_code}")
+                report.append((page, len(counter.statements), counter.rows, max_statements, max_rows))
+                if verbose:
+                    for sql, rows in counter.statements:
+                        print(f"  [{page}] {rows} rows: {' '.join(sql.split())[:160]}")
+        finally:
+            event.remove(db.engine, "after_cursor_execute", counter.after_cursor_execute)
+            db.engine.dispose()
+    tmp.cleanup()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check statements and rows per page against budgets.")
+    parser.add_argument("--verbose", action="store_true", help="print every statement")
+    args = parser.parse_args(argv)
+    failed = 0
+    for page, statements, rows, max_statements, max_rows in run(args.verbose):
+        ok = statements <= max_statements and rows <= max_rows
+        failed += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {page:18} {statements:3} statements (max {max_statements}), "
+              f"{rows:6} rows (max {max_rows})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
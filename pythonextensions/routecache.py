@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# ---- Route result cache ----------------------------------------------------
+# A shared link makes many clients ask for exactly the same routes. Finished
+# results (route geometries, costs and the rendered image or vector document)
+# are kept under a key made of the map's content hash and every option that
+# shapes the answer. Entries expire after a TTL; memory is an LRU with a byte
+# budget, and an optional disk tier (JSON metadata + body file, written
+# atomically like gridcache) survives restarts and is shared by processes.
+#
+# Concurrent requests for a key that is still being computed wait for the
+# one computation already running instead of starting their own
+# (single-flight); they get its result, or its exception.
+#
+# An entry can carry its own, shorter TTL: a result cut short by a time
+# budget is kept only long enough to absorb a burst of identical requests,
+# so a later request gets another chance at the full set of routes.
+
+DEFAULT_TTL = 3600                          # seconds
+PARTIAL_TTL = 30                            # seconds, for results cut short by a time budget
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024        # memory tier
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 * 1024  # disk tier, when enabled
+
+
+def route_key(map_key, options):
+    """Cache key for the routes of one map (e.g. gridcache.grid_key) under one set of options."""
+    items = sorted((k, repr(v)) for k, v in options.items())
+    return hashlib.sha256(repr((map_key, items)).encode()).hexdigest()
+
+
+class CachedRoute:
+    """
+    One finished computation: results as returned by pathfinder.main (list of dicts
+    with an (N,2) "path" and a "cost"), the response body and its mimetype, and the
+    search counters of the computation (see routestats.RouteStats.counters).
+    ttl: seconds to keep this entry, None for the cache's ttl (e.g. PARTIAL_TTL).
+    Shared between requests; do not modify.
+    """
+
+    def __init__(self, results, body, mimetype, counters=None, ttl=None):
+        self.results = results
+        self.body = body
+        self.mimetype = mimetype
+        self.counters = counters or {}
+        self.ttl = ttl
+        self.expires = None
+
+    @property
+    def nbytes(self):
+        return len(self.body) + sum(np.asarray(r["path"]).nbytes for r in self.results)
+
+
+def _jsonable(result):
+    return {k: (np.asarray(v).tolist() if k == "path" else v.item() if hasattr(v, "item") else v)
+            for k, v in result.items()}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class RouteCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, cache_dir=None,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        """
+        ttl: seconds an entry stays valid
+        max_bytes: memory budget (body + path arrays); least recently used entries go first
+        cache_dir: directory for the disk tier, None for memory only
+        max_disk_bytes: disk budget; the oldest files are removed when a put exceeds it
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._mem = OrderedDict()   # key -> CachedRoute
+        self._bytes = 0
+        self._inflight = {}         # key -> _Flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # -- memory tier --
+    def _forget(self, key):
+        # caller holds the lock
+        self._bytes -= self._mem.pop(key).nbytes
+
+    def _remember(self, key, entry):
+        # caller holds the lock
+        if key in self._mem:
+            self._forget(key)
+        if entry.nbytes > self.max_bytes:
+            return
+        self._mem[key] = entry
+        self._bytes += entry.nbytes
+        while self._bytes > self.max_bytes:
+            self._forget(next(iter(self._mem)))
+
+    def _get_memory(self, key):
+        # caller holds the lock
+        entry = self._mem.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.time():
+            self._forget(key)
+            return None
+        self._mem.move_to_end(key)
+        return entry
+
+    # -- disk tier --
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".json", base + ".body"
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("key") != key or meta["expires"] <= time.time():
+                return None
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            return None
+        results = [dict(r, path=np.asarray(r["path"], dtype=np.int32).reshape(-1, 2)) for r in meta["results"]]
+        entry = CachedRoute(results, body, meta["mimetype"], meta.get("counters"))
+        entry.expires = meta["expires"]
+        return entry
+
+    def _write_disk(self, key, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta_path, body_path = self._paths(key)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(body_path + suffix, "wb") as f:
+            f.write(entry.body)
+        os.replace(body_path + suffix, body_path)
+        meta = {"key": key, "expires": entry.expires, "mimetype": entry.mimetype,
+                "counters": entry.counters, "results": [_jsonable(r) for r in entry.results]}
+        with open(meta_path + suffix, "w") as f:
+            json.dump(meta, f)
+        # metadata last: a reader never finds metadata without its body
+        os.replace(meta_path + suffix, meta_path)
+        self._prune_disk()
+
+    def _prune_disk(self):
+        """Drop expired entries, then the oldest ones until the disk tier fits max_disk_bytes."""
+        files = []
+        now = time.time()
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith(".json"):
+                    try:
+                        st = e.stat()
+                        body = os.path.getsize(e.path[:-5] + ".body")
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, e.path, st.st_size + body))
+        files.sort()
+        total = sum(size for _, _, size in files)
+        for mtime, path, size in files:
+            if total <= self.max_disk_bytes and mtime + self.ttl > now:
+                continue
+            for p in (path, path[:-5] + ".body"):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+
+    # -- public --
+    def get(self, key):
+        """The cached entry for key or None. Memory first, then disk."""
+        with self._lock:
+            entry = self._get_memory(key)
+        if entry is None:
+            entry = self._read_disk(key)
+            if entry is not None:
+                with self._lock:
+                    self._remember(key, entry)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """Store entry (a CachedRoute) for its own ttl if set, else the cache's. Returns it."""
+        entry.expires = time.time() + (self.ttl if entry.ttl is None else min(entry.ttl, self.ttl))
+        with self._lock:
+            self._remember(key, entry)
+        if self.cache_dir is not None:
+            self._write_disk(key, entry)
+        return entry
+
+    def get_or_compute(self, key, compute, retry=()):
+        """
+        The entry for key, computing it with compute() -> CachedRoute on a miss.
+        Returns (entry, outcome) with outcome "hit", "miss" (computed here) or "shared"
+        (waited for a concurrent computation of the same key).
+        compute's exception reaches every waiting caller; exceptions of the types in
+        retry (e.g. a cancelled computation) make the waiters try again themselves.
+        """
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                return entry, "hit"
+            with self._lock:
+                entry = self._get_memory(key)   # stored since the get() above?
+                if entry is not None:
+                    return entry, "hit"
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._inflight[key] = _Flight()
+            if leader:
+                break
+            flight.done.wait()
+            if flight.error is None:
+                return flight.entry, "shared"
+            if not isinstance(flight.error, retry):
+                raise flight.error
+
+        try:
+            flight.entry = self.put(key, compute())
+            return flight.entry, "miss"
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def clear_memory(self):
+        with self._lock:
+            self._mem.clear()
+            self._bytes = 0
+
+    @property
+    def memory_bytes(self):
+        return self._bytes
+
+
+default_cache = RouteCache()
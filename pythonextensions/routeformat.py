@@ -0,0 +1,145 @@
+import json
+
+import numpy as np
+
+# ---- Vector route output -------------------------------------------------
+# Instead of a rendered image the routes can be returned as data for the
+# client to draw: plain JSON, a GeoJSON FeatureCollection, or JSON with each
+# route as an encoded polyline (Google's delta + varint scheme). Coordinates
+# are pixel centres of the map image, or latitude/longitude when the corner
+# coordinates of the image are given.
+
+VECTOR_FORMATS = {
+    "json": "application/json",
+    "geojson": "application/geo+json",
+    "polyline": "application/json",
+}
+# decimals kept for latitude/longitude (1e-5 deg is about 1 m)
+GEO_PRECISION = 5
+# decimals kept for pixel centres (x + 0.5, y + 0.5) in polylines
+PIXEL_PRECISION = 1
+
+
+class Georef:
+    """
+    Linear pixel -> (lat, lng) mapping for a north-up map image.
+    bounds: (north, west, south, east) of the image edges, shape: (h, w) of the grid.
+    """
+
+    def __init__(self, bounds, shape):
+        self.north, self.west, self.south, self.east = (float(b) for b in bounds)
+        self.h, self.w = shape
+
+    def to_latlng(self, points):
+        """(N,2) pixel (x,y) -> (N,2) float (lat, lng) of the pixel centres."""
+        p = np.asarray(points, dtype=np.float64).reshape(-1, 2) + 0.5
+        lat = self.north + (self.south - self.north) * p[:, 1] / self.h
+        lng = self.west + (self.east - self.west) * p[:, 0] / self.w
+        return np.column_stack((lat, lng))
+
+
+def _varint(value, out):
+    """Append one signed value as 5-bit chunks (Google polyline encoding)."""
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+def encode_polyline(points, precision=0):
+    """
+    Encode (N,2) coordinates as a polyline string: each point is the delta to the
+    previous one, scaled by 10**precision and varint-encoded. Pixel centres use
+    PIXEL_PRECISION, lat/lng uses GEO_PRECISION.
+    """
+    q = np.rint(np.asarray(points, dtype=np.float64).reshape(-1, 2) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    out = []
+    for a, b in deltas.tolist():
+        _varint(a, out)
+        _varint(b, out)
+    return "".join(out)
+
+def decode_polyline(s, precision=0):
+    """Inverse of encode_polyline. Returns an (N,2) array (int for precision 0)."""
+    values = []
+    value = shift = 0
+    for ch in s:
+        b = ord(ch) - 63
+        value |= (b & 0x1f) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    q = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0)
+    return q if precision == 0 else q / 10 ** precision
+
+
+def route_length(path):
+    """Euclidean length of a path in pixels."""
+    p = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+    if len(p) < 2:
+        return 0.0
+    return float(np.hypot(*np.diff(p, axis=0).T).sum())
+
+def _route_stats(i, r):
+    stats = {"route": i + 1, "cost": round(float(r["cost"]), 3), "length": round(route_length(r["path"]), 2),
+             "nodes": int(len(r["path"]))}
+    if "raw_nodes" in r:
+        stats["raw_nodes"] = int(r["raw_nodes"])
+    for end in ("start", "goal"):
+        if end in r:
+            stats[end] = [int(v) for v in r[end]]
+    return stats
+
+def _coords(path, georef):
+    """Pixel centres (x + 0.5, y + 0.5) of a path, or their (lat, lng) as in Georef.to_latlng."""
+    if georef is None:
+        return np.asarray(path, dtype=np.float64).reshape(-1, 2) + 0.5
+    return np.round(georef.to_latlng(path), GEO_PRECISION)
+
+def encode_routes(results, fmt, shape, bounds=None, extra=None):
+    """
+    Serialize main() results as fmt ("json", "geojson" or "polyline"). Returns bytes.
+
+    shape: (h, w) of the cost grid
+    bounds: optional (north, west, south, east) to output lat/lng instead of pixels
+    extra: optional dict of top-level fields to add (e.g. a batch's total cost)
+
+    json:     {"width", "height", "crs", "routes": [{stats..., "points": [[x,y], ...]}]}
+              points are pixel centres [x + 0.5, y + 0.5], or [lat, lng] when georeferenced
+    geojson:  FeatureCollection of LineStrings (RFC 7946, so no "crs" member);
+              coordinates are [lng, lat], or pixel centres [x, y] when not
+              georeferenced (e.g. for Leaflet's CRS.Simple)
+    polyline: as json, with "polyline" (see encode_polyline) and "precision" instead of points
+    """
+    if fmt not in VECTOR_FORMATS:
+        raise ValueError(f"Unknown vector format {fmt!r}")
+    h, w = shape
+    georef = None if bounds is None else Georef(bounds, shape)
+
+    if fmt == "geojson":
+        features = []
+        for i, r in enumerate(results):
+            coords = _coords(r["path"], georef)
+            if georef is not None:
+                coords = coords[:, ::-1]
+            features.append({"type": "Feature", "properties": _route_stats(i, r),
+                             "geometry": {"type": "LineString", "coordinates": coords.tolist()}})
+        doc = {"type": "FeatureCollection", "width": w, "height": h, "features": features}
+    else:
+        routes = []
+        precision = PIXEL_PRECISION if georef is None else GEO_PRECISION
+        for i, r in enumerate(results):
+            route = _route_stats(i, r)
+            coords = _coords(r["path"], georef)
+            if fmt == "polyline":
+                route["polyline"] = encode_polyline(coords, precision)
+                route["precision"] = precision
+            else:
+                route["points"] = coords.tolist()
+            routes.append(route)
+        doc = {"width": w, "height": h, "crs": "pixel" if georef is None else "EPSG:4326", "routes": routes}
+    if extra:
+        doc.update(extra)
+    return json.dumps(doc, separators=(",", ":")).encode()
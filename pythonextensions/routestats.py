@@ -0,0 +1,77 @@
+import time
+from contextlib import contextmanager
+
+# ---- Per-request route statistics ----------------------------------------
+# main() times its stages (grid build, searches, overlays, simplification,
+# rendering) and collects the search counters of a_star_array into a
+# RouteStats the caller passes in, next to the cache outcome of the map and
+# its cost grid. The web app turns it into a Server-Timing header (durations,
+# shown by browser dev tools and collected by most APM agents) and an
+# X-Route-Stats header with the counters. A response from the route cache
+# carries the counters of the computation that produced it, marked cache=hit.
+
+
+class RouteStats:
+    def __init__(self):
+        self.timings = {}    # stage -> seconds, summed over repeated stages
+        self.counters = {}   # e.g. expanded, pushes, peak_open (see pathfinder.a_star_array)
+        self.cache = {}      # "map"/"grid" -> "hit" or "miss", "route" -> "hit", "miss" or "shared"
+        self.total = None    # seconds for the whole request, if set
+
+    @contextmanager
+    def stage(self, name):
+        """Add the time spent in the with-block to stage name."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - t0
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def simplified(self, before, after):
+        """Record one route simplified from before to after nodes."""
+        self.count("raw_nodes", before)
+        self.count("nodes", after)
+
+    @property
+    def simplify_ratio(self):
+        """Simplified / raw node count over all routes (None if nothing was simplified)."""
+        raw = self.counters.get("raw_nodes")
+        return round(self.counters["nodes"] / raw, 4) if raw else None
+
+    def to_dict(self):
+        d = {"timings": {k: round(v, 6) for k, v in self.timings.items()},
+             "counters": dict(self.counters), "cache": dict(self.cache)}
+        if self.simplify_ratio is not None:
+            d["simplify_ratio"] = self.simplify_ratio
+        if self.total is not None:
+            d["total"] = round(self.total, 6)
+        return d
+
+    def server_timing(self):
+        """Server-Timing header value: one metric per stage (milliseconds), cache outcomes as desc."""
+        parts = [f"{name};dur={secs * 1000:.1f}" for name, secs in self.timings.items()]
+        parts += [f'{name}-cache;desc="{outcome}"' for name, outcome in self.cache.items()]
+        if self.total is not None:
+            parts.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def header(self):
+        """
+        Compact "name=value;..." form of the counters, e.g. for a response header;
+        ends with cache=<outcome> when the route cache was consulted.
+        """
+        items = dict(self.counters)
+        if self.simplify_ratio is not None:
+            items["simplify_ratio"] = self.simplify_ratio
+        if "route" in self.cache:
+            items["cache"] = self.cache["route"]
+        return ";".join(f"{k}={v}" for k, v in items.items())
+
+    def __str__(self):
+        parts = [f"{k} {v * 1000:.1f}ms" for k, v in self.timings.items()]
+        parts += [f"{k}={v}" for k, v in self.counters.items()]
+        parts += [f"{k} cache {v}" for k, v in self.cache.items()]
+        return "Stats: " + ", ".join(parts)
@@ -0,0 +1,57 @@
+import functools
+import http.server
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# importing app creates its tables; keep the tracked instance/carpool.db out of the tests
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+
+def random_grid(h, w, seed, blocked=0.25, dtype=np.float64):
+    """Cost grid with a few terrain costs and about `blocked` impassable cells; corners stay passable."""
+    rng = np.random.default_rng(seed)
+    grid = rng.choice([1.0, 1.5, 2.0, 5.0], size=(h, w))
+    grid[rng.random((h, w)) < blocked] = np.inf
+    for y, x in ((0, 0), (0, w - 1), (h - 1, 0), (h - 1, w - 1)):
+        grid[y, x] = 1.0
+    return grid.astype(dtype)
+
+
+def palette_image(h, w, seed, palette, noise=0.1):
+    """(h,w,3) uint8 image of palette colors, `noise` of the pixels jittered off the palette."""
+    rng = np.random.default_rng(seed)
+    colors = np.array(list(palette), dtype=np.int16)
+    rgb = colors[rng.integers(len(colors), size=(h, w))]
+    jitter = rng.random((h, w)) < noise
+    rgb[jitter] += rng.integers(-40, 41, size=(int(jitter.sum()), 3))
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    """
+    HTTP server for the files in a fresh directory (with Last-Modified, so repeat
+    fetches are conditional). Yields (directory, base url).
+    """
+    root = tmp_path / "srv"
+    root.mkdir()
+    handler = functools.partial(_QuietHandler, directory=str(root))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    try:
+        yield root, f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
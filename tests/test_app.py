@@ -0,0 +1,129 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pythonextensions import gridcache, mapfetch, routecache
+
+MAP_W, MAP_H = 60, 40
+WALL = (29, 29, 27)         # impassable in pathfinder.COLOR_COST_MAP
+
+
+@pytest.fixture
+def client(file_server, tmp_path, monkeypatch):
+    """Test client with fresh caches and a map served over HTTP (a wall at x=30, open below y=35)."""
+    import app
+
+    root, base = file_server
+    rgb = np.full((MAP_H, MAP_W, 3), 255, dtype=np.uint8)
+    rgb[:35, 30] = WALL
+    buf = BytesIO()
+    Image.fromarray(rgb).save(buf, format="PNG")
+    (root / "map.png").write_bytes(buf.getvalue())
+
+    monkeypatch.setattr(gridcache, "default_cache", gridcache.GridCache(cache_dir=str(tmp_path / "grids")))
+    monkeypatch.setattr(mapfetch, "default_fetcher", mapfetch.MapFetcher(cache_dir=str(tmp_path / "maps")))
+    monkeypatch.setattr(routecache, "default_cache", routecache.RouteCache())
+    client = app.app.test_client()
+    client.map_url = f"{base}/map.png"
+    return client
+
+
+def get_route(client, **params):
+    params.setdefault("url", client.map_url)
+    query = "&".join(f"{k}={v}" for k, v in params.items())
+    return client.get(f"/beregn_ruter?{query}")
+
+
+def test_route_as_json(client):
+    r = get_route(client, start="0,0", goal="59,0", k=1, format="json")
+    assert r.status_code == 200
+    doc = r.get_json()
+    assert (doc["width"], doc["height"]) == (MAP_W, MAP_H)
+    route = doc["routes"][0]
+    assert route["points"][0] == [0.5, 0.5] and route["points"][-1] == [59.5, 0.5]
+    assert "cache=miss" in r.headers["X-Route-Stats"]
+
+    again = get_route(client, start="0,0", goal="59,0", k=1, format="json")
+    assert again.data == r.data
+    assert "cache=hit" in again.headers["X-Route-Stats"]
+
+
+def test_route_as_image(client):
+    r = get_route(client, start="0,0", goal="59,0", k=2, format="png")
+    assert r.status_code == 200 and r.mimetype == "image/png"
+    assert Image.open(BytesIO(r.data)).size == (MAP_W, MAP_H)
+
+
+@pytest.mark.parametrize("params, message", [
+    (dict(start="0,0"), "Missing parameters"),
+    (dict(start="0", goal="5,5"), "start must be x,y"),
+    (dict(start="0,0", goal="a,b"), "goal must be x,y"),
+    (dict(start="0,0", goal="5,5", k=0), "k must be between"),
+    (dict(start="0,0", goal="5,5", k=6), "k must be between"),
+    (dict(start="0,0", goal="5,5", landmarks=17), "landmarks must be between"),
+    (dict(start="0,0", goal="5,5", format="gif"), "format must be one of"),
+    (dict(start="0,0", goal="5,5", simplify="spline"), "simplify must be one of"),
+    (dict(start="0,0", goal="5,5", quality=0), "quality must be between"),
+    (dict(start="0,0", goal="5,5", scale=2), "scale must be in"),
+    (dict(start="0,0", goal="5,5", bounds="1,2,3"), "bounds must be north,west,south,east"),
+    (dict(start="0,0", goal="5,5", bounds="1,2,3,nan"), "bounds must be north,west,south,east"),
+    (dict(start="0,0", goal="5,5", bounds="50,10,60,11"), "north > south"),
+    (dict(start="0,0", goal="5,5", viewport="10,0,5,5"), "viewport must be"),
+    (dict(start="0,0", goal="5,5", memreport="yes"), "memreport must be"),
+])
+def test_bad_parameters(client, params, message):
+    r = get_route(client, **params)
+    assert r.status_code == 400
+    assert message in r.get_data(as_text=True)
+
+
+@pytest.mark.parametrize("params, message", [
+    (dict(start="0,0", goal="60,0"), "outside the map"),
+    (dict(start="-1,0", goal="5,5"), "outside the map"),
+    (dict(start="0,0", goal="5,5", viewport="0,0,61,10"), "viewport must satisfy"),
+])
+def test_parameters_checked_against_the_map(client, params, message):
+    r = get_route(client, **params)
+    assert r.status_code == 400
+    assert message in r.get_data(as_text=True)
+
+
+def test_impassable_start(client):
+    r = get_route(client, start="30,0", goal="59,0", k=1)
+    assert r.status_code == 422
+
+
+def test_unreachable_map(client):
+    r = get_route(client, url=client.map_url.replace("map.png", "missing.png"), start="0,0", goal="5,5")
+    assert r.status_code == 502
+
+
+def test_batch(client):
+    r = client.post("/beregn_ruter/batch?format=json",
+                    json={"url": client.map_url, "points": [[0, 0], [59, 0], [59, 39]]})
+    assert r.status_code == 200
+    assert len(r.get_json()["routes"]) == 2
+    assert float(r.headers["X-Route-Total-Cost"]) > 0
+
+
+@pytest.mark.parametrize("body, message", [
+    ([[0, 0], [5, 5]], "body must be a JSON object"),
+    ({"points": [[0, 0], [5, 5]]}, "Missing parameters"),
+    ({"url": "URL", "points": [[0, 0]]}, "Need at least two points"),
+    ({"url": "URL", "points": [[0, 0, 1], [5, 5]]}, "pairs"),
+    ({"url": "URL", "points": [[0, 0], [60, 5]]}, "outside the map"),
+])
+def test_batch_bad_requests(client, body, message):
+    if isinstance(body, dict) and body.get("url") == "URL":
+        body = dict(body, url=client.map_url)
+    r = client.post("/beregn_ruter/batch", json=body)
+    assert r.status_code == 400
+    assert message in r.get_data(as_text=True)
+
+
+def test_job_rejects_bad_parameters(client):
+    r = client.post("/beregn_ruter/jobs", data={"url": client.map_url, "start": "0,0", "goal": "5,5", "k": 9})
+    assert r.status_code == 400
+    assert "k must be between" in r.get_json()["error"]
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from pythonextensions import gridcache, mapfetch, routecache
+from pythonextensions.pathfinder import RouteCancelled
+
+
+def route_entry(body=b"body", ttl=None):
+    results = [{"path": np.array([[0, 0], [1, 1], [2, 1]], dtype=np.int32), "cost": 2.5}]
+    return routecache.CachedRoute(results, body, "application/json", counters={"expanded": 7}, ttl=ttl)
+
+
+# -- gridcache --
+
+def test_grid_cache_round_trip(tmp_path):
+    cache = gridcache.GridCache(cache_dir=str(tmp_path))
+    grid = np.arange(12, dtype=np.float32).reshape(3, 4)
+    stored = cache.put("k", grid, name="grid32")
+    assert not stored.flags.writeable
+    np.testing.assert_array_equal(cache.get("k", name="grid32"), grid)
+    assert cache.get("k", name="other") is None
+    # a new process finds it on disk
+    np.testing.assert_array_equal(gridcache.GridCache(cache_dir=str(tmp_path)).get("k", name="grid32"), grid)
+
+
+def test_grid_cache_memory_only_put(tmp_path):
+    cache = gridcache.GridCache(cache_dir=str(tmp_path))
+    cache.put("k", np.ones(4), name="field", persist=False)
+    assert cache.get("k", name="field") is not None
+    assert gridcache.GridCache(cache_dir=str(tmp_path)).get("k", name="field") is None
+
+
+def test_grid_cache_memory_budget(tmp_path):
+    cache = gridcache.GridCache(cache_dir=str(tmp_path), max_bytes=100)
+    cache.put("a", np.ones(8), persist=False)     # 64 bytes
+    cache.put("b", np.ones(8), persist=False)
+    assert cache.memory_bytes <= 100
+    assert cache.get("a") is None and cache.get("b") is not None
+
+
+def test_grid_key_depends_on_palette():
+    key = gridcache.grid_key("abc", {(0, 0, 0): 1.0}, None)
+    assert key == gridcache.grid_key("abc", {(0, 0, 0): 1.0}, None)
+    assert key != gridcache.grid_key("abc", {(0, 0, 0): 2.0}, None)
+    assert key != gridcache.grid_key("abc", {(0, 0, 0): 1.0}, 20)
+
+
+# -- routecache --
+
+def test_route_key_depends_on_options():
+    assert routecache.route_key("m", {"k": 1, "field": False}) == routecache.route_key("m", {"field": False, "k": 1})
+    assert routecache.route_key("m", {"k": 1}) != routecache.route_key("m", {"k": 2})
+    assert routecache.route_key("m", {"k": 1}) != routecache.route_key("n", {"k": 1})
+
+
+def test_route_cache_hit_and_expiry():
+    cache = routecache.RouteCache(ttl=3600)
+    assert cache.get("k") is None
+    entry = cache.put("k", route_entry())
+    assert cache.get("k") is entry
+    assert (cache.hits, cache.misses) == (1, 1)
+    expired = routecache.RouteCache(ttl=0)
+    expired.put("k", route_entry())
+    assert expired.get("k") is None
+
+
+def test_route_cache_entry_ttl():
+    cache = routecache.RouteCache(ttl=3600)
+    partial = cache.put("p", route_entry(ttl=routecache.PARTIAL_TTL))
+    full = cache.put("f", route_entry())
+    now = time.time()
+    assert partial.expires - now == pytest.approx(routecache.PARTIAL_TTL, abs=5)
+    assert full.expires - now == pytest.approx(3600, abs=5)
+
+
+def test_route_cache_memory_budget():
+    one = route_entry().nbytes
+    cache = routecache.RouteCache(max_bytes=2 * one)
+    for key in "abc":
+        cache.put(key, route_entry())
+    assert cache.memory_bytes <= 2 * one
+    assert cache.get("a") is None and cache.get("c") is not None
+
+
+def test_route_cache_disk_tier(tmp_path):
+    routecache.RouteCache(cache_dir=str(tmp_path)).put("k", route_entry(b"png bytes"))
+    entry = routecache.RouteCache(cache_dir=str(tmp_path)).get("k")
+    assert entry.body == b"png bytes"
+    assert entry.mimetype == "application/json"
+    assert entry.counters == {"expanded": 7}
+    np.testing.assert_array_equal(entry.results[0]["path"], [[0, 0], [1, 1], [2, 1]])
+    assert entry.results[0]["cost"] == 2.5
+
+
+def test_get_or_compute_computes_once():
+    cache = routecache.RouteCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return route_entry()
+
+    first, outcome = cache.get_or_compute("k", compute)
+    assert outcome == "miss"
+    again, outcome = cache.get_or_compute("k", compute)
+    assert (again, outcome) == (first, "hit")
+    assert len(calls) == 1
+
+
+def test_get_or_compute_single_flight():
+    cache = routecache.RouteCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return route_entry()
+
+    outcomes = []
+    leader = threading.Thread(target=lambda: outcomes.append(cache.get_or_compute("k", compute)[1]))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: outcomes.append(cache.get_or_compute("k", compute)[1]))
+    follower.start()
+    time.sleep(0.1)     # the follower is waiting for the leader's flight
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert sorted(outcomes) == ["miss", "shared"]
+    assert len(calls) == 1
+
+
+def test_get_or_compute_retries_after_cancel():
+    cache = routecache.RouteCache()
+    started, release = threading.Event(), threading.Event()
+
+    def cancelled():
+        started.set()
+        release.wait(5)
+        raise RouteCancelled()
+
+    errors = []
+
+    def lead():
+        try:
+            cache.get_or_compute("k", cancelled, retry=(RouteCancelled,))
+        except RouteCancelled as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait(5)
+    result = []
+    follower = threading.Thread(
+        target=lambda: result.append(cache.get_or_compute("k", route_entry, retry=(RouteCancelled,))))
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 1
+    assert result[0][1] == "miss"       # computed by the follower itself
+
+
+def test_get_or_compute_shares_errors():
+    cache = routecache.RouteCache()
+
+    def fail():
+        raise ValueError("bad map")
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute("k", fail)
+    assert cache.get("k") is None
+
+
+# -- mapfetch --
+
+def test_map_fetch_revalidates_and_survives_prune(file_server, tmp_path):
+    root, base = file_server
+    (root / "map.png").write_bytes(b"not really a png" * 100)
+    fetcher = mapfetch.MapFetcher(cache_dir=str(tmp_path / "maps"))
+    first = fetcher.fetch(f"{base}/map.png")
+    assert not first.from_cache and first.data == b"not really a png" * 100
+
+    cached = fetcher.fetch(f"{base}/map.png")
+    assert cached.from_cache and cached.content_hash == first.content_hash
+    # a concurrent fetch pruned the body before it was read
+    os.remove(cached.path)
+    assert cached.data == first.data
+    assert os.path.exists(cached.path)
+
+
+def test_map_fetch_size_limit(file_server, tmp_path):
+    root, base = file_server
+    (root / "big.png").write_bytes(b"x" * 2048)
+    fetcher = mapfetch.MapFetcher(cache_dir=str(tmp_path / "maps"), max_bytes=1024)
+    with pytest.raises(mapfetch.MapTooLarge):
+        fetcher.fetch(f"{base}/big.png")
+
+
+def test_map_fetch_missing(file_server, tmp_path):
+    _, base = file_server
+    fetcher = mapfetch.MapFetcher(cache_dir=str(tmp_path / "maps"))
+    with pytest.raises(mapfetch.MapFetchError):
+        fetcher.fetch(f"{base}/nope.png")
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import pythonextensions.benchmark as bench
+import pythonextensions.overlap as ov
+import pythonextensions.pathfinder as pf
+from conftest import palette_image, random_grid
+
+
+@pytest.mark.parametrize("threshold", [None, 20])
+def test_vectorized_builder_matches_reference(threshold):
+    rgb = palette_image(40, 50, seed=1, palette=pf.COLOR_COST_MAP)
+    expected = pf.build_cost_grid(Image.fromarray(rgb), pf.COLOR_COST_MAP, threshold=threshold)
+    np.testing.assert_array_equal(pf.build_cost_grid_vectorized(rgb, pf.COLOR_COST_MAP, threshold), expected)
+    np.testing.assert_array_equal(
+        pf.build_cost_grid_vectorized(Image.fromarray(rgb), pf.COLOR_COST_MAP, threshold), expected)
+
+
+@pytest.mark.parametrize("threshold", [None, 20])
+def test_terrain_codes_match_reference(threshold):
+    rgb = palette_image(40, 50, seed=2, palette=pf.COLOR_COST_MAP)
+    expected = pf.build_cost_grid(Image.fromarray(rgb), pf.COLOR_COST_MAP, threshold=threshold)
+    codes, lut = pf.build_terrain_codes(rgb, pf.COLOR_COST_MAP, threshold)
+    assert codes.dtype == np.uint8
+    np.testing.assert_array_equal(pf.cost_grid_from_codes(codes, lut), expected.astype(np.float32))
+
+
+def test_penalty_overlay_matches_reference():
+    grid = random_grid(30, 40, seed=3)
+    first = pf.as_path_array(pf.a_star(grid, (0, 0), (39, 29))[0])
+    second = pf.as_path_array(pf.a_star(grid, (0, 29), (39, 0))[0])
+    expected = bench._reference_penalize(grid, first, 6.0, 4, 0.6)
+    expected = bench._reference_penalize(expected, second, 6.0, 4, 0.6)
+    overlay = ov.PenaltyOverlay(grid.shape, base_penalty=6.0, radius=4, decay=0.6)
+    got = overlay.sync([first]).sync([first, second]).apply(grid, out=np.empty_like(grid))
+    np.testing.assert_allclose(got, expected, rtol=1e-12)
+    assert np.array_equal(np.isinf(got), np.isinf(grid))
+
+
+def test_mask_overlay_matches_reference():
+    grid = random_grid(30, 40, seed=4)
+    path = pf.as_path_array(pf.a_star(grid, (0, 0), (39, 29))[0])
+    expected = bench._reference_mask(grid, path, 3)
+    got = ov.MaskOverlay(grid.shape, radius=3).sync([path]).apply(grid, keep=(path[0], path[-1]))
+    np.testing.assert_array_equal(got, expected)
+
+
+def test_fast_line_of_sight_simplifier_matches_reference():
+    grid = random_grid(40, 40, seed=5, blocked=0.15)
+    path, _ = pf.a_star(grid, (0, 0), (39, 39))
+    expected = pf.simplify_path(path, grid)
+    np.testing.assert_array_equal(pf.simplify_path_fast(path, grid), pf.as_path_array(expected))
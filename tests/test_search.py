@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+import pytest
+
+import pythonextensions.incremental as inc
+import pythonextensions.landmarks as lm
+import pythonextensions.overlap as ov
+import pythonextensions.pathfinder as pf
+from pythonextensions.hpa import AbstractGraph
+from conftest import random_grid
+
+SEEDS = [0, 1, 2, 3]
+
+
+def reference(grid, start, goal, diagonal=True):
+    """
+    Cost of the reference a_star (inf when there is no route). The grid is widened
+    to float64 first: a_star adds numpy scalars, which would stay float32, while
+    the searches under test add up in float64.
+    """
+    return pf.a_star(np.asarray(grid, dtype=np.float64), start, goal, diagonal)[1]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("diagonal", [True, False])
+def test_a_star_array_matches_a_star(seed, diagonal):
+    grid = random_grid(30, 40, seed)
+    expected_path, expected_cost = pf.a_star(grid, (0, 0), (39, 29), diagonal)
+    path, cost = pf.a_star_array(grid, (0, 0), (39, 29), diagonal)
+    assert cost == pytest.approx(expected_cost, rel=1e-12)
+    if expected_path is None:
+        assert path is None
+    else:
+        np.testing.assert_array_equal(pf.as_path_array(path), pf.as_path_array(expected_path))
+
+
+def test_a_star_array_float32_grid():
+    grid = random_grid(30, 40, seed=5, dtype=np.float32)
+    assert pf.a_star_array(grid, (0, 0), (39, 29))[1] == pytest.approx(reference(grid, (0, 0), (39, 29)), rel=1e-9)
+
+
+def test_a_star_array_no_route():
+    grid = np.ones((10, 10))
+    grid[:, 5] = np.inf
+    assert pf.a_star_array(grid, (0, 0), (9, 9)) == (None, math.inf)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_goal_field_matches_a_star(seed):
+    grid = random_grid(30, 40, seed)
+    dist, parent = pf.goal_field(grid, (39, 29))
+    for start in ((0, 0), (0, 29), (39, 0)):
+        path, cost = pf.path_from_field(dist, parent, start)
+        assert cost == pytest.approx(reference(grid, start, (39, 29)), rel=1e-6)   # float32 field
+        if path is not None:
+            assert pf.path_cost(grid, path) == pytest.approx(cost, rel=1e-6)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_incremental_planner_matches_a_star(seed):
+    grid = random_grid(30, 40, seed, dtype=np.float32)
+    goal = (39, 29)
+    planner = inc.IncrementalPlanner(grid, goal)
+    for start in ((0, 0), (0, 29), (39, 0), (0, 0)):
+        assert planner.plan(start)[1] == pytest.approx(reference(grid, start, goal), rel=1e-9)
+
+    # cost changes are repaired on the next plan()
+    changed = np.array(grid)
+    rng = np.random.default_rng(seed)
+    cells = rng.choice(grid.size, size=60, replace=False)
+    values = rng.choice([1.0, 9.0, np.inf], size=60).astype(np.float32)
+    values[np.isin(cells, [0, grid.size - 1])] = 1.0     # keep start and goal passable
+    changed.reshape(-1)[cells] = values
+    planner.set_costs(cells, values)
+    assert planner.plan((0, 0))[1] == pytest.approx(reference(changed, (0, 0), goal), rel=1e-9)
+
+    # an overlay reverts to the base costs when it is replaced
+    planner = inc.IncrementalPlanner(grid, goal)
+    planner.apply_overlay(cells, values)
+    planner.apply_overlay(np.zeros(0, dtype=np.int64), [])
+    assert planner.plan((0, 0))[1] == pytest.approx(reference(grid, (0, 0), goal), rel=1e-9)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_landmark_heuristic_keeps_costs(seed):
+    grid = random_grid(30, 40, seed, dtype=np.float32)
+    _, dists = lm.select_landmarks(grid, n=4)
+    for start, goal in (((0, 0), (39, 29)), ((39, 0), (0, 29))):
+        heuristic = lm.heuristic_for(dists, goal)
+        expected = reference(grid, start, goal)
+        assert pf.a_star_array(grid, start, goal, heuristic=heuristic)[1] == pytest.approx(expected, rel=1e-9)
+
+        # penalties only raise costs, so the bound stays admissible on a penalised grid
+        path = pf.as_path_array(pf.a_star(grid, start, goal)[0])
+        if path is None:
+            continue
+        penalised = ov.PenaltyOverlay(grid.shape, base_penalty=6.0, radius=3, decay=0.6).sync([path]).apply(grid)
+        assert pf.a_star_array(penalised, start, goal, heuristic=heuristic)[1] == pytest.approx(
+            reference(penalised, start, goal), rel=1e-9)
+
+
+def test_landmark_heuristic_is_admissible():
+    grid = random_grid(30, 40, seed=7, dtype=np.float32)
+    _, dists = lm.select_landmarks(grid, n=4)
+    goal = (39, 29)
+    exact, _ = pf.dijkstra(grid, goal)
+    heuristic = lm.heuristic_for(dists, goal)
+    reachable = np.isfinite(exact)
+    assert np.all(heuristic[reachable] <= exact[reachable] * (1 + 1e-9))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_hpa_exact_matches_a_star(seed):
+    grid = random_grid(40, 48, seed, blocked=0.2)
+    graph = AbstractGraph.build(grid, cluster_size=8)
+    for start, goal in (((0, 0), (47, 39)), ((47, 0), (0, 39))):
+        expected = reference(grid, start, goal)
+        path, cost = graph.find_path(start, goal, exact=True)
+        assert cost == pytest.approx(expected, rel=1e-9)
+        if path is not None:
+            assert pf.path_cost(grid, path) == pytest.approx(cost, rel=1e-9)
+        # the corridor route is never better than the optimum
+        assert graph.find_path(start, goal)[1] >= expected * (1 - 1e-9)
+
+
+def test_hpa_rejects_impassable_endpoints():
+    grid = random_grid(16, 16, seed=8)
+    grid[5, 5] = np.inf
+    graph = AbstractGraph.build(grid, cluster_size=8)
+    with pytest.raises(ValueError, match="Start is impassable"):
+        graph.find_path((5, 5), (15, 15))
+
+
+def test_main_takes_options_or_keywords():
+    rgb = np.full((20, 30, 3), 255, dtype=np.uint8)
+    opts = pf.RouteOptions(k=1, use_cache=False, image_format="json", return_image=True)
+    results, body = pf.main(rgb, (0, 0), (29, 19), opts)
+    assert results[0]["cost"] == pytest.approx(reference(np.ones((20, 30)), (0, 0), (29, 19)), rel=1e-9)
+    assert pf.main(rgb, (0, 0), (29, 19), use_cache=False, k=1, image_format="json", return_image=True)[1] == body
+    # keywords override the options object
+    assert pf.main(rgb, (0, 0), (29, 19), opts, image_format="geojson")[1] != body
+    with pytest.raises(TypeError):
+        pf.main(rgb, (0, 0), (29, 19), opts, no_such_option=1)